@@ -0,0 +1,83 @@
+"""
+Measures the client side overhead of each LLM request, against a local stub of the OpenAI API.
+
+Sends the same procedure table requests through the current SqlCodeParser, which keeps one LlmBackend with
+pooled keep-alive connections and prompts compiled once, and through the previous implementation, which
+created a new ChatOpenAI client and rebuilt the prompt templates for every request.  The stub server answers
+immediately, so the time per request is the client side overhead plus a round trip to localhost.
+
+Usage:
+    python -m benchmarks.llm_overhead_benchmark [--requests 1000] [--concurrency 1 8]
+"""
+import argparse
+import time
+
+import openai
+from langchain.chat_models import ChatOpenAI
+
+from test_support.fake_llm import approximate_token_count
+from test_support.stub_openai_server import StubOpenAiServer
+from lib.llm_backend import LlmBackend
+from lib.sql_code_parser import SqlCodeParser
+
+PROCEDURE_CODE = 'CREATE PROCEDURE "Proc{i}" @ID int\nAS\nSELECT "Name" FROM "Orders" WHERE "ID" = @ID\nGO'
+
+
+class LegacyLlmBackend(LlmBackend):
+    """
+    The previous way of sending requests, which created a new ChatOpenAI client for every request.
+    """
+
+    def get_chat_model(self):
+        return ChatOpenAI(model=self.model_name, temperature=0, verbose=True, openai_api_base=self.openai_api_base, openai_api_key=self.openai_api_key)
+
+
+class LegacySqlCodeParser(SqlCodeParser):
+    """
+    The previous implementation of find_tables_manipulated_by_procedure, which rebuilt the prompt templates
+    for every request.
+    """
+
+    def find_tables_manipulated_by_procedure(self, procedure_name, sql_code):
+        chat_prompt = self._procedure_tables_prompt()
+        return self._get_json_completion(chat_prompt.format_prompt(procedure_name=procedure_name, sql_code_fragment=sql_code).to_messages(), 'procedure_tables')
+
+
+def create_parser(legacy, api_base, concurrency):
+    options = dict(source_directory='.', use_cache=False, debug=False, max_concurrency=concurrency, count_tokens=approximate_token_count,
+                   result_cache_file_name=':memory:', use_table_access_analyzer=False)
+    if legacy:
+        # The openai package's default, a session for each thread.
+        openai.requestssession = None
+        return LegacySqlCodeParser(llm_backend=LegacyLlmBackend(openai_api_base=api_base, openai_api_key='stub'), **options)
+    backend = LlmBackend(max_connections=concurrency, openai_api_base=api_base, openai_api_key='stub')
+    return SqlCodeParser(llm_backend=backend, **options)
+
+
+def time_requests(legacy, number_of_requests, concurrency):
+    with StubOpenAiServer() as server:
+        parser = create_parser(legacy, server.api_base, concurrency)
+        procedures = [(f"Proc{i}", PROCEDURE_CODE.format(i=i)) for i in range(number_of_requests)]
+        start = time.perf_counter()
+        for _ in parser.dispatcher.map(lambda procedure: parser.find_tables_manipulated_by_procedure(*procedure), procedures):
+            pass
+        elapsed = time.perf_counter() - start
+        parser.llm_backend.close()
+        return elapsed, server.requests, server.connections
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the client side overhead of each LLM request')
+    parser.add_argument('--requests', type=int, default=1000, help='the number of requests to send')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8], help='the numbers of requests to send at the same time')
+    args = parser.parse_args()
+
+    print(f"{'implementation':<10} {'concurrency':>11} {'requests':>9} {'connections':>12} {'seconds':>8} {'ms/request':>11} {'requests/s':>11}")
+    for concurrency in args.concurrency:
+        for name, legacy in [('previous', True), ('current', False)]:
+            elapsed, requests, connections = time_requests(legacy, args.requests, concurrency)
+            print(f"{name:<10} {concurrency:>11} {requests:>9} {connections:>12} {elapsed:8.2f} {1000 * elapsed / requests:11.2f} {requests / elapsed:11.0f}")
+
+
+if __name__ == '__main__':
+    main()
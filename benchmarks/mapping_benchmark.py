@@ -0,0 +1,111 @@
+"""
+Micro-benchmark for the procedure to table mapping stage, with the LLM stubbed out.
+
+Builds a synthetic catalogue of procedures and times StoredProcedureToTableMapper._execute_mapping,
+comparing it with the previous implementation, which filtered the procedures by name and grew the
+output data frame with pd.concat for every row.
+
+Usage:
+    python -m benchmarks.mapping_benchmark [--procedures 50000] [--legacy-procedures 2000 5000]
+"""
+import argparse
+import re
+import time
+
+import pandas as pd
+
+from lib.stored_procedure_to_table_mapper import StoredProcedureToTableMapper
+
+
+class StubSqlCodeParser:
+    """
+    Stands in for the SqlCodeParser, answering from the procedure code instead of asking the LLM.
+    """
+
+    def find_procedure_declaration(self, procedure_name, sql_code):
+        match = re.search(r'(CREATE PROCEDURE +?"?%s"?.+?(\nGO|$))' % re.escape(procedure_name), sql_code, re.DOTALL | re.IGNORECASE)
+        return match.group(1) if match else None
+
+    def find_tables_manipulated_by_procedure(self, procedure_name, sql_code):
+        return [
+            {"table_name": table_name, "sql_operation": sql_operation}
+            for sql_operation, table_name in re.findall(r'^(SELECT|INSERT|UPDATE|DELETE) .*?"(\w+)"', sql_code, re.MULTILINE)
+        ]
+
+    find_tables_with_llm = find_tables_manipulated_by_procedure
+
+    def find_tables_locally(self, procedures):
+        return {}
+
+
+def make_catalogue(number_of_procedures, number_of_tables=500):
+    """
+    Returns a DDL statements data frame with one CREATE PROCEDURE row per procedure, and a few tables.
+    """
+    rows = []
+    for i in range(number_of_tables):
+        rows.append({'db_object_name': f"Table{i}", 'sql_operation': 'CREATE TABLE', 'sql_code': f'CREATE TABLE "Table{i}" ("ID" int)\nGO\n'})
+    for i in range(number_of_procedures):
+        read_table = f"Table{i % number_of_tables}"
+        write_table = f"Table{(i * 7) % number_of_tables}"
+        sql_code = (
+            f'CREATE PROCEDURE "Proc{i}" @ID int\nAS\n'
+            f'SELECT * FROM "{read_table}" WHERE ID = @ID\n'
+            f'UPDATE "{write_table}" SET Name = \'x\' WHERE ID = @ID\n'
+            f'GO\n'
+        )
+        rows.append({'db_object_name': f"Proc{i}", 'sql_operation': 'CREATE PROCEDURE', 'sql_code': sql_code})
+    return pd.DataFrame(rows)
+
+
+def legacy_execute_mapping(mapper, ddl_df):
+    """
+    The previous implementation of StoredProcedureToTableMapper._execute_mapping.
+    """
+    procedures_ds = ddl_df[ddl_df['sql_operation'] == 'CREATE PROCEDURE']
+    procedure_names = procedures_ds['db_object_name'].tolist()
+    output_df = pd.DataFrame(columns=['table_name', 'sql_operation', 'operation_type', 'procedure_name'])
+    for procedure_name in procedure_names:
+        sql_code = procedures_ds[procedures_ds['db_object_name'] == procedure_name]['sql_code'].values[0]
+        procedure_code = mapper.sql_code_parser.find_procedure_declaration(procedure_name, sql_code)
+        tables = mapper.sql_code_parser.find_tables_manipulated_by_procedure(procedure_name, procedure_code)
+        for table in tables:
+            new_row = pd.DataFrame([{
+                'table_name': table['table_name'],
+                'sql_operation': table['sql_operation'],
+                'operation_type': mapper._map_sql_operation_to_read_write(table['sql_operation']),
+                'procedure_name': procedure_name
+            }])
+            output_df = pd.concat([output_df, new_row], ignore_index=True)
+    return output_df
+
+
+def time_mapping(execute_mapping, number_of_procedures):
+    mapper = StoredProcedureToTableMapper(StubSqlCodeParser(), use_cache=False)
+    ddl_df = make_catalogue(number_of_procedures)
+    start = time.perf_counter()
+    result = execute_mapping(mapper, ddl_df)
+    elapsed = time.perf_counter() - start
+    print(f"{number_of_procedures:>8} procedures  {len(result):>8} rows  {elapsed:8.2f}s  {number_of_procedures / elapsed:10.0f} procedures/s")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the procedure to table mapping stage')
+    parser.add_argument('--procedures', type=int, default=50000, help='the number of procedures in the synthetic catalogue')
+    parser.add_argument('--legacy-procedures', type=int, nargs='*', default=[2000, 5000],
+                        help='catalogue sizes to run the previous implementation with; it is quadratic, so keep these small')
+    args = parser.parse_args()
+
+    print("Current implementation:")
+    for number_of_procedures in sorted({args.procedures // 10, args.procedures}):
+        time_mapping(lambda mapper, ddl_df: mapper._execute_mapping(ddl_df), number_of_procedures)
+
+    if args.legacy_procedures:
+        print("Previous implementation:")
+        for number_of_procedures in args.legacy_procedures:
+            time_mapping(legacy_execute_mapping, number_of_procedures)
+
+
+if __name__ == '__main__':
+    main()
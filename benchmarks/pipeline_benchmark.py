@@ -0,0 +1,264 @@
+"""
+End-to-end benchmark of the pipeline, run offline with a fake LLM.
+
+For each schema size, a synthetic schema is generated and run through the parse, map, cluster and render
+stages, with the FakeChatModel in place of the OpenAI chat model and a no-op in place of PlantUML.  Each size
+is run in a fresh process, so that the memory figures of one size don't include those of the last.
+
+For each stage it reports the time taken, the throughput, and the peak resident memory of the process at
+the end of the stage along with how much the stage raised it.  The LLM request count and token counts are
+taken from the run's Instrumentation.
+
+The results can be saved as a baseline, and are compared with the saved baseline on later runs, e.g.
+
+    python -m benchmarks.pipeline_benchmark --sizes 10 1000 10000 --save-baseline
+    python -m benchmarks.pipeline_benchmark --sizes 10 1000 10000 --fail-on-regression
+
+Timings only compare well between runs on the same machine with the same settings.
+"""
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from test_support.fake_llm import FakeChatModel, approximate_token_count
+from test_support.synthetic_schema import write_schema
+from lib.clustering import MiniBatchKMeansBackend
+from lib.diagram_generator import DiagramGenerator
+from lib.graph_service_extractor import GraphServiceExtractor
+from lib.instrumentation import Instrumentation, peak_memory_bytes
+from lib.service_extractor import ServiceExtractor
+from lib.sql_code_parser import SqlCodeParser
+from lib.stored_procedure_to_table_mapper import StoredProcedureToTableMapper
+
+STAGES = ['parse', 'map', 'cluster', 'render']
+BASELINE_FILE_NAME = os.path.join(os.path.dirname(__file__), 'baselines', 'pipeline_benchmark.json')
+
+
+def create_extractor(name, tables_df):
+    if name == 'graph':
+        return GraphServiceExtractor(tables_df)
+    if name == 'minibatch':
+        return ServiceExtractor(tables_df, clustering_backend=MiniBatchKMeansBackend())
+    return ServiceExtractor(tables_df)
+
+
+def _peak_rss():
+    peak_memory = peak_memory_bytes()
+    return peak_memory['self'] if peak_memory else None
+
+
+@contextlib.contextmanager
+def measure(stages, name, items):
+    """
+    Records the time taken by a stage, its throughput in items per second and its peak memory use.
+    """
+    rss_before = _peak_rss()
+    start = time.perf_counter()
+    yield
+    seconds = time.perf_counter() - start
+    rss_after = _peak_rss()
+    stages[name] = {
+        'seconds': seconds,
+        'items': items,
+        'items_per_second': items / seconds if seconds > 0 else None,
+        'peak_rss_bytes': rss_after,
+        'peak_rss_growth_bytes': rss_after - rss_before if rss_after is not None else None,
+    }
+
+
+def run_pipeline(number_of_procedures, settings):
+    """
+    Runs the pipeline over a synthetic schema with number_of_procedures procedures and as many tables.
+    Returns the measurements of each stage and of the run as a whole.
+    """
+    with tempfile.TemporaryDirectory() as work_directory:
+        source_directory = os.path.join(work_directory, 'source')
+        write_schema(source_directory, number_of_procedures, seed=settings['seed'])
+
+        instrumentation = Instrumentation()
+        chat_model = FakeChatModel(latency=settings['latency'], jitter=settings['jitter'], seed=settings['seed'])
+        stages = {}
+        output = io.StringIO()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(output if not settings['verbose'] else sys.stdout):
+            parser = SqlCodeParser(
+                source_directory=source_directory,
+                use_cache=False,
+                debug=False,
+                cache_file_name=os.path.join(work_directory, 'parsed_code_cache.parquet'),
+                result_cache_file_name=os.path.join(work_directory, 'llm_result_cache.sqlite'),
+                max_concurrency=settings['max_concurrency'],
+                chat_model=chat_model,
+                use_ddl_recognizer=settings['use_ddl_recognizer'],
+                use_table_access_analyzer=settings['use_table_access_analyzer'],
+                count_tokens=approximate_token_count,
+                instrumentation=instrumentation)
+            with measure(stages, 'parse', 2 * number_of_procedures):
+                ddl_df = parser.find_ddl_statements()
+
+            mapper = StoredProcedureToTableMapper(
+                parser,
+                use_cache=False,
+                batch_token_budget=settings['batch_token_budget'],
+                cache_file_name=os.path.join(work_directory, 'tables_to_procs_cache.parquet'),
+                instrumentation=instrumentation)
+            with measure(stages, 'map', number_of_procedures):
+                tables_df = mapper.map_procedures_to_tables(ddl_df)
+
+            extractor = create_extractor(settings['extractor'], tables_df)
+            extractor.cache_file_name = os.path.join(work_directory, 'service_candidates_cache.csv')
+            with measure(stages, 'cluster', number_of_procedures):
+                service_definitions = extractor.extract()
+
+            diagram_directory = os.path.join(work_directory, 'diagrams')
+            os.makedirs(diagram_directory)
+            generator = DiagramGenerator(
+                output_directory=diagram_directory,
+                use_cache=False,
+                run=lambda cmd, check: None,
+                instrumentation=instrumentation)
+            with measure(stages, 'render', len(service_definitions)):
+                generator.generate(service_definitions)
+        seconds = time.perf_counter() - start
+
+        llm = instrumentation.report()['llm']
+        return {
+            'procedures': number_of_procedures,
+            'tables': number_of_procedures,
+            'ddl_statements': len(ddl_df),
+            'table_map_rows': len(tables_df),
+            'services': len(service_definitions),
+            'stages': stages,
+            'total': {
+                'seconds': seconds,
+                'procedures_per_second': number_of_procedures / seconds,
+                'peak_rss_bytes': _peak_rss(),
+            },
+            'llm': {
+                'requests': llm['count'],
+                'prompt_tokens': llm['prompt_tokens'],
+                'completion_tokens': llm['completion_tokens'],
+            },
+        }
+
+
+def run_in_fresh_process(number_of_procedures, settings):
+    # Spawn rather than fork, so the peak memory of each run starts from a clean interpreter.
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(run_pipeline, number_of_procedures, settings).result()
+
+
+def _megabytes(value):
+    return f"{value / (1 << 20):8.1f}" if value is not None else "       -"
+
+
+def print_result(result):
+    print(f"\n{result['procedures']} procedures, {result['tables']} tables: {result['ddl_statements']} DDL statements, "
+          f"{result['table_map_rows']} table map rows, {result['services']} services, {result['llm']['requests']} LLM requests, "
+          f"{result['llm']['prompt_tokens']} prompt tokens, {result['llm']['completion_tokens']} completion tokens")
+    print(f"  {'stage':<8} {'seconds':>9} {'items/s':>12} {'peak MB':>8} {'+MB':>8}")
+    for name in STAGES:
+        stage = result['stages'][name]
+        items_per_second = f"{stage['items_per_second']:12.0f}" if stage['items_per_second'] else "           -"
+        print(f"  {name:<8} {stage['seconds']:9.3f} {items_per_second} {_megabytes(stage['peak_rss_bytes'])} {_megabytes(stage['peak_rss_growth_bytes'])}")
+    total = result['total']
+    print(f"  {'total':<8} {total['seconds']:9.3f} {total['procedures_per_second']:12.0f} {_megabytes(total['peak_rss_bytes'])}")
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """
+    Prints how each stage compares with the baseline, and returns the stages that are slower than the
+    baseline by more than the tolerance, e.g. 0.25 for 25%.
+    """
+    if baseline['settings'] != results['settings']:
+        print("\nThe baseline was measured with different settings, so it isn't compared:")
+        print(f"  baseline: {baseline['settings']}")
+        return []
+
+    regressions = []
+    print(f"\nCompared with the baseline measured on {baseline['measured_on']} (time taken, current / baseline):")
+    for size, result in results['sizes'].items():
+        if size not in baseline['sizes']:
+            continue
+        baseline_result = baseline['sizes'][size]
+        ratios = []
+        for name in STAGES + ['total']:
+            current_seconds = result['total']['seconds'] if name == 'total' else result['stages'][name]['seconds']
+            baseline_seconds = baseline_result['total']['seconds'] if name == 'total' else baseline_result['stages'][name]['seconds']
+            ratio = current_seconds / baseline_seconds if baseline_seconds > 0 else 1.0
+            ratios.append(f"{name} {ratio:.2f}x")
+            # Ignore tiny stages, whose timings are mostly noise.
+            if ratio > 1 + tolerance and current_seconds - baseline_seconds > 0.05:
+                regressions.append(f"{size} procedures, {name}: {current_seconds:.3f}s against {baseline_seconds:.3f}s")
+        print(f"  {size:>7} procedures: {', '.join(ratios)}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline end to end, offline, with a fake LLM')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000],
+                        help='the numbers of procedures (and tables) in the synthetic schemas, up to 100000')
+    parser.add_argument('--latency', type=float, default=0.0, help='the delay of each fake LLM request, in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='a random extra delay of up to this many seconds for each request')
+    parser.add_argument('--max-concurrency', type=int, default=1, help='the number of requests to send to the fake LLM at the same time')
+    parser.add_argument('--batch-token-budget', type=int, default=None, help='pack several procedures into each mapping request')
+    parser.add_argument('--extractor', choices=['graph', 'minibatch', 'kmeans'], default='graph',
+                        help='the service extractor; the kmeans extractor is only practical for small schemas')
+    parser.add_argument('--no-ddl-recognizer', action='store_true', help='send every code fragment to the fake LLM')
+    parser.add_argument('--no-table-access-analyzer', action='store_true', help='send every procedure to the fake LLM for mapping')
+    parser.add_argument('--seed', type=int, default=0, help='the seed for the synthetic schemas and the fake LLM jitter')
+    parser.add_argument('--baseline-file', default=BASELINE_FILE_NAME, help='the file to save the baseline to and compare with')
+    parser.add_argument('--save-baseline', action='store_true', help='save the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='how much slower than the baseline a stage can be, e.g. 0.25 for 25%%')
+    parser.add_argument('--fail-on-regression', action='store_true', help='exit with an error if a stage is slower than the baseline')
+    parser.add_argument('--results-file', default=None, help='also write the results to this JSON file')
+    parser.add_argument('--verbose', action='store_true', help='show the output of the pipeline stages')
+    args = parser.parse_args()
+
+    settings = {
+        'latency': args.latency,
+        'jitter': args.jitter,
+        'max_concurrency': args.max_concurrency,
+        'batch_token_budget': args.batch_token_budget,
+        'extractor': args.extractor,
+        'use_ddl_recognizer': not args.no_ddl_recognizer,
+        'use_table_access_analyzer': not args.no_table_access_analyzer,
+        'seed': args.seed,
+        'verbose': args.verbose,
+    }
+    results = {'settings': settings, 'measured_on': time.strftime('%Y-%m-%d'), 'cpu_count': os.cpu_count(), 'sizes': {}}
+    for number_of_procedures in args.sizes:
+        result = run_in_fresh_process(number_of_procedures, settings)
+        results['sizes'][str(number_of_procedures)] = result
+        print_result(result)
+
+    if args.results_file:
+        with open(args.results_file, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    regressions = []
+    if os.path.exists(args.baseline_file) and not args.save_baseline:
+        with open(args.baseline_file) as file:
+            regressions = compare_with_baseline(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"Slower than the baseline: {regression}")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline_file), exist_ok=True)
+        with open(args.baseline_file, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f"\nThe baseline has been saved to {args.baseline_file}")
+
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Measures how the local, CPU bound stages of the pipeline scale with the number of worker processes.
+
+Writes a synthetic schema of about the given size, then times, for each number of workers, the
+classification of the code fragments, the building of the procedure index and the static analysis
+of the procedures, with a fake LLM and no caches.  The results of each run are checked against
+those of a single worker.
+
+Usage:
+    python -m benchmarks.scaling_benchmark [--megabytes 1024] [--workers 1 2 4 8 16] [--directory DIR]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from test_support.fake_llm import FakeChatModel, approximate_token_count
+from test_support.synthetic_schema import write_schema
+from lib.procedure_index import ProcedureIndex
+from lib.sql_code_parser import SqlCodeParser
+from lib.worker_pool import WorkerPool
+
+# The approximate size of a CREATE TABLE and a CREATE PROCEDURE statement of the synthetic schema.
+BYTES_PER_PROCEDURE = 520
+
+
+def time_stages(directory, workers):
+    """
+    Runs the local stages with the number of workers, and returns their times and results.
+    """
+    with tempfile.TemporaryDirectory() as cache_directory, WorkerPool(workers) as worker_pool:
+        parser = SqlCodeParser(
+            source_directory=os.path.join(directory, "source"),
+            use_cache=False,
+            debug=False,
+            cache_file_name=os.path.join(cache_directory, "ddl.parquet"),
+            result_cache_file_name=os.path.join(cache_directory, "results.sqlite"),
+            chat_model=FakeChatModel(),
+            count_tokens=approximate_token_count,
+            streaming=True,
+            worker_pool=worker_pool,
+        )
+        times = {}
+        start = time.perf_counter()
+        ddl_df = parser.find_ddl_statements()
+        times['classify'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        index = ProcedureIndex.build(parser.source_directory, worker_pool=worker_pool)
+        times['index'] = time.perf_counter() - start
+
+        procedures = ddl_df[ddl_df['sql_operation'] == 'CREATE PROCEDURE']
+        procedures = [(name, parser.find_procedure_declaration(name, sql_code)) for name, sql_code in zip(procedures['db_object_name'], procedures['sql_code'])]
+        start = time.perf_counter()
+        tables = parser.find_tables_locally(procedures)
+        times['analyze'] = time.perf_counter() - start
+    return times, (ddl_df, index.locations, tables)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure how the local stages scale with the number of worker processes')
+    parser.add_argument('--megabytes', type=int, default=1024, help='the approximate size of the synthetic schema')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8, 16], help='the numbers of worker processes to try')
+    parser.add_argument('--directory', default=None, help='write the schema here and keep it, rather than in a temporary directory')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        directory = args.directory or temporary_directory
+        number_of_procedures = args.megabytes * 1024 * 1024 // BYTES_PER_PROCEDURE
+        source_directory = os.path.join(directory, "source")
+        if not os.path.exists(source_directory):
+            write_schema(source_directory, number_of_procedures)
+        size = sum(entry.stat().st_size for entry in os.scandir(source_directory))
+        print(f"{size / 2 ** 20:.0f}MB of SQL code, {os.cpu_count()} CPUs")
+        print(f"{'workers':>8} {'classify':>10} {'index':>10} {'analyze':>10} {'total':>10} {'speedup':>8}")
+
+        serial_total = None
+        serial_results = None
+        for workers in args.workers:
+            times, results = time_stages(directory, workers)
+            total = sum(times.values())
+            if serial_results is None:
+                serial_total, serial_results = total, results
+            else:
+                assert results[0].equals(serial_results[0]) and results[1:] == serial_results[1:], f"The results with {workers} workers differ"
+            print(f"{workers:>8} {times['classify']:>9.2f}s {times['index']:>9.2f}s {times['analyze']:>9.2f}s {total:>9.2f}s {serial_total / total:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""
+Measures how long the pipeline takes to start, and how long a fully cached run of main.py takes.
+
+The import time of each module is measured in a fresh interpreter.  For the cached run, the caches are
+primed in a temporary working directory by running the same stages as main.py --graph-services, with the
+FakeChatModel in place of the OpenAI chat model.  The graph service extractor is used because its services
+are the same on every run, unlike the clusters of the default extractor.  Then main.py --graph-services is
+run there with the caches warm, and the heavy libraries that it loaded are listed; a cached run shouldn't
+need any of them.  A no-op plantuml command is put first on the PATH, so PlantUML needn't be installed.
+
+Usage:
+    python -m benchmarks.startup_benchmark [--procedures 10000] [--repeat 5]
+
+By default the sample SQL Server code is used, otherwise a synthetic schema with that many procedures.
+"""
+import argparse
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+
+from test_support.fake_llm import FakeChatModel, approximate_token_count
+from test_support.synthetic_schema import write_schema
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = [
+    'lib.sql_code_parser',
+    'lib.stored_procedure_to_table_mapper',
+    'lib.service_extractor',
+    'lib.graph_service_extractor',
+    'lib.clustering',
+    'lib.incremental_updater',
+    'lib.multi_dialect_driver',
+    'lib.diagram_generator',
+]
+HEAVY_MODULES = ['langchain', 'openai', 'tiktoken', 'sklearn', 'scipy', 'joblib', 'requests']
+
+MAIN_ARGUMENTS = ['--graph-services']
+
+# Runs main.py, then lists the heavy modules that were imported.
+RUN_MAIN = """
+import runpy, sys
+sys.argv = sys.argv[1:]
+runpy.run_path(sys.argv[0], run_name='__main__')
+print('Heavy modules imported:', ','.join(m for m in {heavy_modules!r} if m in sys.modules) or 'none', file=sys.stderr)
+"""
+
+
+def best_time(command, repeat, **kwargs):
+    """
+    Returns the shortest time taken to run the command, and the output of the last run.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        completed = subprocess.run(command, capture_output=True, text=True, check=True, **kwargs)
+        times.append(time.perf_counter() - start)
+    return min(times), completed
+
+
+# A stand in for PlantUML, which writes an empty image for each diagram.
+NO_OP_PLANTUML = """#!{python}
+import os, sys
+for path in sys.argv[1:]:
+    if path.endswith('.puml'):
+        open(os.path.splitext(path)[0] + '.png', 'w').close()
+"""
+
+
+def write_no_op_plantuml(directory):
+    """
+    Writes the no-op plantuml command to the directory, and returns its path.
+    """
+    os.makedirs(directory)
+    path = os.path.join(directory, 'plantuml')
+    with open(path, 'w') as file:
+        file.write(NO_OP_PLANTUML.format(python=sys.executable))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return path
+
+
+def prime_caches(work_directory, procedures, plantuml_command):
+    """
+    Runs the stages of main.py --graph-services in the working directory, with the same cache files and
+    settings, so that a run of main.py --graph-services there finds every cache warm.
+    """
+    from lib.dependency_graph import DependencyGraph
+    from lib.diagram_generator import DiagramGenerator
+    from lib.graph_service_extractor import GraphServiceExtractor
+    from lib.sql_code_parser import SqlCodeParser
+    from lib.stored_procedure_to_table_mapper import StoredProcedureToTableMapper
+
+    source_directory = os.path.join(work_directory, 'source_code', 'sql_server')
+    if procedures:
+        write_schema(source_directory, procedures)
+    else:
+        shutil.copytree(os.path.join(REPOSITORY_DIRECTORY, 'source_code', 'sql_server'), source_directory)
+    os.makedirs(os.path.join(work_directory, 'results'))
+
+    current_directory = os.getcwd()
+    os.chdir(work_directory)
+    try:
+        parser = SqlCodeParser(source_directory="source_code/sql_server", debug=False, chat_model=FakeChatModel(), count_tokens=approximate_token_count)
+        ddl_df = parser.find_ddl_statements()
+        mapper = StoredProcedureToTableMapper(parser)
+        tables_df = mapper.map_procedures_to_tables(ddl_df)
+        service_definitions = GraphServiceExtractor(tables_df, use_cache=True).extract()
+        DiagramGenerator(plantuml_command=plantuml_command).generate(service_definitions)
+        dependency_graph = DependencyGraph.build(ddl_df, tables_df, service_definitions, procedure_code_by_name=mapper.find_procedure_code(ddl_df))
+        dependency_graph.save(fingerprint=DependencyGraph.fingerprint(parser.source_fingerprint(), tables_df, service_definitions))
+    finally:
+        os.chdir(current_directory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the startup time and the time taken by a fully cached run')
+    parser.add_argument('--procedures', type=int, default=None, help='use a synthetic schema with this many procedures')
+    parser.add_argument('--repeat', type=int, default=5, help='the number of times to run each command; the best time is reported')
+    args = parser.parse_args()
+
+    print("Import time, in a fresh interpreter:")
+    baseline, _ = best_time([sys.executable, '-c', 'pass'], args.repeat)
+    print(f"  {'python':<40} {baseline:6.3f}s")
+    for module in MODULES:
+        seconds, _ = best_time([sys.executable, '-c', f'import {module}'], args.repeat, cwd=REPOSITORY_DIRECTORY)
+        print(f"  {module:<40} {seconds:6.3f}s")
+    seconds, _ = best_time([sys.executable, 'main.py', '--help'], args.repeat, cwd=REPOSITORY_DIRECTORY)
+    print(f"  {'main.py --help':<40} {seconds:6.3f}s")
+
+    with tempfile.TemporaryDirectory() as work_directory:
+        plantuml_directory = os.path.join(work_directory, 'bin')
+        plantuml_command = write_no_op_plantuml(plantuml_directory)
+        print("\nPriming the caches...")
+        prime_caches(work_directory, args.procedures, plantuml_command)
+        environment = dict(os.environ, PYTHONPATH=REPOSITORY_DIRECTORY, PATH=plantuml_directory + os.pathsep + os.environ.get('PATH', ''))
+        command = [sys.executable, '-c', RUN_MAIN.format(heavy_modules=HEAVY_MODULES), os.path.join(REPOSITORY_DIRECTORY, 'main.py'), *MAIN_ARGUMENTS]
+        seconds, completed = best_time(command, args.repeat, cwd=work_directory, env=environment)
+        print(f"Fully cached run of main.py: {seconds:.3f}s")
+        print(completed.stderr.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    main()
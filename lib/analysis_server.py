@@ -0,0 +1,265 @@
+import json
+import re
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import pandas as pd
+
+from lib.catalogue_index import CatalogueIndex, TableAccess
+from lib.dependency_graph import DependencyGraph
+
+
+class AnalysisServer:
+    """
+    A long running local HTTP server that keeps the results of the pipeline in memory, so that tools can
+    query them without running main.py again.
+
+    The DDL statements, the procedure to table map and the services are held in a CatalogueIndex, and each
+    query is answered from it, e.g.
+
+        GET  /tables/Orders/services?operation=write    the services that write to the Orders table
+        GET  /procedures/CustOrdersDetail/tables         the tables used by the CustOrdersDetail procedure
+        GET  /tables/Orders/procedures                   the procedures that use the Orders table
+        GET  /procedures/CustOrdersDetail/service        the service of the CustOrdersDetail procedure
+        GET  /services, /services/<name>                 the services
+        GET  /objects/<name>                             the DDL statements for a database object
+        GET  /objects/<name>/impact                      everything that depends on a table, view or procedure
+        GET  /services/<name>/impact                     everything that depends on a service
+        GET  /stats                                      the size of the catalogue and the last update
+        POST /update                                     reload the source files and update the catalogue
+
+    An update parses the source files again, which only sends new or changed code to the LLM, and then
+    updates the services with the incremental_updater, which only maps the new or changed procedures.  The
+    queries are answered from the old index until the new one is ready.  Updates run one at a time.
+
+    The impact queries are answered from a DependencyGraph, which is rebuilt along with the catalogue, on
+    the worker_pool if one is given, and saved to the dependency_graph_directory after each update.
+
+    The server only listens on localhost, as it has no authentication.
+    """
+
+    DEFAULT_PORT = 8765
+
+    def __init__(self, sql_code_parser, incremental_updater, host="127.0.0.1", port=DEFAULT_PORT, diagram_generator=None,
+                 worker_pool=None, dependency_graph_directory=DependencyGraph.DEFAULT_DIRECTORY) -> None:
+        self.sql_code_parser = sql_code_parser
+        self.incremental_updater = incremental_updater
+        self.host = host
+        self.port = port
+        self.diagram_generator = diagram_generator
+        self.worker_pool = worker_pool
+        self.dependency_graph_directory = dependency_graph_directory
+        self.index = None
+        self.dependency_graph = None
+        self.last_update = None
+        self.update_lock = threading.Lock()
+        self.http_server = None
+        self.routes = [
+            ('GET', r'/stats', self._statistics),
+            ('GET', r'/services', self._services),
+            ('GET', r'/services/(?P<name>[^/]+)', self._service),
+            ('GET', r'/objects/(?P<name>[^/]+)', self._object_statements),
+            ('GET', r'/objects/(?P<name>[^/]+)/impact', self._object_impact),
+            ('GET', r'/services/(?P<name>[^/]+)/impact', self._service_impact),
+            ('GET', r'/procedures/(?P<name>[^/]+)/tables', self._tables_used_by_procedure),
+            ('GET', r'/procedures/(?P<name>[^/]+)/service', self._service_of_procedure),
+            ('GET', r'/tables/(?P<name>[^/]+)/procedures', self._procedures_using_table),
+            ('GET', r'/tables/(?P<name>[^/]+)/services', self._services_using_table),
+            ('POST', r'/update', self._update),
+        ]
+
+
+    def load(self, ddl_df, tables_df, service_definitions, dependency_graph=None):
+        """
+        Replaces the catalogue and the dependency graph with the results of a run of the pipeline.
+        The dependency graph is built from them unless one is given.
+        """
+        if dependency_graph is None:
+            dependency_graph = DependencyGraph.build(
+                ddl_df, tables_df, service_definitions, procedure_code_by_name=self.incremental_updater.mapper.find_procedure_code(ddl_df),
+                worker_pool=self.worker_pool)
+        self.dependency_graph = dependency_graph
+        self.index = CatalogueIndex(ddl_df, tables_df, service_definitions)
+
+
+    def update(self):
+        """
+        Parses the source files again, updates the services and replaces the catalogue.
+        Returns a summary of the procedures that changed.
+        """
+        with self.update_lock:
+            start = time.perf_counter()
+            self.sql_code_parser.reload_sources()
+            ddl_df = self.sql_code_parser.find_ddl_statements()
+            service_definitions = self.incremental_updater.update(ddl_df)
+            tables_df = self.incremental_updater.tables_df
+            if tables_df is None:
+                tables_df = pd.DataFrame(columns=TableAccess._fields)
+            if self.diagram_generator is not None:
+                self.diagram_generator.generate(service_definitions)
+            self.load(ddl_df, tables_df, service_definitions)
+            self.dependency_graph.save(self.dependency_graph_directory)
+            self.last_update = {
+                'changed_procedures': list(self.incremental_updater.changed_procedures),
+                'removed_procedures': list(self.incremental_updater.removed_procedures),
+                'seconds': time.perf_counter() - start,
+                'finished_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            }
+            return self.last_update
+
+
+    @staticmethod
+    def _operation_type(query):
+        operation_type = query.get('operation', [None])[0]
+        return operation_type.upper() if operation_type else None
+
+
+    @staticmethod
+    def _service_definition(service_definition):
+        return {
+            'service_name': service_definition.service_name,
+            'procs': list(service_definition.procs),
+            'read_tables': list(service_definition.read_tables),
+            'write_tables': list(service_definition.write_tables),
+        }
+
+
+    def _statistics(self, index, query):
+        return {**index.statistics(), 'last_update': self.last_update}
+
+
+    def _services(self, index, query):
+        return [self._service_definition(service_definition) for service_definition in index.services.values()]
+
+
+    def _service(self, index, query, name):
+        return self._service_definition(index.service(name))
+
+
+    def _object_statements(self, index, query, name):
+        return index.object_statements(name)
+
+
+    def _object_impact(self, index, query, name):
+        return self.dependency_graph.impact(name)
+
+
+    def _service_impact(self, index, query, name):
+        return self.dependency_graph.impact(name, kind='SERVICE')
+
+
+    def _tables_used_by_procedure(self, index, query, name):
+        return [access._asdict() for access in index.tables_used_by_procedure(name, self._operation_type(query))]
+
+
+    def _service_of_procedure(self, index, query, name):
+        return {'procedure_name': name, 'service_name': index.service_of_procedure(name)}
+
+
+    def _procedures_using_table(self, index, query, name):
+        return [access._asdict() for access in index.procedures_using_table(name, self._operation_type(query))]
+
+
+    def _services_using_table(self, index, query, name):
+        return index.services_using_table(name, self._operation_type(query))
+
+
+    def _update(self, index, query):
+        return self.update()
+
+
+    def handle(self, method, url):
+        """
+        Answers a request, returning the HTTP status and the JSON response.
+        """
+        parts = urlsplit(url)
+        path = parts.path.rstrip('/') or '/'
+        query = parse_qs(parts.query)
+        index = self.index
+        for route_method, pattern, handler in self.routes:
+            match = re.fullmatch(pattern, path)
+            if not match:
+                continue
+            if route_method != method:
+                return 405, {'error': f"{method} is not supported for {path}"}
+            if index is None and handler != self._update:
+                return 503, {'error': "The catalogue hasn't been loaded yet"}
+            arguments = {name: unquote(value) for name, value in match.groupdict().items()}
+            try:
+                return 200, handler(index, query, **arguments)
+            except KeyError as e:
+                if handler == self._update:
+                    raise
+                return 404, {'error': e.args[0]}
+            except ValueError as e:
+                if handler == self._update:
+                    raise
+                return 400, {'error': str(e)}
+        return 404, {'error': f"Unknown path: {path}"}
+
+
+    def start(self):
+        """
+        Starts answering requests on a background thread.
+        """
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                # Send the headers and the body without waiting for an acknowledgement in between.
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def _respond(self, method):
+                if int(self.headers.get('Content-Length', 0)):
+                    self.rfile.read(int(self.headers['Content-Length']))
+                try:
+                    status, payload = server.handle(method, self.path)
+                except Exception as e:
+                    status, payload = 500, {'error': f"{type(e).__name__}: {e}"}
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self._respond('GET')
+
+            def do_POST(self):
+                self._respond('POST')
+
+            def log_message(self, format, *args):
+                pass
+
+        self.http_server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.http_server.daemon_threads = True
+        self.port = self.http_server.server_address[1]
+        threading.Thread(target=self.http_server.serve_forever, daemon=True).start()
+        print(f"Serving the catalogue on http://{self.host}:{self.port}")
+
+
+    def stop(self):
+        if self.http_server is not None:
+            self.http_server.shutdown()
+            self.http_server.server_close()
+            self.http_server = None
+
+
+    def serve_forever(self):
+        """
+        Answers requests until interrupted.
+        """
+        self.start()
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            print("Stopping the server.")
+        finally:
+            self.stop()
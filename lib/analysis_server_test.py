@@ -0,0 +1,95 @@
+import json
+import urllib.error
+import urllib.request
+import pytest
+from lib.analysis_server import AnalysisServer
+from lib.dependency_graph import DependencyGraph
+from lib.graph_service_extractor import GraphServiceExtractor
+from lib.incremental_updater import IncrementalUpdater
+from lib.sql_code_parser import SqlCodeParser
+from test_support.fake_llm import FakeTableChatModel, approximate_token_count
+
+
+def write_source(source_directory, procedures):
+    code = "".join(
+        f"CREATE PROCEDURE {name} AS\nUPDATE Table{service} SET X = 1\nSELECT * FROM Lookup{service}\nGO\n\n"
+        for name, service in procedures.items())
+    (source_directory / "procs.sql").write_text(code)
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.setattr(GraphServiceExtractor, 'CACHE_FILE_NAME', str(tmp_path / "services.csv"))
+    source_directory = tmp_path / "source"
+    source_directory.mkdir()
+    write_source(source_directory, {f"S{service}P{p}": service for service in range(3) for p in range(4)})
+    chat_model = FakeTableChatModel()
+    parser = SqlCodeParser(
+        source_directory=str(source_directory),
+        debug=False,
+        cache_file_name=str(tmp_path / "cache.parquet"),
+        result_cache_file_name=str(tmp_path / "results.sqlite"),
+        chat_model=chat_model,
+        count_tokens=approximate_token_count,
+        use_table_access_analyzer=False,
+    )
+    updater = IncrementalUpdater(parser, results_directory=str(tmp_path), create_service_extractor=GraphServiceExtractor)
+    server = AnalysisServer(parser, updater, port=0, dependency_graph_directory=str(tmp_path / "dependency_graph"))
+    server.update()
+    server.chat_model = chat_model
+    server.source_directory = source_directory
+    return server
+
+
+def test_queries(server):
+    assert server.handle('GET', '/tables/Table1/services?operation=write') == (200, ['Table1'])
+    status, tables = server.handle('GET', '/procedures/S1P2/tables')
+    assert status == 200
+    assert {(table['table_name'], table['operation_type']) for table in tables} == {('Table1', 'WRITE'), ('Lookup1', 'READ')}
+    assert server.handle('GET', '/procedures/S1P2/service') == (200, {'procedure_name': 'S1P2', 'service_name': 'Table1'})
+    status, procedures = server.handle('GET', '/tables/Lookup2/procedures')
+    assert sorted(procedure['procedure_name'] for procedure in procedures) == [f"S2P{p}" for p in range(4)]
+    assert server.handle('GET', '/objects/S0P0') == (200, [{'db_object_name': 'S0P0', 'sql_operation': 'CREATE PROCEDURE'}])
+    assert server.handle('GET', '/stats')[1]['procedures'] == 12
+
+
+def test_impact_queries(server):
+    status, impact = server.handle('GET', '/objects/Lookup1/impact')
+    assert status == 200
+    assert impact['procedures'] == [f"S1P{p}" for p in range(4)]
+    assert impact['services'] == ['Table1']
+    assert server.handle('GET', '/services/Table1/impact')[1]['procedures'] == []
+    assert server.handle('GET', '/objects/Missing/impact') == (404, {'error': 'Unknown database object: Missing'})
+
+
+def test_errors(server):
+    assert server.handle('GET', '/procedures/Missing/tables') == (404, {'error': 'Unknown procedure: Missing'})
+    assert server.handle('GET', '/nothing')[0] == 404
+    assert server.handle('GET', '/update')[0] == 405
+    assert server.handle('GET', '/tables/Table1/services?operation=foo') == (
+        400, {'error': "Unknown operation type: FOO, expected one of READ, WRITE"})
+
+
+def test_update_only_maps_the_changed_procedures(server):
+    calls = server.chat_model.calls
+    write_source(server.source_directory, {**{f"S{service}P{p}": service for service in range(3) for p in range(4)}, "S1P9": 1})
+
+    status, summary = server.handle('POST', '/update')
+    assert status == 200
+    assert summary['changed_procedures'] == ['S1P9']
+    assert server.chat_model.calls == calls + 1
+    assert server.handle('GET', '/procedures/S1P9/service') == (200, {'procedure_name': 'S1P9', 'service_name': 'Table1'})
+    assert DependencyGraph.load(server.dependency_graph_directory).impact('Lookup1')['procedures'] == [f"S1P{p}" for p in (0, 1, 2, 3, 9)]
+
+
+def test_http(server):
+    server.start()
+    try:
+        url = f"http://{server.host}:{server.port}"
+        with urllib.request.urlopen(f"{url}/services/Table0") as response:
+            assert sorted(set(json.load(response)['procs'])) == [f"S0P{p}" for p in range(4)]
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(f"{url}/services/Missing")
+        assert error.value.code == 404
+    finally:
+        server.stop()
@@ -0,0 +1,135 @@
+from collections import namedtuple
+
+from lib.service_definition import ServiceDefinition, unique_service_names
+
+# A table operation of a procedure, e.g. TableAccess('Orders', 'UPDATE', 'WRITE', 'UpdateOrder').
+TableAccess = namedtuple('TableAccess', ['table_name', 'sql_operation', 'operation_type', 'procedure_name'])
+
+
+def index_key(name):
+    """
+    Returns the key that a database object name is indexed by.
+
+    Names are matched ignoring case, quotes and brackets, and spaces match underscores, since the service
+    extractor replaces the spaces in names with underscores.
+    """
+    return str(name).strip().strip('[]"').replace(' ', '_').lower()
+
+
+class CatalogueIndex:
+    """
+    An in-memory index of the DDL statements, the procedure to table map and the services, for answering
+    queries such as "which services write to table X" or "which tables does procedure Y use" without
+    scanning the data frames.
+
+    The index is built once from the results of the pipeline, and is read only afterwards, so it can be
+    shared by the threads answering queries.  To update it, build a new index and replace the old one.
+
+    Services that share a name are indexed under the names given by unique_service_names, e.g. Orders and
+    Orders_2, so that neither hides the other.
+    """
+
+    OPERATION_TYPES = ('READ', 'WRITE')
+
+    def __init__(self, ddl_df, tables_df, service_definitions) -> None:
+        self.statements_by_object = {}
+        for db_object_name, sql_operation in zip(ddl_df['db_object_name'], ddl_df['sql_operation']):
+            statements = self.statements_by_object.setdefault(index_key(db_object_name), [])
+            statement = {'db_object_name': db_object_name, 'sql_operation': sql_operation}
+            if statement not in statements:
+                statements.append(statement)
+
+        self.accesses_by_procedure = {}
+        self.accesses_by_table = {}
+        columns = [tables_df[column] for column in TableAccess._fields]
+        for access in map(TableAccess._make, zip(*columns)):
+            self.accesses_by_procedure.setdefault(index_key(access.procedure_name), []).append(access)
+            self.accesses_by_table.setdefault(index_key(access.table_name), []).append(access)
+
+        self.services = {}
+        self.service_by_procedure = {}
+        self.services_by_table = {'READ': {}, 'WRITE': {}}
+        for service_name, service_definition in zip(unique_service_names(service_definitions), service_definitions):
+            if service_name != service_definition.service_name:
+                service_definition = ServiceDefinition(service_name, service_definition.procs, service_definition.read_tables,
+                                                       service_definition.write_tables)
+            self.services[index_key(service_name)] = service_definition
+            for procedure_name in service_definition.procs:
+                self.service_by_procedure[index_key(procedure_name)] = service_definition.service_name
+            for operation_type, table_names in [('READ', service_definition.read_tables), ('WRITE', service_definition.write_tables)]:
+                for table_name in table_names:
+                    services = self.services_by_table[operation_type].setdefault(index_key(table_name), [])
+                    if service_definition.service_name not in services:
+                        services.append(service_definition.service_name)
+
+
+    @staticmethod
+    def _lookup(index, name, kind):
+        try:
+            return index[index_key(name)]
+        except KeyError:
+            raise KeyError(f"Unknown {kind}: {name}") from None
+
+
+    @classmethod
+    def _check_operation_type(cls, operation_type):
+        if operation_type is not None and operation_type not in cls.OPERATION_TYPES:
+            raise ValueError(f"Unknown operation type: {operation_type}, expected one of {', '.join(cls.OPERATION_TYPES)}")
+
+
+    def statistics(self):
+        return {
+            'db_objects': len(self.statements_by_object),
+            'procedures': len(self.accesses_by_procedure),
+            'tables': len(self.accesses_by_table),
+            'services': len(self.services),
+        }
+
+
+    def object_statements(self, name):
+        """
+        Returns the DDL statements for the database object.
+        """
+        return self._lookup(self.statements_by_object, name, 'database object')
+
+
+    def tables_used_by_procedure(self, name, operation_type=None):
+        """
+        Returns the table operations of the procedure, optionally only the READ or WRITE operations.
+        """
+        self._check_operation_type(operation_type)
+        accesses = self._lookup(self.accesses_by_procedure, name, 'procedure')
+        return [access for access in accesses if operation_type is None or access.operation_type == operation_type]
+
+
+    def procedures_using_table(self, name, operation_type=None):
+        """
+        Returns the operations of the procedures on the table, optionally only the READ or WRITE operations.
+        """
+        self._check_operation_type(operation_type)
+        accesses = self._lookup(self.accesses_by_table, name, 'table')
+        return [access for access in accesses if operation_type is None or access.operation_type == operation_type]
+
+
+    def services_using_table(self, name, operation_type=None):
+        """
+        Returns the names of the services that read or write the table, or only those that do one or the other.
+        """
+        self._check_operation_type(operation_type)
+        key = index_key(name)
+        if key not in self.accesses_by_table and not any(key in services for services in self.services_by_table.values()):
+            raise KeyError(f"Unknown table: {name}")
+        services = []
+        for operation in [operation_type] if operation_type else ['WRITE', 'READ']:
+            for service_name in self.services_by_table[operation].get(key, []):
+                if service_name not in services:
+                    services.append(service_name)
+        return services
+
+
+    def service(self, name):
+        return self._lookup(self.services, name, 'service')
+
+
+    def service_of_procedure(self, name):
+        return self._lookup(self.service_by_procedure, name, 'procedure')
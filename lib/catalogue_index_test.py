@@ -0,0 +1,78 @@
+import pandas as pd
+import pytest
+from lib.catalogue_index import CatalogueIndex
+from lib.service_definition import ServiceDefinition
+
+
+@pytest.fixture
+def index():
+    ddl_df = pd.DataFrame({
+        'db_object_name': ['Order Details', 'Orders', 'CustOrdersDetail', 'Orders'],
+        'sql_operation': ['CREATE TABLE', 'CREATE TABLE', 'CREATE PROCEDURE', 'DROP TABLE'],
+    })
+    tables_df = pd.DataFrame([
+        {'table_name': 'Order Details', 'sql_operation': 'SELECT', 'operation_type': 'READ', 'procedure_name': 'CustOrdersDetail'},
+        {'table_name': 'Orders', 'sql_operation': 'UPDATE', 'operation_type': 'WRITE', 'procedure_name': 'UpdateOrder'},
+        {'table_name': 'Orders', 'sql_operation': 'SELECT', 'operation_type': 'READ', 'procedure_name': 'CustOrdersDetail'},
+    ])
+    service_definitions = [
+        ServiceDefinition('Orders', ['UpdateOrder'], [], ['Orders']),
+        ServiceDefinition('Order_Details', ['CustOrdersDetail', 'CustOrdersDetail'], ['Order_Details', 'Orders'], []),
+    ]
+    return CatalogueIndex(ddl_df, tables_df, service_definitions)
+
+
+def test_tables_used_by_procedure(index):
+    accesses = index.tables_used_by_procedure('custordersdetail')
+    assert [(access.table_name, access.operation_type) for access in accesses] == [('Order Details', 'READ'), ('Orders', 'READ')]
+    assert index.tables_used_by_procedure('CustOrdersDetail', 'WRITE') == []
+
+
+def test_procedures_using_table(index):
+    assert [access.procedure_name for access in index.procedures_using_table('[Orders]', 'WRITE')] == ['UpdateOrder']
+
+
+def test_services_using_table_match_names_with_underscores(index):
+    assert index.services_using_table('Orders', 'WRITE') == ['Orders']
+    assert index.services_using_table('Orders') == ['Orders', 'Order_Details']
+    assert index.services_using_table('Order Details', 'READ') == ['Order_Details']
+    assert index.services_using_table('Order Details', 'WRITE') == []
+
+
+def test_services_and_objects(index):
+    assert index.service_of_procedure('UpdateOrder') == 'Orders'
+    assert index.service('order details').procs == ('CustOrdersDetail',)
+    assert index.object_statements('Orders') == [
+        {'db_object_name': 'Orders', 'sql_operation': 'CREATE TABLE'},
+        {'db_object_name': 'Orders', 'sql_operation': 'DROP TABLE'},
+    ]
+    assert index.statistics() == {'db_objects': 3, 'procedures': 2, 'tables': 2, 'services': 2}
+
+
+def test_unknown_names_raise_key_error(index):
+    with pytest.raises(KeyError, match="Unknown procedure: Missing"):
+        index.tables_used_by_procedure('Missing')
+    with pytest.raises(KeyError, match="Unknown table: Missing"):
+        index.services_using_table('Missing')
+
+
+def test_unknown_operation_types_raise_value_error(index):
+    with pytest.raises(ValueError, match="Unknown operation type: FOO"):
+        index.services_using_table('Orders', 'FOO')
+    with pytest.raises(ValueError, match="Unknown operation type: FOO"):
+        index.procedures_using_table('Orders', 'FOO')
+
+
+def test_services_that_share_a_name_are_kept_apart():
+    tables_df = pd.DataFrame(columns=['table_name', 'sql_operation', 'operation_type', 'procedure_name'])
+    service_definitions = [
+        ServiceDefinition('Orders', ['UpdateOrder'], [], ['Orders']),
+        ServiceDefinition('Orders', ['InsertOrder'], [], ['Orders']),
+    ]
+    index = CatalogueIndex(pd.DataFrame(columns=['db_object_name', 'sql_operation']), tables_df, service_definitions)
+
+    assert index.service('Orders').procs == ('UpdateOrder',)
+    assert index.service('Orders_2').procs == ('InsertOrder',)
+    assert index.service_of_procedure('InsertOrder') == 'Orders_2'
+    assert index.services_using_table('Orders', 'WRITE') == ['Orders', 'Orders_2']
+    assert index.statistics()['services'] == 2
@@ -0,0 +1,66 @@
+import pandas as pd
+
+# Columns with only a few distinct values, which are stored as dictionary encoded categories.
+CATEGORICAL_COLUMNS = ['dialect', 'sql_operation', 'operation_type']
+
+
+def chunks_file_name(file_name):
+    """
+    Returns the name of the file holding the code chunks for a DDL statements file.
+    """
+    base_name = file_name[:-len('.parquet')] if file_name.endswith('.parquet') else file_name
+    return f"{base_name}.chunks.parquet"
+
+
+def _with_categories(df):
+    for column in CATEGORICAL_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype('category')
+    return df
+
+
+def write_ddl_statements(file_name, ddl_df):
+    """
+    Writes the DDL statements data frame to Parquet files.
+
+    Many statements come from the same code chunk, so the chunk text is stored once, in a separate file,
+    and the statements refer to it by chunk_id.
+    """
+    chunk_ids, chunks = pd.factorize(ddl_df['sql_code'], use_na_sentinel=False)
+    statements_df = _with_categories(ddl_df.drop(columns='sql_code'))
+    statements_df['chunk_id'] = chunk_ids.astype('int32')
+    statements_df.to_parquet(file_name, index=False)
+    pd.DataFrame({'sql_code': pd.Series(chunks, dtype=object)}).to_parquet(chunks_file_name(file_name), index=False)
+
+
+def read_ddl_statements(file_name, columns=None):
+    """
+    Reads a DDL statements data frame written by write_ddl_statements.
+
+    Only the columns asked for are read, and the code chunks are only read if the sql_code column is asked
+    for, so e.g. reading just the object names and operations doesn't load the code at all.
+    """
+    statement_columns = None if columns is None else [column for column in columns if column != 'sql_code']
+    if columns is None or 'sql_code' in columns:
+        statements_df = pd.read_parquet(file_name, columns=None if statement_columns is None else statement_columns + ['chunk_id'])
+        chunks = pd.read_parquet(chunks_file_name(file_name))['sql_code'].to_numpy()
+        statements_df['sql_code'] = chunks[statements_df.pop('chunk_id').to_numpy()]
+        if columns is not None:
+            statements_df = statements_df[columns]
+        return statements_df
+
+    return pd.read_parquet(file_name, columns=statement_columns)
+
+
+def write_table_map(file_name, tables_df):
+    """
+    Writes a procedure to table map data frame to a Parquet file.
+    """
+    _with_categories(tables_df.copy()).to_parquet(file_name, index=False)
+
+
+def read_table_map(file_name, columns=None):
+    """
+    Reads a procedure to table map data frame written by write_table_map, optionally only some of the columns.
+    """
+    return pd.read_parquet(file_name, columns=columns)
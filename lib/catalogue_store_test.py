@@ -0,0 +1,56 @@
+import os
+import pandas as pd
+from lib.catalogue_store import chunks_file_name, read_ddl_statements, read_table_map, write_ddl_statements, write_table_map
+
+
+def make_ddl_df():
+    chunks = [f"CREATE TABLE A{i} (ID int)\nGO\nCREATE TABLE B{i} (ID int)\nGO\n" for i in range(3)]
+    return pd.DataFrame({
+        'db_object_name': [f"{name}{i}" for i in range(3) for name in "AB"],
+        'sql_operation': ["CREATE TABLE"] * 6,
+        'sql_code': [chunk for chunk in chunks for _ in range(2)],
+    })
+
+
+def test_write_ddl_statements_stores_each_chunk_once(tmp_path):
+    file_name = str(tmp_path / "ddl.parquet")
+    write_ddl_statements(file_name, make_ddl_df())
+
+    assert os.path.exists(chunks_file_name(file_name))
+    assert len(pd.read_parquet(chunks_file_name(file_name))) == 3
+    assert pd.read_parquet(file_name).columns.tolist() == ['db_object_name', 'sql_operation', 'chunk_id']
+
+
+def test_read_ddl_statements_round_trip(tmp_path):
+    file_name = str(tmp_path / "ddl.parquet")
+    write_ddl_statements(file_name, make_ddl_df())
+
+    df = read_ddl_statements(file_name)
+    assert df.columns.tolist() == ['db_object_name', 'sql_operation', 'sql_code']
+    assert df.astype(str).equals(make_ddl_df())
+    assert df['sql_operation'].dtype == 'category'
+
+
+def test_read_ddl_statements_only_reads_the_columns_asked_for(tmp_path):
+    file_name = str(tmp_path / "ddl.parquet")
+    write_ddl_statements(file_name, make_ddl_df())
+    os.remove(chunks_file_name(file_name))
+
+    df = read_ddl_statements(file_name, columns=['db_object_name'])
+    assert df['db_object_name'].tolist() == ["A0", "B0", "A1", "B1", "A2", "B2"]
+
+
+def test_table_map_round_trip(tmp_path):
+    file_name = str(tmp_path / "tables.parquet")
+    tables_df = pd.DataFrame({
+        'table_name': ["Orders", "Products"],
+        'sql_operation': ["SELECT", "UPDATE"],
+        'operation_type': ["READ", "WRITE"],
+        'procedure_name': ["GetOrders", "SetPrice"],
+    })
+    write_table_map(file_name, tables_df)
+
+    df = read_table_map(file_name)
+    assert df.astype(str).equals(tables_df)
+    assert df['operation_type'].dtype == 'category'
+    assert read_table_map(file_name, columns=['procedure_name']).columns.tolist() == ['procedure_name']
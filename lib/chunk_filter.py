@@ -0,0 +1,72 @@
+from lib.ddl_recognizer import DdlRecognizer
+from lib.sql_tokenizer import tokenize, is_keyword
+
+
+class DataLoadChunkFilter:
+    """
+    Detects code fragments that only load data, e.g. blocks of INSERT ... VALUES statements.
+
+    Database scripts are often mostly row inserts, which the LLM won't find any DDL statements in,
+    so these fragments can be dropped before they are parsed.
+
+    The fragment is split into statements, and a fragment is considered to be data only if:
+    - it doesn't contain any CREATE, ALTER, DROP or CONSTRAINT keywords, and
+    - at least min_data_ratio of its statement text is INSERT statements, or VALUES rows carried over
+      from the previous fragment.
+
+    Any object with an is_data_only(sql_code) method can be used as a chunk filter by the SqlCodeParser.
+    """
+
+    SCHEMA_KEYWORDS = DdlRecognizer.DDL_KEYWORDS | {'CONSTRAINT'}
+
+    def __init__(self, min_data_ratio=0.9) -> None:
+        self.min_data_ratio = min_data_ratio
+
+
+    def is_data_only(self, sql_code):
+        """
+        Returns True if the code fragment only loads data.
+        """
+        data_bytes = 0
+        total_bytes = 0
+        statement_start = None
+        statement_end = None
+        statement_is_data = False
+        leading_fragment = True
+        depth = 0
+
+        for token in tokenize(sql_code):
+            if token.kind == 'unterminated' or is_keyword(token, *self.SCHEMA_KEYWORDS):
+                return False
+
+            ends_statement = token.kind == 'separator' or (depth == 0 and token.value == ';')
+            starts_statement = depth == 0 and is_keyword(token, *DdlRecognizer.STATEMENT_KEYWORDS)
+            if (ends_statement or starts_statement) and statement_start is not None:
+                total_bytes += statement_end - statement_start
+                data_bytes += statement_end - statement_start if statement_is_data else 0
+                statement_start = None
+            if ends_statement or starts_statement:
+                leading_fragment = False
+            if ends_statement:
+                continue
+
+            if statement_start is None:
+                # A fragment may start part way through the rows of an INSERT statement.
+                statement_start = token.start
+                statement_is_data = is_keyword(token, 'INSERT') or (leading_fragment and (
+                    is_keyword(token, 'VALUES') or token.value in ('(', ',') or token.kind in ('string', 'number')))
+            elif leading_fragment and is_keyword(token, 'VALUES'):
+                # The fragment starts part way through an INSERT statement, e.g. in its column list.
+                statement_is_data = True
+            statement_end = token.end
+
+            if token.value == '(':
+                depth += 1
+            elif token.value == ')':
+                depth = max(0, depth - 1)
+
+        if statement_start is not None:
+            total_bytes += statement_end - statement_start
+            data_bytes += statement_end - statement_start if statement_is_data else 0
+
+        return total_bytes > 0 and data_bytes / total_bytes >= self.min_data_ratio
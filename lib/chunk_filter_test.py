@@ -0,0 +1,55 @@
+from lib.chunk_filter import DataLoadChunkFilter
+
+
+def test_insert_blocks_are_data_only():
+    code = """
+INSERT INTO Customers (CustomerID, CompanyName) VALUES('ALFKI', 'Alfreds Futterkiste');
+INSERT INTO Customers (CustomerID, CompanyName) VALUES('ANATR', 'Ana Trujillo Emparedados y helados');
+"""
+    assert DataLoadChunkFilter().is_data_only(code)
+
+
+def test_fragments_starting_part_way_through_an_insert_are_data_only():
+    chunk_filter = DataLoadChunkFilter()
+    assert chunk_filter.is_data_only("""(OrderID,CustomerID,EmployeeID)
+VALUES (10254,'CHOPS',5);
+
+INSERT INTO Orders
+(OrderID,CustomerID,EmployeeID)
+VALUES (10255,'RICSU',9);
+""")
+    assert chunk_filter.is_data_only("""ShipCity,ShipRegion,ShipPostalCode,ShipCountry)
+VALUES (10254,'Bern',NULL,'3012','Switzerland');
+""")
+    assert chunk_filter.is_data_only(""",'http://accweb/emmployees/davolio.bmp','2954.55');
+INSERT INTO Employees VALUES(null,'Fuller','Andrew');
+""")
+
+
+def test_fragments_with_schema_statements_are_kept():
+    chunk_filter = DataLoadChunkFilter()
+    assert not chunk_filter.is_data_only("""
+INSERT INTO Customers VALUES('ALFKI', 'Alfreds Futterkiste');
+CREATE TABLE "Orders" ("OrderID" int NOT NULL);
+""")
+    assert not chunk_filter.is_data_only("""
+INSERT INTO Customers VALUES('ALFKI', 'Alfreds Futterkiste');
+ALTER TABLE Orders ADD CONSTRAINT FK_Orders_Customers FOREIGN KEY (CustomerID) REFERENCES Customers (CustomerID);
+""")
+
+
+def test_data_ratio_is_configurable():
+    code = """
+SET IDENTITY_INSERT "Categories" ON
+go
+INSERT "Categories"("CategoryID","CategoryName") VALUES(1,'Beverages')
+go
+SELECT COUNT(*) FROM Categories
+go
+"""
+    assert DataLoadChunkFilter(min_data_ratio=0.5).is_data_only(code)
+    assert not DataLoadChunkFilter(min_data_ratio=0.9).is_data_only(code)
+
+
+def test_empty_fragments_are_kept():
+    assert not DataLoadChunkFilter().is_data_only("-- just a comment\n")
@@ -0,0 +1,106 @@
+import os
+
+import numpy as np
+
+
+def build_procedure_vectors(df):
+    """
+    Builds one TF-IDF vector per procedure from a data frame with the procedure_name, table_name and
+    operation_type columns, i.e. one row per table operation.
+
+    Each procedure is described by its name and the names of the tables it touches.  Tables that the
+    procedure writes to are counted twice, so that procedures are grouped by the tables they write to
+    in preference to the tables they only read.
+
+    Returns the procedure names, in order of first appearance, and a sparse matrix with a row for each.
+    """
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    documents = {}
+    for procedure_name, table_name, operation_type in zip(df['procedure_name'], df['table_name'], df['operation_type']):
+        words = documents.setdefault(procedure_name, [procedure_name])
+        words.append(table_name)
+        if operation_type == 'WRITE':
+            words.append(table_name)
+
+    procedure_names = list(documents)
+    # Names are single tokens, as spaces have been replaced with underscores.
+    vectorizer = TfidfVectorizer(token_pattern=r'\S+', lowercase=True)
+    vectors = vectorizer.fit_transform(' '.join(words) for words in documents.values())
+    return procedure_names, vectors
+
+
+class MiniBatchKMeansBackend:
+    """
+    Clusters procedure vectors with MiniBatchKMeans, which scales to tens of thousands of procedures.
+
+    If number_of_clusters is None, then the number of clusters is chosen automatically: a model is
+    fitted for each k from 2 to max_clusters in parallel, on n_jobs processes (all the cores by default),
+    and the k with the best silhouette score is used.  The silhouette score is calculated on a sample
+    of up to silhouette_sample_size procedures, to keep it fast on large catalogues.
+    """
+
+    def __init__(self, number_of_clusters=None, max_clusters=30, n_jobs=None, batch_size=1024, silhouette_sample_size=2000, random_state=0) -> None:
+        self.number_of_clusters = number_of_clusters
+        self.max_clusters = max_clusters
+        self.n_jobs = n_jobs
+        self.batch_size = batch_size
+        self.silhouette_sample_size = silhouette_sample_size
+        self.random_state = random_state
+        self.scores = {}
+
+
+    def config(self):
+        """
+        Returns the settings that determine the clusters, as a JSON serialisable dictionary.
+        """
+        return {
+            'kind': type(self).__name__,
+            'number_of_clusters': self.number_of_clusters,
+            'max_clusters': self.max_clusters,
+            'batch_size': self.batch_size,
+            'silhouette_sample_size': self.silhouette_sample_size,
+            'random_state': self.random_state,
+        }
+
+
+    def _fit(self, vectors, k):
+        from sklearn.cluster import MiniBatchKMeans
+
+        model = MiniBatchKMeans(n_clusters=k, batch_size=self.batch_size, n_init=3, random_state=self.random_state)
+        return model.fit_predict(vectors)
+
+
+    def _score(self, vectors, k):
+        """
+        Fits a model with k clusters and returns the labels and their silhouette score.
+        """
+        from sklearn.metrics import silhouette_score
+
+        labels = self._fit(vectors, k)
+        if len(set(labels)) < 2:
+            return labels, -1.0
+        sample_size = min(self.silhouette_sample_size, vectors.shape[0])
+        score = silhouette_score(vectors, labels, sample_size=sample_size, random_state=self.random_state)
+        return labels, score
+
+
+    def fit_predict(self, vectors):
+        """
+        Returns the cluster label of each row of the vectors.
+        """
+        n_samples = vectors.shape[0]
+        if self.number_of_clusters is not None:
+            return self._fit(vectors, min(self.number_of_clusters, n_samples))
+
+        candidates = list(range(2, min(self.max_clusters, n_samples - 1) + 1))
+        if not candidates:
+            return np.zeros(n_samples, dtype=int)
+
+        from joblib import Parallel, delayed
+
+        n_jobs = self.n_jobs or os.cpu_count() or 1
+        results = Parallel(n_jobs=min(n_jobs, len(candidates)))(delayed(self._score)(vectors, k) for k in candidates)
+        self.scores = {k: score for k, (_, score) in zip(candidates, results)}
+        best = max(range(len(candidates)), key=lambda i: results[i][1])
+        return results[best][0]
@@ -0,0 +1,44 @@
+from lib.clustering import MiniBatchKMeansBackend, build_procedure_vectors
+from lib.service_extractor import ServiceExtractor
+from test_support.synthetic_schema import make_tables_df
+
+
+def test_build_procedure_vectors_has_one_row_per_procedure():
+    procedure_names, vectors = build_procedure_vectors(make_tables_df())
+    assert procedure_names[:2] == ["Service0_Proc0", "Service0_Proc1"]
+    assert vectors.shape[0] == len(procedure_names) == 30
+
+
+def test_backend_chooses_the_number_of_clusters():
+    _, vectors = build_procedure_vectors(make_tables_df(services=4))
+    backend = MiniBatchKMeansBackend(max_clusters=8, n_jobs=2)
+    labels = backend.fit_predict(vectors)
+    assert len(set(labels)) == 4
+    assert max(backend.scores, key=backend.scores.get) == 4
+
+
+def test_backend_with_a_fixed_number_of_clusters():
+    _, vectors = build_procedure_vectors(make_tables_df())
+    assert len(set(MiniBatchKMeansBackend(number_of_clusters=2).fit_predict(vectors))) == 2
+
+
+def test_service_extractor_puts_each_procedure_in_one_service(tmp_path, monkeypatch):
+    monkeypatch.setattr(ServiceExtractor, 'CLUSTERED_CACHE_FILE_NAME', str(tmp_path / "services.csv"))
+    extractor = ServiceExtractor(make_tables_df(), clustering_backend=MiniBatchKMeansBackend(max_clusters=6, n_jobs=1))
+    service_definitions = extractor.extract()
+
+    assert sorted(s.service_name for s in service_definitions) == ["Table0", "Table1", "Table2"]
+    for service_definition in service_definitions:
+        service = service_definition.service_name[-1]
+        assert {p.split('_')[0] for p in service_definition.procs} == {f"Service{service}"}
+
+
+def test_clustered_services_are_cached_apart_from_the_other_services(tmp_path, monkeypatch):
+    monkeypatch.setattr(ServiceExtractor, 'CACHE_FILE_NAME', str(tmp_path / "services.csv"))
+    monkeypatch.setattr(ServiceExtractor, 'CLUSTERED_CACHE_FILE_NAME', str(tmp_path / "clustered_services.csv"))
+    ServiceExtractor(make_tables_df(), number_of_clusters=2, use_cache=True).extract()
+
+    backend = MiniBatchKMeansBackend(max_clusters=6, n_jobs=1)
+    service_definitions = ServiceExtractor(make_tables_df(), use_cache=True, clustering_backend=backend).extract()
+    assert len(service_definitions) == 3
+    assert (tmp_path / "clustered_services.csv").exists()
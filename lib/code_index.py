@@ -0,0 +1,296 @@
+import hashlib
+import json
+import os
+import re
+import sys
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from lib.instrumentation import Instrumentation
+from lib.procedure_index import ProcedureIndex
+from lib.sql_batch_reader import SqlBatchReader
+from lib.sql_tokenizer import normalize_object_name
+
+# A batch of code returned by a query, with its similarity to the query.
+CodeMatch = namedtuple('CodeMatch', ['path', 'batch_number', 'procedure_name', 'score', 'code'])
+
+
+class HashingEmbedding:
+    """
+    Embeds code as a hashed bag of the words in it, i.e. the keywords and the object and variable names.
+
+    This needs no model to be downloaded and is quick on a CPU, and since the hashing is fixed, the same code
+    always has the same vector.  It is good at finding the code that mentions a name, but knows nothing about
+    the meaning of the words.
+
+    Words that hash to the same feature can't be told apart, so n_features should be well above the number of
+    distinct names in the code.  The vectors are stored densely, taking 4 * n_features bytes per batch of code.
+    """
+
+    DEFAULT_N_FEATURES = 2 ** 12
+
+    def __init__(self, n_features=DEFAULT_N_FEATURES) -> None:
+        self.n_features = n_features
+        self.name = f"hashing-{n_features}"
+        self.vectorizer = None
+
+
+    def __call__(self, texts):
+        """
+        Returns a float32 array with a unit length row for each text.
+        """
+        if self.vectorizer is None:
+            from sklearn.feature_extraction.text import HashingVectorizer
+            self.vectorizer = HashingVectorizer(n_features=self.n_features, token_pattern=r'[A-Za-z_@#][\w@#$]*', lowercase=True,
+                                                alternate_sign=False, norm='l2', dtype=np.float32)
+        return self.vectorizer.transform(texts).toarray()
+
+
+class SentenceTransformerEmbedding:
+    """
+    Embeds code with a sentence-transformers model, run locally on the CPU.
+    The model is downloaded the first time it is used; the sentence-transformers package must be installed.
+    """
+
+    def __init__(self, model_name="all-MiniLM-L6-v2", device="cpu") -> None:
+        self.model_name = model_name
+        self.device = device
+        self.name = model_name
+        self.model = None
+
+
+    def __call__(self, texts):
+        if self.model is None:
+            from sentence_transformers import SentenceTransformer
+            self.model = SentenceTransformer(self.model_name, device=self.device)
+        texts = list(texts)
+        return self.model.encode(texts, batch_size=len(texts), normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+
+
+class CodeIndex:
+    """
+    A vector index of the batches of SQL code, kept on disk, for finding the code that is relevant to a
+    question, e.g. the code that touches a table, without reading all the source files again.
+
+    Each batch of code, up to its GO statement, is embedded as a vector.  The vectors are stored in
+    the index directory along with the code, the file it came from and the procedure it creates, if any.
+    An update only reads the files that have changed since the last one, and only embeds batches whose
+    code it hasn't seen before.  Batches are identified by the SHA-256 hash of their code.  New batches
+    are embedded embedding_batch_size at a time.
+
+    Queries score all the batches with a single matrix product, so they don't read the source files.
+    The code of a procedure is looked up by name in the procedure_index, so the StoredProcedureToTableMapper
+    can get the procedures through the code index.  A ProcedureIndex of the source files is built when a
+    procedure is first looked up, unless one is given.
+
+    The embedding is any callable that returns an array of unit vectors for a list of texts, with a name
+    attribute.  The name is stored in the index, and all the batches are embedded again if it changes.
+    """
+
+    DEFAULT_DIRECTORY = './results/code_index'
+    BATCHES_FILE_NAME = 'batches.parquet'
+    VECTORS_FILE_NAME = 'vectors.npy'
+    MANIFEST_FILE_NAME = 'manifest.json'
+
+    def __init__(self, source_directory, source_file_glob_pattern="**/*.sql", directory=DEFAULT_DIRECTORY, embedding=None,
+                 embedding_batch_size=256, batch_separator_pattern=SqlBatchReader.DEFAULT_BATCH_SEPARATOR_PATTERN, instrumentation=None,
+                 procedure_index=None) -> None:
+        self.source_directory = source_directory
+        self.source_file_glob_pattern = source_file_glob_pattern
+        self.directory = directory
+        self.embedding = embedding or HashingEmbedding()
+        self.embedding_batch_size = embedding_batch_size
+        self.batch_separator_pattern = batch_separator_pattern
+        self.instrumentation = instrumentation or Instrumentation()
+        self.batches_df = None
+        self.vectors = None
+        self.file_signatures = {}
+        self._procedure_index = procedure_index
+
+
+    @staticmethod
+    def _file_signature(path):
+        status = os.stat(path)
+        return [status.st_mtime_ns, status.st_size]
+
+
+    def _path(self, file_name):
+        return os.path.join(self.directory, file_name)
+
+
+    def load(self):
+        """
+        Reads the index from the index directory, if there is one.
+        The index is empty if it doesn't exist or was built with a different embedding.
+        """
+        self.batches_df = pd.DataFrame({'id': [], 'path': [], 'batch_number': [], 'procedure_name': [], 'code': []})
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.file_signatures = {}
+        if os.path.exists(self._path(self.MANIFEST_FILE_NAME)):
+            with open(self._path(self.MANIFEST_FILE_NAME)) as file:
+                manifest = json.load(file)
+            if manifest['embedding'] == self.embedding.name:
+                self.batches_df = pd.read_parquet(self._path(self.BATCHES_FILE_NAME))
+                self.vectors = np.load(self._path(self.VECTORS_FILE_NAME))
+                self.file_signatures = manifest['files']
+        return self
+
+
+    def _save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.batches_df.to_parquet(self._path(self.BATCHES_FILE_NAME), index=False)
+        np.save(self._path(self.VECTORS_FILE_NAME), self.vectors)
+        # The manifest is written last, so that an interrupted update leaves an index that is rebuilt next time.
+        with open(self._path(self.MANIFEST_FILE_NAME), 'w') as file:
+            json.dump({'embedding': self.embedding.name, 'files': self.file_signatures}, file)
+
+
+    def _read_batches(self, path):
+        """
+        Returns the rows for the batches in the file.
+        """
+        reader = SqlBatchReader(self.source_directory, self.source_file_glob_pattern, window_size=sys.maxsize,
+                                batch_separator_pattern=self.batch_separator_pattern)
+        rows = []
+        for batch_number, code in enumerate(reader.read_batches(path)):
+            if not code.strip():
+                continue
+            procedure = ProcedureIndex.find_procedure(code)
+            self.instrumentation.add_bytes_ingested(len(code))
+            rows.append({
+                'id': hashlib.sha256(code.encode('utf-8', errors='surrogateescape')).hexdigest(),
+                'path': path,
+                'batch_number': batch_number,
+                'procedure_name': procedure[0] if procedure else '',
+                'code': code,
+            })
+        return rows
+
+
+    def _embed(self, codes):
+        """
+        Returns the vectors of the code, embedding embedding_batch_size batches of code at a time.
+        """
+        vectors = [self.embedding(codes[i:i + self.embedding_batch_size]) for i in range(0, len(codes), self.embedding_batch_size)]
+        return np.vstack(vectors).astype(np.float32)
+
+
+    def update(self):
+        """
+        Brings the index up to date with the source files, and saves it.
+        Returns the number of batches that were embedded.
+        """
+        with self.instrumentation.stage('index_code'):
+            if self.batches_df is None:
+                self.load()
+
+            paths = SqlBatchReader(self.source_directory, self.source_file_glob_pattern).file_paths() if os.path.exists(self.source_directory) else []
+            signatures = {path: self._file_signature(path) for path in paths}
+            unchanged_paths = {path for path, signature in signatures.items() if self.file_signatures.get(path) == signature}
+            kept_df = self.batches_df[self.batches_df['path'].isin(unchanged_paths)]
+            new_rows = [row for path in signatures if path not in unchanged_paths for row in self._read_batches(path)]
+            new_df = pd.DataFrame(new_rows, columns=self.batches_df.columns)
+            frames = [df for df in [kept_df, new_df] if len(df)]
+            batches_df = pd.concat(frames, ignore_index=True) if frames else new_df
+            batches_df = batches_df.sort_values(['path', 'batch_number'], ignore_index=True, kind='stable')
+
+            # Reuse the vectors of the batches that are already in the index, wherever they were.
+            position_by_id = {batch_id: position for position, batch_id in enumerate(self.batches_df['id'])}
+            new_codes = {}
+            for batch_id, code in zip(batches_df['id'], batches_df['code']):
+                hit = batch_id in position_by_id
+                self.instrumentation.record_cache('code_index_embeddings', hit)
+                if not hit:
+                    new_codes.setdefault(batch_id, code)
+
+            if new_codes:
+                new_vectors = self._embed(list(new_codes.values()))
+                position_by_id.update({batch_id: len(self.vectors) + i for i, batch_id in enumerate(new_codes)})
+                all_vectors = np.vstack([self.vectors, new_vectors]) if len(self.vectors) else new_vectors
+            else:
+                all_vectors = self.vectors
+            positions = np.array([position_by_id[batch_id] for batch_id in batches_df['id']], dtype=np.int64)
+            self.vectors = all_vectors[positions]
+
+            self.batches_df = batches_df
+            self.file_signatures = signatures
+            self._save()
+            print(f"Indexed {len(batches_df)} batches of code, embedding {len(new_codes)} of them")
+            return len(new_codes)
+
+
+    def _ensure_loaded(self):
+        if self.batches_df is None:
+            self.load()
+
+
+    def _match(self, position, score):
+        row = self.batches_df.iloc[position]
+        return CodeMatch(row['path'], int(row['batch_number']), row['procedure_name'] or None, float(score), row['code'])
+
+
+    def _scores(self, text):
+        if not len(self.vectors):
+            return np.zeros(0, dtype=np.float32)
+        return self.vectors @ self.embedding([text])[0]
+
+
+    def search(self, text, limit=10):
+        """
+        Returns the limit batches of code most similar to the text, most similar first.
+        """
+        self._ensure_loaded()
+        scores = self._scores(text)
+        if len(scores) > limit:
+            candidates = np.argpartition(-scores, limit)[:limit]
+        else:
+            candidates = np.arange(len(scores))
+        candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+        return [self._match(position, scores[position]) for position in candidates if scores[position] > 0]
+
+
+    def find_code_touching(self, name, limit=None):
+        """
+        Returns the batches of code that mention the database object, most similar to its name first.
+
+        The batches are ranked by their similarity to the name, and only those that contain the name are
+        returned.  Names are matched ignoring case, quotes, brackets and the schema name.
+        """
+        self._ensure_loaded()
+        words = normalize_object_name(name).split()
+        if not words:
+            return []
+        pattern = re.compile(r'(?<![\w@#$])' + r'\s+'.join(map(re.escape, words)) + r'(?![\w@#$])', re.IGNORECASE)
+        scores = self._scores(' '.join(words))
+        candidates = np.flatnonzero(scores > 0)
+        candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+        codes = self.batches_df['code'].to_numpy()
+        matches = []
+        for position in candidates:
+            if pattern.search(codes[position]):
+                matches.append(self._match(position, scores[position]))
+                if limit is not None and len(matches) >= limit:
+                    break
+        return matches
+
+
+    @property
+    def procedure_index(self):
+        if self._procedure_index is None:
+            self._procedure_index = ProcedureIndex.build(self.source_directory, self.source_file_glob_pattern, self.batch_separator_pattern)
+        return self._procedure_index
+
+
+    def get_procedure_code(self, procedure_name):
+        """
+        Returns the code of the procedure, from the CREATE PROCEDURE statement to the end of the GO
+        statement, or None if the procedure isn't in the procedure_index.
+        """
+        return self.procedure_index.get_procedure_code(procedure_name)
+
+
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self.batches_df)
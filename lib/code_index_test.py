@@ -0,0 +1,100 @@
+import os
+
+from lib.code_index import CodeIndex, HashingEmbedding
+from lib.procedure_index import ProcedureIndex
+
+
+CODE = """
+CREATE TABLE Orders (OrderID int, CustomerID nchar(5))
+GO
+CREATE TABLE [Order Details] (OrderID int, ProductID int)
+GO
+CREATE PROCEDURE CustOrdersOrders @CustomerID nchar(5)
+AS
+SELECT OrderID FROM Orders WHERE CustomerID = @CustomerID
+GO
+CREATE PROCEDURE "dbo"."Sales by Year" @Year int
+AS
+SELECT * FROM [Order Details]
+GO
+"""
+
+
+class CountingEmbedding(HashingEmbedding):
+    def __init__(self):
+        super().__init__(n_features=256)
+        self.texts = []
+
+    def __call__(self, texts):
+        self.texts.extend(texts)
+        return super().__call__(texts)
+
+
+def create_index(tmp_path, embedding=None):
+    return CodeIndex(str(tmp_path / "source"), directory=str(tmp_path / "index"), embedding=embedding or CountingEmbedding(), embedding_batch_size=2)
+
+
+def write_source(tmp_path, file_name, code):
+    os.makedirs(tmp_path / "source", exist_ok=True)
+    (tmp_path / "source" / file_name).write_text(code)
+
+
+def test_finds_the_code_touching_a_table(tmp_path):
+    write_source(tmp_path, "schema.sql", CODE)
+    index = create_index(tmp_path)
+    index.update()
+
+    matches = index.find_code_touching("dbo.[Order Details]")
+    assert sorted(match.batch_number for match in matches) == [1, 3]
+    assert all("[Order Details]" in match.code for match in matches)
+    # "Orders" is a whole word, so the batches that only mention "Order Details" or "OrderID" don't match.
+    assert sorted(match.batch_number for match in index.find_code_touching("Orders")) == [0, 2]
+    assert index.find_code_touching("Customers") == []
+    assert index.search("SELECT OrderID FROM Orders WHERE CustomerID = @CustomerID", limit=1)[0].procedure_name == 'CustOrdersOrders'
+
+
+def test_procedure_code_is_looked_up_by_name(tmp_path):
+    write_source(tmp_path, "schema.sql", CODE)
+    index = create_index(tmp_path)
+    index.update()
+
+    assert index.get_procedure_code("sales by year") == 'CREATE PROCEDURE "dbo"."Sales by Year" @Year int\nAS\nSELECT * FROM [Order Details]\nGO'
+    assert index.get_procedure_code("Missing") is None
+
+
+def test_procedure_code_is_looked_up_in_the_procedure_index_given(tmp_path):
+    write_source(tmp_path, "schema.sql", CODE)
+    procedure_index = ProcedureIndex()
+    procedure_index.add_file(str(tmp_path / "source" / "schema.sql"))
+    index = CodeIndex(str(tmp_path / "source"), directory=str(tmp_path / "index"), embedding=CountingEmbedding(), procedure_index=procedure_index)
+
+    assert index.procedure_index is procedure_index
+    assert index.get_procedure_code("CustOrdersOrders") == procedure_index.get_procedure_code("CustOrdersOrders")
+
+
+def test_embeddings_are_reused_across_runs(tmp_path):
+    write_source(tmp_path, "schema.sql", CODE)
+    write_source(tmp_path, "other.sql", "CREATE TABLE Customers (CustomerID nchar(5))\nGO\n")
+    embedding = CountingEmbedding()
+    assert create_index(tmp_path, embedding).update() == 5
+    assert len(embedding.texts) == 5
+
+    # Nothing has changed, so nothing is embedded.
+    embedding = CountingEmbedding()
+    assert create_index(tmp_path, embedding).update() == 0
+
+    # Only the new batch of a changed file is embedded, and the batches of a removed file are dropped.
+    os.remove(tmp_path / "source" / "other.sql")
+    write_source(tmp_path, "schema.sql", CODE + "CREATE TABLE Shippers (ShipperID int)\nGO\n")
+    index = create_index(tmp_path, embedding)
+    assert index.update() == 1
+    assert embedding.texts == ["CREATE TABLE Shippers (ShipperID int)\nGO\n"]
+    assert len(index) == 5
+    assert index.find_code_touching("Customers") == []
+    assert [match.code for match in create_index(tmp_path).find_code_touching("Shippers")] == ["CREATE TABLE Shippers (ShipperID int)\nGO\n"]
+
+
+def test_index_is_rebuilt_for_a_different_embedding(tmp_path):
+    write_source(tmp_path, "schema.sql", CODE)
+    create_index(tmp_path).update()
+    assert create_index(tmp_path, HashingEmbedding(n_features=512)).update() == 4
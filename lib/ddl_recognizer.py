@@ -0,0 +1,210 @@
+from lib.sql_tokenizer import tokenize, is_keyword
+
+
+class UnrecognizedCodeError(Exception):
+    """
+    Raised when the DDL recognizer can't classify a code fragment with confidence.
+    """
+
+
+class DdlRecognizer:
+    """
+    A deterministic, local recognizer for Data Definition Language (DDL) statements.
+
+    Most code fragments in a database script are plain CREATE, ALTER and DROP statements or INSERT
+    data blocks, which can be classified from the SQL tokens without asking the LLM.  The recognizer
+    produces the same records as the LLM, e.g.
+
+        [{"db_object_name": "Products", "sql_operation": "CREATE TABLE"}]
+
+    It understands quoted, bracketed and schema qualified names, and the sysobjects idiom:
+
+        if exists (select * from sysobjects where id = object_id('dbo.Sales by Year') and sysstat & 0xf = 4)
+            drop procedure "dbo"."Sales by Year"
+
+    If the fragment contains anything it doesn't understand, e.g. a fragment that starts part way
+    through a statement, then it gives up and the fragment should be sent to the LLM instead.
+    """
+
+    OBJECT_TYPES = {
+        'TABLE': 'TABLE',
+        'VIEW': 'VIEW',
+        'PROCEDURE': 'PROCEDURE',
+        'PROC': 'PROCEDURE',
+        'INDEX': 'INDEX',
+        'TRIGGER': 'TRIGGER',
+        'FUNCTION': 'FUNCTION',
+        'SEQUENCE': 'SEQUENCE',
+        'SYNONYM': 'SYNONYM',
+        'TYPE': 'TYPE',
+        'SCHEMA': 'SCHEMA',
+        'DATABASE': 'DATABASE',
+        'RULE': 'RULE',
+        'DEFAULT': 'DEFAULT',
+        'CONSTRAINT': 'CONSTRAINT',
+    }
+
+    # Words that can appear between CREATE and the object type, e.g. CREATE UNIQUE CLUSTERED INDEX
+    CREATE_MODIFIERS = {
+        'OR', 'REPLACE', 'UNIQUE', 'CLUSTERED', 'NONCLUSTERED', 'BITMAP', 'FULLTEXT', 'SPATIAL',
+        'TEMPORARY', 'TEMP', 'GLOBAL', 'LOCAL', 'FORCE', 'NOFORCE', 'EDITIONABLE',
+    }
+
+    # Objects whose body runs to the end of the batch, and may contain any other statements.
+    BODY_OBJECT_TYPES = {'PROCEDURE', 'FUNCTION', 'TRIGGER', 'VIEW'}
+
+    DDL_KEYWORDS = {'CREATE', 'ALTER', 'DROP'}
+
+    # Keywords that start a statement; only the DDL keywords produce records.
+    STATEMENT_KEYWORDS = DDL_KEYWORDS | {
+        'INSERT', 'UPDATE', 'DELETE', 'SELECT', 'TRUNCATE', 'SET', 'USE', 'PRINT', 'EXEC', 'EXECUTE',
+        'DECLARE', 'IF', 'ELSE', 'BEGIN', 'END', 'COMMIT', 'ROLLBACK', 'GRANT', 'REVOKE', 'DENY',
+        'RETURN', 'WHILE', 'CHECKPOINT', 'DBCC', 'RAISERROR', 'LOCK', 'UNLOCK', 'START', 'COMMENT',
+    }
+
+
+    def recognize(self, sql_code):
+        """
+        Find all the DDL statements in the SQL code.
+
+        Returns a list of dictionaries containing the db_object_name and sql_operation,
+        or None if the code could not be classified with confidence.
+        """
+        try:
+            return self._recognize(list(tokenize(sql_code)))
+        except UnrecognizedCodeError:
+            return None
+
+
+    def _recognize(self, tokens):
+        records = []
+        statement = None
+        expect_statement = True
+        depth = 0
+        i = 0
+        while i < len(tokens):
+            token = tokens[i]
+            if token.kind == 'unterminated':
+                raise UnrecognizedCodeError(f"Unterminated token: {token.value[:20]}")
+
+            if token.kind == 'separator' or (token.value == ';' and depth == 0):
+                if depth != 0:
+                    raise UnrecognizedCodeError("Unbalanced brackets at the end of a batch")
+                statement = None
+                expect_statement = True
+            elif token.value == '(':
+                depth += 1
+            elif token.value == ')':
+                depth -= 1
+                if depth < 0:
+                    raise UnrecognizedCodeError("Unbalanced brackets")
+            elif depth == 0 and is_keyword(token, *self.STATEMENT_KEYWORDS):
+                expect_statement = False
+                if is_keyword(token, *self.DDL_KEYWORDS):
+                    statement, i = self._ddl_statement(tokens, i, records)
+                    continue
+                statement = token.value.upper()
+            elif expect_statement:
+                raise UnrecognizedCodeError(f"Unexpected start of statement: {token.value}")
+            elif is_keyword(token, 'CONSTRAINT') and statement in ('CREATE TABLE', 'ALTER TABLE'):
+                name, i = self._object_name(tokens, i + 1)
+                records.append({"db_object_name": name, "sql_operation": "CREATE CONSTRAINT"})
+                continue
+            i += 1
+
+        return records
+
+
+    def _ddl_statement(self, tokens, i, records):
+        """
+        Parse a CREATE, ALTER or DROP statement starting at token i, adding its records.
+        Returns the statement type, e.g. 'CREATE TABLE', and the index of the next token to parse.
+        """
+        keyword = tokens[i].value.upper()
+        i += 1
+        if keyword == 'CREATE':
+            i = self._skip_create_modifiers(tokens, i)
+
+        if i >= len(tokens) or not is_keyword(tokens[i], *self.OBJECT_TYPES):
+            raise UnrecognizedCodeError(f"Unknown object type after {keyword}")
+        object_type = self.OBJECT_TYPES[tokens[i].value.upper()]
+        sql_operation = f"{keyword} {object_type}"
+        i = self._skip_if_exists(tokens, i + 1)
+
+        name, i = self._object_name(tokens, i)
+        records.append({"db_object_name": name, "sql_operation": sql_operation})
+        while keyword == 'DROP' and i < len(tokens) and tokens[i].value == ',':
+            name, i = self._object_name(tokens, i + 1)
+            records.append({"db_object_name": name, "sql_operation": sql_operation})
+
+        if keyword != 'DROP' and object_type in self.BODY_OBJECT_TYPES:
+            i = self._skip_body(tokens, i, stop_at_semicolon=object_type == 'VIEW')
+
+        return sql_operation, i
+
+
+    def _skip_create_modifiers(self, tokens, i):
+        while i < len(tokens):
+            if is_keyword(tokens[i], *self.CREATE_MODIFIERS):
+                i += 1
+            elif is_keyword(tokens[i], 'DEFINER'):
+                # MySQL: DEFINER=`user`@`host`
+                i += 2
+                while i < len(tokens) and (tokens[i].kind in ('identifier', 'string') or tokens[i].value in ('@', '.')):
+                    i += 1
+            else:
+                break
+        return i
+
+
+    def _skip_if_exists(self, tokens, i):
+        if is_keyword(tokens[i] if i < len(tokens) else None, 'IF'):
+            i += 1
+            if i < len(tokens) and is_keyword(tokens[i], 'NOT'):
+                i += 1
+            if i >= len(tokens) or not is_keyword(tokens[i], 'EXISTS'):
+                raise UnrecognizedCodeError("Expected EXISTS")
+            i += 1
+        return i
+
+
+    def _object_name(self, tokens, i):
+        """
+        Read a possibly schema qualified object name starting at token i, e.g. "dbo"."Sales by Year".
+        Returns the unqualified name and the index of the token after the name.
+        """
+        name = None
+        while i < len(tokens) and tokens[i].kind in ('word', 'identifier'):
+            name = tokens[i].value
+            i += 1
+            if i < len(tokens) and tokens[i].value == '.':
+                i += 1
+            else:
+                break
+        if name is None:
+            raise UnrecognizedCodeError("Expected an object name")
+        return name, i
+
+
+    def _skip_body(self, tokens, i, stop_at_semicolon):
+        """
+        Skip the body of a procedure, function, trigger or view, which runs to the end of the batch.
+        If there is no batch separator, then give up if the body seems to contain other DDL statements.
+        """
+        depth = 0
+        start = i
+        while i < len(tokens):
+            token = tokens[i]
+            if token.kind == 'separator' or (stop_at_semicolon and depth == 0 and token.value == ';'):
+                return i
+            if token.kind == 'unterminated':
+                raise UnrecognizedCodeError("Unterminated token in body")
+            if token.value == '(':
+                depth += 1
+            elif token.value == ')':
+                depth -= 1
+            i += 1
+
+        if any(is_keyword(token, *self.DDL_KEYWORDS) for token in tokens[start:]):
+            raise UnrecognizedCodeError("The end of the body can't be found")
+        return i
@@ -0,0 +1,70 @@
+from lib.ddl_recognizer import DdlRecognizer
+
+
+def test_recognize_sysobjects_drop_idiom():
+    code = """
+if exists (select * from sysobjects where id = object_id('dbo.Employee Sales by Country') and sysstat & 0xf = 4)
+    drop procedure "dbo"."Employee Sales by Country"
+GO
+if exists (select * from sysobjects where id = object_id('dbo.Category Sales for 1997') and sysstat & 0xf = 2)
+    drop view "dbo"."Category Sales for 1997"
+GO
+"""
+    assert DdlRecognizer().recognize(code) == [
+        {"db_object_name": "Employee Sales by Country", "sql_operation": "DROP PROCEDURE"},
+        {"db_object_name": "Category Sales for 1997", "sql_operation": "DROP VIEW"},
+    ]
+
+
+def test_recognize_tables_constraints_and_indexes():
+    code = """
+CREATE TABLE [dbo].[Order Details] (
+    "OrderID" "int" NOT NULL ,
+    CONSTRAINT "PK_Order_Details" PRIMARY KEY CLUSTERED ("OrderID"),
+    CONSTRAINT "CK_Quantity" CHECK (Quantity > 0)
+)
+GO
+ CREATE UNIQUE CLUSTERED INDEX "OrderID" ON "dbo"."Order Details"("OrderID")
+GO
+ALTER TABLE `Orders` ADD CONSTRAINT `FK_Orders_Customers` FOREIGN KEY (`CustomerID`) REFERENCES `Customers` (`CustomerID`);
+DROP TABLE IF EXISTS "Shippers", "Suppliers";
+"""
+    assert DdlRecognizer().recognize(code) == [
+        {"db_object_name": "Order Details", "sql_operation": "CREATE TABLE"},
+        {"db_object_name": "PK_Order_Details", "sql_operation": "CREATE CONSTRAINT"},
+        {"db_object_name": "CK_Quantity", "sql_operation": "CREATE CONSTRAINT"},
+        {"db_object_name": "OrderID", "sql_operation": "CREATE INDEX"},
+        {"db_object_name": "Orders", "sql_operation": "ALTER TABLE"},
+        {"db_object_name": "FK_Orders_Customers", "sql_operation": "CREATE CONSTRAINT"},
+        {"db_object_name": "Shippers", "sql_operation": "DROP TABLE"},
+        {"db_object_name": "Suppliers", "sql_operation": "DROP TABLE"},
+    ]
+
+
+def test_recognize_skips_procedure_bodies_and_data():
+    code = """
+create procedure "Sales by Year"
+    @Beginning_Date DateTime, @Ending_Date DateTime AS
+SELECT Orders.ShippedDate, Orders.OrderID
+FROM Orders
+WHERE Orders.ShippedDate Between @Beginning_Date And @Ending_Date
+GO
+set quoted_identifier on
+go
+INSERT "Categories"("CategoryName","Description") VALUES('Beverages','Soft drinks, coffees, teas, beers, and ales')
+INSERT "Categories"("CategoryName","Description") VALUES('Condiments','Sweet and savory sauces')
+go
+"""
+    assert DdlRecognizer().recognize(code) == [
+        {"db_object_name": "Sales by Year", "sql_operation": "CREATE PROCEDURE"},
+    ]
+
+
+def test_recognize_gives_up_on_code_it_does_not_understand():
+    recognizer = DdlRecognizer()
+    # A fragment starting part way through a CREATE TABLE statement
+    assert recognizer.recognize('"Notes" "ntext" NULL ,\n CONSTRAINT "PK_Employees" PRIMARY KEY ("EmployeeID")\n)\nGO') is None
+    # An unknown object type
+    assert recognizer.recognize("CREATE ASSEMBLY Utilities FROM 'utilities.dll'") is None
+    # An unterminated string
+    assert recognizer.recognize("INSERT INTO Notes VALUES ('This is sample text") is None
@@ -0,0 +1,466 @@
+import hashlib
+import json
+import os
+import re
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from lib.instrumentation import Instrumentation
+from lib.service_definition import unique_service_names
+from lib.sql_tokenizer import is_keyword, normalize_object_name, tokenize
+from lib.table_access_analyzer import TableAccessAnalyzer
+from lib.worker_pool import WorkerPool
+
+# A reference from one database object to another, found in the SQL code, e.g.
+# ObjectReference('PROCEDURE', 'CustOrderHist', 'CALL', 'GetCustomer').
+ObjectReference = namedtuple('ObjectReference', ['object_type', 'object_name', 'relation', 'referenced_name'])
+
+# Words that can appear between CREATE and the object type, e.g. CREATE OR ALTER PROCEDURE.
+_CREATE_MODIFIERS = {'OR', 'ALTER', 'REPLACE', 'UNIQUE', 'CLUSTERED', 'NONCLUSTERED'}
+
+# Code without any of these words can't contain a reference, so it isn't tokenized.
+_REFERENCE_PATTERN = re.compile(r'\b(?:EXEC|EXECUTE|REFERENCES|VIEW)\b', re.IGNORECASE)
+
+_OBJECT_TYPES = {'TABLE': 'TABLE', 'VIEW': 'VIEW', 'PROCEDURE': 'PROCEDURE', 'PROC': 'PROCEDURE', 'FUNCTION': 'FUNCTION', 'TRIGGER': 'TRIGGER'}
+
+
+def _read_name(tokens, i):
+    """
+    Reads an object name, which may be qualified by the schema and database, e.g. Northwind..[Order Details].
+    Returns the last part of the name and the index of the next token, or None and i if there isn't a name at i.
+    """
+    name = None
+    while i < len(tokens):
+        token = tokens[i]
+        if token.kind == 'identifier' or (token.kind == 'word' and not token.value.startswith('@')):
+            name = token.value
+            i += 1
+            if i >= len(tokens) or tokens[i].value != '.':
+                break
+            i += 1
+        elif token.value == '.' and token.kind == 'punctuation':
+            i += 1
+        else:
+            break
+    return name, i
+
+
+def _called_procedure(tokens, i):
+    """
+    Reads the procedure called by an EXEC statement, whose first token after EXEC is at i.
+    Returns None for dynamic SQL, e.g. EXEC (@sql) or EXEC @procedure_name.
+    """
+    if i + 1 < len(tokens) and tokens[i].value.startswith('@') and tokens[i + 1].value == '=':
+        # EXEC @return_status = procedure_name
+        i += 2
+    if i >= len(tokens) or tokens[i].value == '(' or tokens[i].value.startswith('@'):
+        return None
+    return _read_name(tokens, i)[0]
+
+
+def find_object_references(sql_code):
+    """
+    Finds the references between the database objects created or altered in the SQL code:
+    - the procedures, functions and triggers called by a procedure, function or trigger with EXEC, relation CALL
+    - the tables and views that a view selects from, relation READ
+    - the tables that a table refers to with a FOREIGN KEY constraint, relation FOREIGN KEY
+
+    Code that isn't in the body of a CREATE or ALTER statement is ignored.
+    """
+    if not _REFERENCE_PATTERN.search(sql_code):
+        return []
+    tokens = list(tokenize(sql_code))
+    references = []
+    current_type = None
+    current_name = None
+    view_start = None
+
+    def end_view(end):
+        if view_start is not None:
+            for table in TableAccessAnalyzer().analyze(sql_code[view_start:end]).tables:
+                references.append(ObjectReference('VIEW', current_name, 'READ', table['table_name']))
+
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token.kind == 'separator':
+            end_view(token.start)
+            current_type, current_name, view_start = None, None, None
+        elif is_keyword(token, 'CREATE', 'ALTER') and (current_type is None or current_type == 'TABLE'):
+            j = i + 1
+            while j < len(tokens) and is_keyword(tokens[j], *_CREATE_MODIFIERS):
+                j += 1
+            if j < len(tokens) and is_keyword(tokens[j], *_OBJECT_TYPES):
+                end_view(token.start)
+                current_type = _OBJECT_TYPES[tokens[j].value.upper()]
+                current_name, i = _read_name(tokens, j + 1)
+                view_start = token.start if current_type == 'VIEW' else None
+                continue
+        elif is_keyword(token, 'EXEC', 'EXECUTE') and current_type in ('PROCEDURE', 'FUNCTION', 'TRIGGER'):
+            called_name = _called_procedure(tokens, i + 1)
+            if called_name:
+                references.append(ObjectReference(current_type, current_name, 'CALL', called_name))
+        elif is_keyword(token, 'REFERENCES') and current_type == 'TABLE':
+            referenced_name, i = _read_name(tokens, i + 1)
+            if referenced_name:
+                references.append(ObjectReference('TABLE', current_name, 'FOREIGN KEY', referenced_name))
+            continue
+        i += 1
+    end_view(len(sql_code))
+    return references
+
+
+def find_all_object_references(sql_codes):
+    """
+    Returns the references found in each piece of SQL code, for running on the workers of a WorkerPool.
+    """
+    return [find_object_references(sql_code) for sql_code in sql_codes]
+
+
+class DependencyGraph:
+    """
+    A graph of the dependencies between the database objects and the services, for answering questions
+    such as "if I change the Orders table, which procedures and services are affected?" without scanning
+    the data frames.
+
+    The graph has an edge from each object to each object that it depends on:
+    - a procedure reads or writes a table, from the procedure to table map, relation READ or WRITE
+    - a procedure, function or trigger calls a procedure with EXEC, relation CALL
+    - a view selects from a table or view, relation READ
+    - a table has a foreign key to another table, relation FOREIGN KEY
+    - a service contains a procedure, relation CONTAINS
+
+    The impact of an object, i.e. everything that depends on it directly or indirectly, is precomputed
+    for every object when the graph is built, so an impact query only slices an array.  The strongly
+    connected components, e.g. procedures that call each other, are found first, and the impact of each
+    component is built from the impact of the components that depend on it, so each component is only
+    visited once.
+
+    The nodes are numbered, and the edges and impacts are held in compressed sparse row arrays, i.e. the
+    numbers of the nodes connected to node n are targets[offsets[n]:offsets[n + 1]].  The graph is saved
+    to a directory as a Parquet file of the nodes and a NumPy file of the arrays, and loads without
+    being rebuilt.  A fingerprint of the inputs can be saved with the graph, so that it is only loaded
+    while they are unchanged.
+
+    Object names are matched ignoring case, quotes, brackets and the schema name, and spaces match
+    underscores, since the service extractor replaces the spaces in names with underscores.  Services have
+    a namespace of their own, since they are often named after a table.
+    """
+
+    DEFAULT_DIRECTORY = './results/dependency_graph'
+    NODES_FILE_NAME = 'nodes.parquet'
+    ARRAYS_FILE_NAME = 'graph.npz'
+    MANIFEST_FILE_NAME = 'manifest.json'
+
+    KINDS = ['TABLE', 'VIEW', 'PROCEDURE', 'FUNCTION', 'TRIGGER', 'SERVICE']
+    RELATIONS = ['READ', 'WRITE', 'CALL', 'FOREIGN KEY', 'CONTAINS']
+
+    # The keys of the impact query results, for each kind of node.
+    IMPACT_KEYS = {'TABLE': 'tables', 'VIEW': 'views', 'PROCEDURE': 'procedures', 'FUNCTION': 'functions', 'TRIGGER': 'triggers', 'SERVICE': 'services'}
+
+    def __init__(self, names, kinds, keys, edge_offsets, edge_targets, edge_relations, impact_offsets, impact_targets) -> None:
+        self.names = names
+        self.kinds = kinds
+        self.keys = keys
+        self.edge_offsets = edge_offsets
+        self.edge_targets = edge_targets
+        self.edge_relations = edge_relations
+        self.impact_offsets = impact_offsets
+        self.impact_targets = impact_targets
+        self.node_by_key = dict(zip(keys, range(len(keys))))
+
+
+    @staticmethod
+    def _node_key(name, kind):
+        key = normalize_object_name(str(name)).replace(' ', '_')
+        return f"service:{key}" if kind == 'SERVICE' else key
+
+
+    @classmethod
+    def build(cls, ddl_df, tables_df, service_definitions=(), procedure_code_by_name=None, worker_pool=None, instrumentation=None):
+        """
+        Builds the graph from the DDL statements and the procedure to table map, and optionally the services.
+
+        The references between objects are found in the distinct code chunks of the DDL statements, and in
+        the code of each procedure if procedure_code_by_name is given, since a chunk may only hold part of a
+        procedure.  If a worker_pool is given, the code is scanned on its workers.
+        """
+        instrumentation = instrumentation or Instrumentation()
+        with instrumentation.stage('build_dependency_graph'):
+            builder = _GraphBuilder()
+            for db_object_name, sql_operation in zip(ddl_df['db_object_name'], ddl_df['sql_operation']):
+                operation, _, object_type = str(sql_operation).partition(' ')
+                if operation == 'CREATE' and object_type in cls.KINDS:
+                    builder.node(db_object_name, object_type)
+
+            codes = list(pd.unique(ddl_df['sql_code'])) if 'sql_code' in ddl_df.columns else []
+            codes.extend((procedure_code_by_name or {}).values())
+            codes = [code for code in codes if isinstance(code, str) and code]
+            for references in (worker_pool or WorkerPool()).map(find_all_object_references, codes, weight=len):
+                for reference in references:
+                    referenced_type = 'PROCEDURE' if reference.relation == 'CALL' else 'TABLE'
+                    builder.edge(reference.object_name, reference.object_type, reference.referenced_name, referenced_type, reference.relation)
+
+            columns = [tables_df[column] for column in ['procedure_name', 'table_name', 'sql_operation', 'operation_type']]
+            for procedure_name, table_name, sql_operation, operation_type in zip(*columns):
+                if operation_type in ('READ', 'WRITE'):
+                    builder.edge(procedure_name, 'PROCEDURE', table_name, 'TABLE', operation_type)
+                elif str(sql_operation).upper() in ('EXEC', 'EXECUTE'):
+                    # The LLM reports calls to other procedures as an EXEC of a "table".
+                    builder.edge(procedure_name, 'PROCEDURE', table_name, 'PROCEDURE', 'CALL')
+
+            for service_name, service_definition in zip(unique_service_names(service_definitions), service_definitions):
+                for procedure_name in service_definition.procs:
+                    builder.edge(service_name, 'SERVICE', procedure_name, 'PROCEDURE', 'CONTAINS')
+
+            graph = builder.graph(cls)
+        print(f"Built a dependency graph of {len(graph.names)} objects and {len(graph.edge_targets)} dependencies")
+        return graph
+
+
+    @staticmethod
+    def fingerprint(source_fingerprint, tables_df, service_definitions=()):
+        """
+        Returns a fingerprint of the inputs of build(), given a fingerprint of the source files that the DDL
+        statements and the procedure code were found in, e.g. SqlCodeParser.source_fingerprint().
+        """
+        digest = hashlib.sha256(str(source_fingerprint).encode('utf-8'))
+        columns = tables_df[['procedure_name', 'table_name', 'sql_operation', 'operation_type']].astype(str)
+        digest.update(pd.util.hash_pandas_object(columns, index=False).to_numpy().tobytes())
+        for service_definition in service_definitions:
+            digest.update(str(service_definition).encode('utf-8', errors='surrogateescape'))
+        return digest.hexdigest()
+
+
+    def save(self, directory=DEFAULT_DIRECTORY, fingerprint=None):
+        """
+        Saves the graph to the directory, with the fingerprint of its inputs if one is given.
+        """
+        os.makedirs(directory, exist_ok=True)
+        nodes_df = pd.DataFrame({'name': self.names, 'kind': pd.Categorical.from_codes(self.kinds, self.KINDS), 'key': self.keys})
+        nodes_df.to_parquet(os.path.join(directory, self.NODES_FILE_NAME), index=False)
+        np.savez(os.path.join(directory, self.ARRAYS_FILE_NAME), edge_offsets=self.edge_offsets, edge_targets=self.edge_targets,
+                 edge_relations=self.edge_relations, impact_offsets=self.impact_offsets, impact_targets=self.impact_targets)
+        # The manifest is written last, so that an interrupted save isn't loaded.
+        with open(os.path.join(directory, self.MANIFEST_FILE_NAME), 'w') as file:
+            json.dump({'nodes': len(self.names), 'edges': len(self.edge_targets), 'impacts': len(self.impact_targets), 'fingerprint': fingerprint}, file)
+
+
+    @classmethod
+    def load(cls, directory=DEFAULT_DIRECTORY, fingerprint=None):
+        """
+        Loads a graph saved by save(), or returns None if there isn't one in the directory.
+        If a fingerprint is given, then None is also returned if the graph was saved with a different one.
+        """
+        manifest_file_name = os.path.join(directory, cls.MANIFEST_FILE_NAME)
+        if not os.path.exists(manifest_file_name):
+            return None
+        if fingerprint is not None:
+            with open(manifest_file_name) as file:
+                if json.load(file).get('fingerprint') != fingerprint:
+                    return None
+        nodes_df = pd.read_parquet(os.path.join(directory, cls.NODES_FILE_NAME))
+        kinds = pd.Categorical(nodes_df['kind'], categories=cls.KINDS).codes.astype(np.int8)
+        with np.load(os.path.join(directory, cls.ARRAYS_FILE_NAME)) as arrays:
+            return cls(nodes_df['name'].tolist(), kinds, nodes_df['key'].tolist(), arrays['edge_offsets'], arrays['edge_targets'], arrays['edge_relations'],
+                       arrays['impact_offsets'], arrays['impact_targets'])
+
+
+    def _node(self, name, kind=None):
+        node = self.node_by_key.get(self._node_key(name, kind))
+        if node is None:
+            raise KeyError(f"Unknown {'service' if kind == 'SERVICE' else 'database object'}: {name}")
+        return node
+
+
+    def _group_by_kind(self, nodes):
+        result = {key: [] for key in self.IMPACT_KEYS.values()}
+        for node in nodes.tolist():
+            result[self.IMPACT_KEYS[self.KINDS[self.kinds[node]]]].append(self.names[node])
+        for names in result.values():
+            names.sort()
+        return result
+
+
+    def impact(self, name, kind=None):
+        """
+        Returns the names of everything that depends on the object, directly or indirectly, by kind, e.g.
+        {'tables': [...], 'views': [...], 'procedures': [...], 'functions': [...], 'triggers': [...], 'services': [...]}.
+        Use kind='SERVICE' for a service.
+        """
+        node = self._node(name, kind)
+        return self._group_by_kind(self.impact_targets[self.impact_offsets[node]:self.impact_offsets[node + 1]])
+
+
+    def is_affected_by(self, name, changed_name):
+        """
+        Returns True if the object depends on the changed object, directly or indirectly.
+        """
+        node = self._node(name)
+        changed_node = self._node(changed_name)
+        impacted = self.impact_targets[self.impact_offsets[changed_node]:self.impact_offsets[changed_node + 1]]
+        position = np.searchsorted(impacted, node)
+        return bool(position < len(impacted) and impacted[position] == node)
+
+
+    def dependencies(self, name, kind=None):
+        """
+        Returns the objects that the object depends on directly, as (name, kind, relation) tuples.
+        """
+        node = self._node(name, kind)
+        start, end = self.edge_offsets[node], self.edge_offsets[node + 1]
+        return [(self.names[target], self.KINDS[self.kinds[target]], self.RELATIONS[relation])
+                for target, relation in zip(self.edge_targets[start:end].tolist(), self.edge_relations[start:end].tolist())]
+
+
+    def statistics(self):
+        return {'nodes': len(self.names), 'edges': len(self.edge_targets), 'impacts': len(self.impact_targets)}
+
+
+class _GraphBuilder:
+    """
+    Collects the nodes and edges of a DependencyGraph, and computes the impact of each node.
+    """
+
+    def __init__(self) -> None:
+        self.names = []
+        self.kinds = []
+        self.keys = []
+        self.node_by_key = {}
+        self.node_by_name = {}
+        self.edges = set()
+
+
+    def node(self, name, kind):
+        """
+        Returns the number of the node, adding it if it's new.  A node keeps the kind it was first added with,
+        and the objects created by the DDL statements are added first, so e.g. a view that a procedure reads
+        from is a view rather than a table.
+        """
+        node = self.node_by_name.get((name, kind))
+        if node is not None:
+            return node
+        key = DependencyGraph._node_key(name, kind)
+        node = self.node_by_key.get(key)
+        if node is None:
+            node = self.node_by_key[key] = len(self.names)
+            self.names.append(str(name))
+            self.kinds.append(DependencyGraph.KINDS.index(kind))
+            self.keys.append(key)
+        self.node_by_name[(name, kind)] = node
+        return node
+
+
+    def edge(self, name, kind, dependency_name, dependency_kind, relation):
+        if not isinstance(name, str) or not isinstance(dependency_name, str):
+            return
+        node = self.node(name, kind)
+        dependency = self.node(dependency_name, dependency_kind)
+        if node != dependency:
+            self.edges.add((node, dependency, DependencyGraph.RELATIONS.index(relation)))
+
+
+    @staticmethod
+    def _compressed(number_of_nodes, sources, targets):
+        """
+        Returns the offsets and targets of the compressed sparse row arrays for the edges from the sources to
+        the targets, with the targets of each source in order.
+        """
+        sources = np.array(sources, dtype=np.int32)
+        targets = np.array(targets, dtype=np.int32)
+        order = np.lexsort((targets, sources))
+        offsets = np.searchsorted(sources[order], np.arange(number_of_nodes + 1)).astype(np.int64)
+        return offsets, targets[order]
+
+
+    @staticmethod
+    def _strongly_connected_components(number_of_nodes, successors):
+        """
+        Returns the strongly connected components of the graph, each one after all the components that it
+        can reach, using an iterative version of Tarjan's algorithm.
+        """
+        index = [-1] * number_of_nodes
+        low_link = [0] * number_of_nodes
+        on_stack = [False] * number_of_nodes
+        stack = []
+        components = []
+        counter = 0
+        for root in range(number_of_nodes):
+            if index[root] != -1:
+                continue
+            work = [(root, 0)]
+            while work:
+                node, child = work.pop()
+                if child == 0:
+                    index[node] = low_link[node] = counter
+                    counter += 1
+                    stack.append(node)
+                    on_stack[node] = True
+                recurse = False
+                for position in range(child, len(successors[node])):
+                    successor = successors[node][position]
+                    if index[successor] == -1:
+                        work.append((node, position + 1))
+                        work.append((successor, 0))
+                        recurse = True
+                        break
+                    if on_stack[successor]:
+                        low_link[node] = min(low_link[node], index[successor])
+                if recurse:
+                    continue
+                if low_link[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = False
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+                if work:
+                    parent = work[-1][0]
+                    low_link[parent] = min(low_link[parent], low_link[node])
+        return components
+
+
+    def _impacts(self):
+        """
+        Returns the nodes and the nodes they impact, i.e. that depend on them directly or indirectly, as two lists.
+        """
+        number_of_nodes = len(self.names)
+        dependents = [[] for _ in range(number_of_nodes)]
+        for node, dependency, _ in self.edges:
+            dependents[dependency].append(node)
+
+        # Each component comes after the components of its dependents, so their impact is already known.
+        component_of = [0] * number_of_nodes
+        impact_of_component = []
+        sources = []
+        targets = []
+        for component_number, component in enumerate(self._strongly_connected_components(number_of_nodes, dependents)):
+            impacted = set(component) if len(component) > 1 else set()
+            for node in component:
+                component_of[node] = component_number
+            for node in component:
+                for dependent in dependents[node]:
+                    dependent_component = component_of[dependent]
+                    if dependent_component != component_number:
+                        impacted.add(dependent)
+                        impacted |= impact_of_component[dependent_component]
+            impact_of_component.append(frozenset(impacted))
+            for node in component:
+                impacted_nodes = [impacted_node for impacted_node in impacted if impacted_node != node]
+                sources.extend([node] * len(impacted_nodes))
+                targets.extend(impacted_nodes)
+        return sources, targets
+
+
+    def graph(self, graph_class):
+        number_of_nodes = len(self.names)
+        edges = sorted(self.edges)
+        edge_offsets, edge_targets = self._compressed(number_of_nodes, [edge[0] for edge in edges], [edge[1] for edge in edges])
+        edge_relations = np.array([edge[2] for edge in edges], dtype=np.int8)
+        impact_offsets, impact_targets = self._compressed(number_of_nodes, *self._impacts())
+        return graph_class(self.names, np.array(self.kinds, dtype=np.int8), self.keys, edge_offsets, edge_targets, edge_relations, impact_offsets, impact_targets)
@@ -0,0 +1,124 @@
+import pandas as pd
+
+from lib.dependency_graph import DependencyGraph, ObjectReference, find_object_references
+from lib.service_definition import ServiceDefinition
+
+CODE = """
+CREATE TABLE Customers (CustomerID nchar(5))
+GO
+CREATE TABLE Orders (OrderID int, CustomerID nchar(5) REFERENCES dbo.Customers (CustomerID))
+GO
+CREATE TABLE [Order Details] (OrderID int)
+GO
+ALTER TABLE [Order Details] ADD CONSTRAINT FK_Order_Details_Orders FOREIGN KEY (OrderID) REFERENCES [dbo].[Orders] (OrderID)
+GO
+CREATE VIEW "Order Subtotals" AS
+SELECT OrderID, COUNT(*) AS Lines FROM [Order Details] GROUP BY OrderID
+GO
+CREATE PROCEDURE AddOrder @CustomerID nchar(5) AS
+EXEC @rc = dbo.CheckCustomer @CustomerID
+EXEC (@sql)
+INSERT INTO Orders (CustomerID) VALUES (@CustomerID)
+GO
+CREATE PROCEDURE CheckCustomer @CustomerID nchar(5) AS
+SELECT 1 FROM Customers WHERE CustomerID = @CustomerID
+GO
+CREATE PROCEDURE OrderReport AS
+SELECT * FROM "Order Subtotals"
+GO
+"""
+
+
+def build_graph(**options):
+    ddl_df = pd.DataFrame([
+        (name, operation, CODE) for name, operation in [
+            ('Customers', 'CREATE TABLE'), ('Orders', 'CREATE TABLE'), ('Order Details', 'CREATE TABLE'),
+            ('FK_Order_Details_Orders', 'CREATE CONSTRAINT'), ('Order Subtotals', 'CREATE VIEW'),
+            ('AddOrder', 'CREATE PROCEDURE'), ('CheckCustomer', 'CREATE PROCEDURE'), ('OrderReport', 'CREATE PROCEDURE'),
+            ('Audit', 'CREATE PROCEDURE'),
+        ]], columns=['db_object_name', 'sql_operation', 'sql_code'])
+    tables_df = pd.DataFrame([
+        ('Orders', 'INSERT', 'WRITE', 'AddOrder'),
+        ('Customers', 'SELECT', 'READ', 'CheckCustomer'),
+        ('Order_Subtotals', 'SELECT', 'READ', 'OrderReport'),
+        ('AddOrder', 'EXEC', 'NONE', 'Audit'),
+    ], columns=['table_name', 'sql_operation', 'operation_type', 'procedure_name'])
+    services = [ServiceDefinition('Orders', ['AddOrder', 'CheckCustomer'], ['Customers'], ['Orders']), ServiceDefinition('Reports', ['OrderReport'])]
+    return DependencyGraph.build(ddl_df, tables_df, services, **options)
+
+
+def test_references_are_found_in_the_code():
+    references = find_object_references(CODE)
+    assert ObjectReference('TABLE', 'Orders', 'FOREIGN KEY', 'Customers') in references
+    assert ObjectReference('TABLE', 'Order Details', 'FOREIGN KEY', 'Orders') in references
+    assert ObjectReference('VIEW', 'Order Subtotals', 'READ', 'Order Details') in references
+    assert ObjectReference('PROCEDURE', 'AddOrder', 'CALL', 'CheckCustomer') in references
+    # Dynamic SQL and the tables used by procedures, which come from the procedure to table map, aren't references.
+    assert len(references) == 4
+
+
+def test_impact_includes_everything_that_depends_on_an_object():
+    graph = build_graph()
+    assert graph.impact('dbo.Customers') == {
+        'tables': ['Order Details', 'Orders'],
+        'views': ['Order Subtotals'],
+        'procedures': ['AddOrder', 'Audit', 'CheckCustomer', 'OrderReport'],
+        'functions': [],
+        'triggers': [],
+        'services': ['Orders', 'Reports'],
+    }
+    assert graph.impact('[Order Details]')['procedures'] == ['OrderReport']
+    assert graph.impact('Audit')['procedures'] == []
+    assert graph.impact('Orders', kind='SERVICE')['services'] == []
+    assert graph.is_affected_by('Audit', 'CheckCustomer')
+    assert not graph.is_affected_by('CheckCustomer', 'Audit')
+    assert ('AddOrder', 'PROCEDURE', 'CALL') in graph.dependencies('Audit')
+    assert graph.dependencies('Orders', kind='SERVICE') == [('AddOrder', 'PROCEDURE', 'CONTAINS'), ('CheckCustomer', 'PROCEDURE', 'CONTAINS')]
+
+
+def test_procedures_that_call_each_other_impact_each_other():
+    ddl_df = pd.DataFrame({'db_object_name': ['A', 'B'], 'sql_operation': ['CREATE PROCEDURE'] * 2,
+                           'sql_code': ["CREATE PROCEDURE A AS\nEXEC B\nGO\n", "CREATE PROCEDURE B AS\nEXEC A\nGO\n"]})
+    tables_df = pd.DataFrame([('T', 'SELECT', 'READ', 'B')], columns=['table_name', 'sql_operation', 'operation_type', 'procedure_name'])
+    graph = DependencyGraph.build(ddl_df, tables_df)
+    assert graph.impact('T')['procedures'] == ['A', 'B']
+    assert graph.impact('A')['procedures'] == ['B']
+    assert graph.impact('B')['procedures'] == ['A']
+
+
+def test_services_that_share_a_name_are_kept_apart():
+    ddl_df = pd.DataFrame(columns=['db_object_name', 'sql_operation', 'sql_code'])
+    tables_df = pd.DataFrame([('Orders', 'UPDATE', 'WRITE', 'A'), ('Orders', 'INSERT', 'WRITE', 'B')],
+                             columns=['table_name', 'sql_operation', 'operation_type', 'procedure_name'])
+    graph = DependencyGraph.build(ddl_df, tables_df, [ServiceDefinition('Orders', ['A']), ServiceDefinition('Orders', ['B'])])
+    assert graph.impact('Orders')['services'] == ['Orders', 'Orders_2']
+    assert graph.dependencies('Orders_2', kind='SERVICE') == [('B', 'PROCEDURE', 'CONTAINS')]
+
+
+def test_the_graph_is_saved_and_loaded(tmp_path):
+    graph = build_graph()
+    graph.save(str(tmp_path / "graph"))
+    loaded = DependencyGraph.load(str(tmp_path / "graph"))
+    assert loaded.statistics() == graph.statistics()
+    for name in ['Customers', 'Orders', 'Order Subtotals', 'AddOrder']:
+        assert loaded.impact(name) == graph.impact(name)
+        assert loaded.dependencies(name) == graph.dependencies(name)
+    assert DependencyGraph.load(str(tmp_path / "missing")) is None
+
+
+def test_a_saved_graph_is_only_loaded_while_its_inputs_are_unchanged(tmp_path):
+    tables_df = pd.DataFrame([('Orders', 'UPDATE', 'WRITE', 'A')], columns=['table_name', 'sql_operation', 'operation_type', 'procedure_name'])
+    services = [ServiceDefinition('Orders', ['A'], [], ['Orders'])]
+    fingerprint = DependencyGraph.fingerprint("sources", tables_df, services)
+    build_graph().save(str(tmp_path / "graph"), fingerprint=fingerprint)
+
+    assert DependencyGraph.fingerprint("sources", tables_df.astype({'operation_type': 'category'}), services) == fingerprint
+    assert DependencyGraph.load(str(tmp_path / "graph"), fingerprint=fingerprint) is not None
+    assert DependencyGraph.load(str(tmp_path / "graph")) is not None
+    for changed_fingerprint in [
+        DependencyGraph.fingerprint("changed sources", tables_df, services),
+        DependencyGraph.fingerprint("sources", tables_df.assign(operation_type='READ'), services),
+        DependencyGraph.fingerprint("sources", tables_df, [ServiceDefinition('Orders', ['A', 'B'], [], ['Orders'])]),
+    ]:
+        assert changed_fingerprint != fingerprint
+        assert DependencyGraph.load(str(tmp_path / "graph"), fingerprint=changed_fingerprint) is None
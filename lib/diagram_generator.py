@@ -1,14 +1,55 @@
 
+import functools
+import hashlib
+import json
+import os
 import subprocess
 from typing import List
 from jinja2 import Template
-from lib.service_definition import ServiceDefinition
+from lib.instrumentation import Instrumentation
+from lib.service_definition import ServiceDefinition, unique_service_names
+from lib.worker_pool import WorkerPool
+
+
+@functools.lru_cache(maxsize=4)
+def _compile_template(template_text):
+    return Template(template_text)
+
+
+def render_diagram_texts(services, template_text):
+    """
+    Renders the PlantUML text of each diagram and hashes it, e.g. in a worker process.
+    services is a list of (service_name, procs, read_tables, write_tables) tuples.
+    Returns a (text, hash) pair for each service.
+    """
+    template = _compile_template(template_text)
+    results = []
+    for service_name, procedures, read_tables, write_tables in services:
+        text = template.render(service_name=service_name, procedures=procedures, read_tables=read_tables, write_tables=write_tables)
+        results.append((text, hashlib.sha256(text.encode('utf-8')).hexdigest()))
+    return results
 
 class DiagramGenerator:
     """
     Genaerates multiple diagrams based on the serive definitions provided.
+
+    In batch mode all the .puml files are written first, and then rendered by a single PlantUML process,
+    which renders the files on several threads.  This avoids starting a new JVM for every diagram.
+    Otherwise each diagram is rendered by a PlantUML process of its own.
+
+    When use_cache is True, diagrams whose text hasn't changed since they were last rendered are skipped,
+    as long as the image is still there.  The hashes of the rendered diagrams are kept in HASHES_FILE_NAME,
+    in the output directory.
+
+    If a worker_pool with more than one worker is given, then the diagram text is rendered on its
+    processes, a shard of services at a time.
     """
 
+    HASHES_FILE_NAME = 'diagram_hashes.json'
+
+    # The maximum number of files passed to one PlantUML process, to keep within the command line length limit.
+    MAX_FILES_PER_PROCESS = 200
+
     DIAGRAM_TEMPLATE = """
   @startuml "{{ service_name }}"
 
@@ -46,33 +87,93 @@ class DiagramGenerator:
   @enduml
   """
 
-    def __init__(self) -> None:
-        self.template = Template(DiagramGenerator.DIAGRAM_TEMPLATE)
-    
+    def __init__(self, output_directory="./results", batch=True, use_cache=True, plantuml_command="plantuml", run=subprocess.run, instrumentation=None, worker_pool=None) -> None:
+        self.output_directory = output_directory
+        self.batch = batch
+        self.use_cache = use_cache
+        self.plantuml_command = plantuml_command
+        self.run = run
+        self.instrumentation = instrumentation or Instrumentation()
+        self.worker_pool = worker_pool or WorkerPool()
+        self.rendered_count = 0
+        self.skipped_count = 0
+
 
-    def _generate_diagram(self, service_definition: ServiceDefinition) -> None:
+    def _diagram_path(self, name: str) -> str:
+        return os.path.join(self.output_directory, f"{name}.puml")
+
+
+    def _write_diagram(self, diagram_path: str, rendered_text: str) -> None:
         """
-        Generate a diagram for a single service definition.
+        Write the diagram text to a .puml file.
         """
-        rendered_text = self.template.render(
-             service_name= service_definition.service_name, 
-             procedures=service_definition.procs, 
-             read_tables=service_definition.read_tables, 
-             write_tables=service_definition.write_tables)
-        # print(rendered_text)
-
-        diagram_path = f"./results/{service_definition.service_name}.puml"
         with open(diagram_path, 'w') as file:
                 file.write(rendered_text)
 
-        cmd = f'plantuml {diagram_path}'
-        subprocess.run(cmd, shell=True, check=True)
 
+    def _render_files(self, diagram_paths: List[str]) -> None:
+        """
+        Render the .puml files to images with PlantUML.
+        """
+        if self.batch:
+            for i in range(0, len(diagram_paths), DiagramGenerator.MAX_FILES_PER_PROCESS):
+                paths = diagram_paths[i:i + DiagramGenerator.MAX_FILES_PER_PROCESS]
+                with self.instrumentation.timed('plantuml'):
+                    self.run([self.plantuml_command, '-nbthread', 'auto', *paths], check=True)
+        else:
+            for diagram_path in diagram_paths:
+                with self.instrumentation.timed('plantuml'):
+                    self.run([self.plantuml_command, diagram_path], check=True)
+
+
+    def _hashes_path(self) -> str:
+        return os.path.join(self.output_directory, DiagramGenerator.HASHES_FILE_NAME)
+
+
+    def _read_hashes(self) -> dict:
+        if not self.use_cache or not os.path.exists(self._hashes_path()):
+            return {}
+        with open(self._hashes_path()) as file:
+            return json.load(file)
+
+
+    def _write_hashes(self, hashes: dict) -> None:
+        with open(self._hashes_path(), 'w') as file:
+            json.dump(hashes, file, indent=2, sort_keys=True)
+
+
+    def _is_unchanged(self, diagram_path: str, text_hash: str, hashes: dict) -> bool:
+        image_path = os.path.splitext(diagram_path)[0] + '.png'
+        return hashes.get(diagram_path) == text_hash and os.path.exists(image_path)
 
 
     def generate(self, service_definitions: List[ServiceDefinition]) -> None:
         """
-        Generate diagrams for each service definition.
+        Generate diagrams for each service definition, skipping the diagrams that haven't changed.
         """
-        for service_definition in service_definitions:
-            self._generate_diagram(service_definition)
+        with self.instrumentation.stage('generate_diagrams'):
+            hashes = self._read_hashes()
+            changed_paths = []
+            services = [
+                (service_definition.service_name, service_definition.procs, service_definition.read_tables, service_definition.write_tables)
+                for service_definition in service_definitions
+            ]
+            rendered_texts = self.worker_pool.map(render_diagram_texts, services, DiagramGenerator.DIAGRAM_TEMPLATE)
+            # Services can share a name, so each diagram is named after a name that no other service has.
+            for name, (rendered_text, text_hash) in zip(unique_service_names(service_definitions), rendered_texts):
+                diagram_path = self._diagram_path(name)
+                unchanged = self._is_unchanged(diagram_path, text_hash, hashes)
+                if self.use_cache:
+                    self.instrumentation.record_cache('diagram_hashes', unchanged)
+                if unchanged:
+                    continue
+                self._write_diagram(diagram_path, rendered_text)
+                changed_paths.append(diagram_path)
+                hashes[diagram_path] = text_hash
+
+            self.skipped_count = len(service_definitions) - len(changed_paths)
+            self.rendered_count = len(changed_paths)
+            if changed_paths:
+                self._render_files(changed_paths)
+            self._write_hashes(hashes)
+        print(f"Rendered {self.rendered_count} diagrams, skipped {self.skipped_count} unchanged diagrams.")
@@ -0,0 +1,72 @@
+import os
+from lib.diagram_generator import DiagramGenerator
+from lib.service_definition import ServiceDefinition
+
+
+class FakePlantUml:
+    """
+    Records the PlantUML commands and writes an empty image for each diagram.
+    """
+
+    def __init__(self):
+        self.commands = []
+
+    def __call__(self, cmd, check):
+        self.commands.append(cmd)
+        for path in cmd[1:]:
+            if path.endswith('.puml'):
+                open(os.path.splitext(path)[0] + '.png', 'w').close()
+
+
+def make_services(n):
+    return [ServiceDefinition(f"Service{i}", [f"Proc{i}"], [f"Table{i}"], []) for i in range(n)]
+
+
+def test_generate_renders_all_diagrams_in_one_process(tmp_path):
+    plantuml = FakePlantUml()
+    DiagramGenerator(output_directory=str(tmp_path), run=plantuml).generate(make_services(5))
+
+    assert len(plantuml.commands) == 1
+    assert plantuml.commands[0][:3] == ["plantuml", "-nbthread", "auto"]
+    assert sorted(os.path.basename(path) for path in plantuml.commands[0][3:]) == [f"Service{i}.puml" for i in range(5)]
+
+
+def test_generate_skips_unchanged_diagrams(tmp_path):
+    DiagramGenerator(output_directory=str(tmp_path), run=FakePlantUml()).generate(make_services(5))
+
+    services = make_services(5)
+    services[2].procs = ["Proc2", "NewProc"]
+    plantuml = FakePlantUml()
+    generator = DiagramGenerator(output_directory=str(tmp_path), run=plantuml)
+    generator.generate(services)
+
+    assert plantuml.commands == [["plantuml", "-nbthread", "auto", str(tmp_path / "Service2.puml")]]
+    assert generator.skipped_count == 4
+    assert "NewProc" in (tmp_path / "Service2.puml").read_text()
+
+
+def test_generate_renders_missing_images_and_without_cache(tmp_path):
+    DiagramGenerator(output_directory=str(tmp_path), run=FakePlantUml()).generate(make_services(3))
+    os.remove(tmp_path / "Service1.png")
+
+    plantuml = FakePlantUml()
+    DiagramGenerator(output_directory=str(tmp_path), run=plantuml).generate(make_services(3))
+    assert plantuml.commands == [["plantuml", "-nbthread", "auto", str(tmp_path / "Service1.puml")]]
+
+    plantuml = FakePlantUml()
+    DiagramGenerator(output_directory=str(tmp_path), batch=False, use_cache=False, run=plantuml).generate(make_services(3))
+    assert plantuml.commands == [["plantuml", str(tmp_path / f"Service{i}.puml")] for i in range(3)]
+
+
+def test_services_with_the_same_name_get_diagrams_of_their_own(tmp_path):
+    services = [ServiceDefinition("Orders", ["AddOrder"], [], ["Orders"]), ServiceDefinition("Orders", ["ShipOrder"], [], ["Orders"])]
+    plantuml = FakePlantUml()
+    DiagramGenerator(output_directory=str(tmp_path), run=plantuml).generate(services)
+    assert plantuml.commands[0][3:] == [str(tmp_path / "Orders.puml"), str(tmp_path / "Orders_2.puml")]
+    assert "ShipOrder" in (tmp_path / "Orders_2.puml").read_text()
+
+    plantuml = FakePlantUml()
+    generator = DiagramGenerator(output_directory=str(tmp_path), run=plantuml)
+    generator.generate(services)
+    assert plantuml.commands == []
+    assert generator.skipped_count == 2
@@ -0,0 +1,143 @@
+import numpy as np
+
+from lib.service_extractor import ServiceExtractor
+
+
+class GraphServiceExtractor(ServiceExtractor):
+    """
+    Extracts services by partitioning the bipartite graph of procedures and the tables they use.
+
+    Service boundaries follow shared write access, so rather than comparing names, the extractor builds a
+    sparse procedure x table adjacency matrix, in which writes are weighted write_weight and reads are
+    weighted read_weight.  Other operations, e.g. calling a procedure, don't add an edge.
+
+    The graph is first split into its connected components, since procedures that share no tables can't
+    belong to the same service.  Components with fewer than min_partition_size procedures become services
+    as they are.  The larger components are partitioned by label propagation: each table takes the label
+    with the most weight among its procedures, then each procedure takes the label with the most weight
+    among its tables, until the labels stop changing.  A table's vote is divided by the number of
+    procedures that use it, so widely shared lookup tables don't pull every procedure into one service.
+
+    Each step is a sparse matrix product, so the time taken grows roughly linearly with the number of
+    edges, and ties are broken by order of appearance, so the results are deterministic.
+    """
+
+    CACHE_FILE_NAME = './results/graph_service_candidates_cache.csv'
+
+    def __init__(self, tables_df, use_cache=False, write_weight=3.0, read_weight=1.0, min_partition_size=10, max_iterations=20, instrumentation=None) -> None:
+        super().__init__(tables_df, use_cache=use_cache, instrumentation=instrumentation)
+        self.write_weight = write_weight
+        self.read_weight = read_weight
+        self.min_partition_size = min_partition_size
+        self.max_iterations = max_iterations
+
+
+    def config(self):
+        return {
+            'kind': type(self).__name__,
+            'write_weight': self.write_weight,
+            'read_weight': self.read_weight,
+            'min_partition_size': self.min_partition_size,
+            'max_iterations': self.max_iterations,
+        }
+
+
+    def _build_adjacency_matrix(self, df):
+        """
+        Returns the procedure names, the table names and the weighted procedure x table adjacency matrix.
+        """
+        import scipy.sparse as sp
+
+        procedure_codes, procedure_names = df['procedure_name'].factorize()
+        table_codes, table_names = df['table_name'].factorize()
+        weights = df['operation_type'].astype(str).map({'WRITE': self.write_weight, 'READ': self.read_weight}).fillna(0.0).to_numpy()
+        # Duplicate edges are summed when the matrix is converted to CSR.
+        adjacency = sp.coo_matrix(
+            (weights, (procedure_codes, table_codes)), shape=(len(procedure_names), len(table_names))
+        ).tocsr()
+        adjacency.eliminate_zeros()
+        return list(procedure_names), list(table_names), adjacency
+
+
+    @staticmethod
+    def _strongest_labels(votes, current_labels):
+        """
+        Returns the label with the most votes in each row, keeping the current label for rows with no votes.
+        Ties are broken in favour of the lowest label.
+        """
+        votes = votes.tocsr()
+        votes.sum_duplicates()
+        labels = current_labels.copy()
+        counts = np.diff(votes.indptr)
+        voted = counts > 0
+        if not voted.any():
+            return labels
+        starts = votes.indptr[:-1][voted]
+        row_max = np.repeat(np.maximum.reduceat(votes.data, starts), counts[voted])
+        candidates = np.where(np.isclose(votes.data, row_max), votes.indices, np.iinfo(votes.indices.dtype).max)
+        labels[voted] = np.minimum.reduceat(candidates, starts)
+        return labels
+
+
+    def _propagate_labels(self, adjacency):
+        """
+        Partitions the procedures of a connected bipartite graph by label propagation.
+        Returns a label for each procedure.
+        """
+        import scipy.sparse as sp
+
+        n_procedures, n_tables = adjacency.shape
+        procedure_labels = np.arange(n_procedures)
+        table_labels = np.zeros(n_tables, dtype=int)
+
+        # Divide each table's votes by the number of procedures that use it.
+        table_degree = np.asarray((adjacency > 0).sum(axis=0)).ravel()
+        normalized = adjacency @ sp.diags(1.0 / np.maximum(table_degree, 1))
+
+        for _ in range(self.max_iterations):
+            procedure_one_hot = sp.csr_matrix((np.ones(n_procedures), (np.arange(n_procedures), procedure_labels)), shape=(n_procedures, n_procedures))
+            table_labels = self._strongest_labels(adjacency.T @ procedure_one_hot, table_labels)
+
+            table_one_hot = sp.csr_matrix((np.ones(n_tables), (np.arange(n_tables), table_labels)), shape=(n_tables, n_procedures))
+            new_labels = self._strongest_labels(normalized @ table_one_hot, procedure_labels)
+            if np.array_equal(new_labels, procedure_labels):
+                break
+            procedure_labels = new_labels
+
+        return procedure_labels
+
+
+    def _partition(self, adjacency):
+        """
+        Returns a cluster label for each procedure, numbered in order of first appearance.
+        """
+        import scipy.sparse as sp
+        from scipy.sparse.csgraph import connected_components
+
+        n_procedures, n_tables = adjacency.shape
+        graph = sp.bmat([[None, adjacency], [adjacency.T, None]], format='csr')
+        _, component_labels = connected_components(graph, directed=False)
+        procedure_components = component_labels[:n_procedures]
+
+        labels = procedure_components.astype(np.int64) * n_procedures
+        component_sizes = np.bincount(procedure_components)
+        for component in np.flatnonzero(component_sizes >= self.min_partition_size):
+            procedures = np.flatnonzero(procedure_components == component)
+            tables = np.flatnonzero(component_labels[n_procedures:] == component)
+            labels[procedures] += self._propagate_labels(adjacency[procedures][:, tables])
+
+        # Renumber the clusters in order of first appearance, so that the labels are stable.
+        _, first_appearance, inverse = np.unique(labels, return_index=True, return_inverse=True)
+        order = np.empty_like(first_appearance)
+        order[np.argsort(first_appearance)] = np.arange(len(first_appearance))
+        return order[inverse]
+
+
+    def _assign_clusters(self, df):
+        """
+        Adds the cluster_label column to the data frame, by partitioning the procedure x table graph.
+        """
+        procedure_names, _, adjacency = self._build_adjacency_matrix(df)
+        labels = self._partition(adjacency)
+        df['cluster_label'] = df['procedure_name'].map(dict(zip(procedure_names, labels)))
+        return df
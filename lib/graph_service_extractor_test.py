@@ -0,0 +1,59 @@
+import pandas as pd
+from lib.graph_service_extractor import GraphServiceExtractor
+from test_support.synthetic_schema import make_tables_df as make_synthetic_tables_df
+
+
+def make_tables_df(services=3, procedures_per_service=10):
+    # Every procedure reads the shared lookup tables, so the whole graph is connected.
+    return make_synthetic_tables_df(services, procedures_per_service, shared_lookups=("Shared_Lookup", "Shared_Codes"))
+
+
+def extract(tables_df, tmp_path, monkeypatch, **kwargs):
+    monkeypatch.setattr(GraphServiceExtractor, 'CACHE_FILE_NAME', str(tmp_path / "services.csv"))
+    return GraphServiceExtractor(tables_df, **kwargs).extract()
+
+
+def test_extract_partitions_by_shared_writes(tmp_path, monkeypatch):
+    service_definitions = extract(make_tables_df(), tmp_path, monkeypatch)
+
+    assert [s.service_name for s in service_definitions] == ["Table0", "Table1", "Table2"]
+    for i, service_definition in enumerate(service_definitions):
+        assert set(service_definition.procs) == {f"Service{i}_Proc{p}" for p in range(10)}
+        assert set(service_definition.write_tables) == {f"Table{i}"}
+
+
+def test_extract_keeps_small_components_whole(tmp_path, monkeypatch):
+    small = pd.DataFrame([
+        ("Audit", 'INSERT', 'WRITE', "LogChange"),
+        ("Audit", 'SELECT', 'READ', "ReadLog"),
+        ("Other", 'EXEC', 'NONE', "CallOther"),
+    ], columns=['table_name', 'sql_operation', 'operation_type', 'procedure_name'])
+    tables_df = pd.concat([make_tables_df(), small], ignore_index=True)
+    service_definitions = extract(tables_df, tmp_path, monkeypatch)
+
+    procs_by_service = {s.service_name: set(s.procs) for s in service_definitions}
+    assert procs_by_service["Audit"] == {"LogChange", "ReadLog"}
+    assert procs_by_service["Other"] == {"CallOther"}
+    assert len(service_definitions) == 5
+
+
+def test_extract_is_deterministic(tmp_path, monkeypatch):
+    tables_df = make_tables_df(services=5)
+    first = extract(tables_df.copy(), tmp_path, monkeypatch)
+    second = extract(tables_df.sample(frac=1, random_state=1).reset_index(drop=True), tmp_path, monkeypatch)
+    assert sorted(sorted(s.procs) for s in first) == sorted(sorted(s.procs) for s in second)
+
+
+def test_extract_accepts_categorical_columns(tmp_path, monkeypatch):
+    # The procedure to table map is read back from its Parquet cache with categorical operation columns.
+    tables_df = make_tables_df().astype({'sql_operation': 'category', 'operation_type': 'category'})
+    service_definitions = extract(tables_df, tmp_path, monkeypatch)
+    assert [s.service_name for s in service_definitions] == ["Table0", "Table1", "Table2"]
+
+
+def test_extract_leaves_the_table_map_unchanged(tmp_path, monkeypatch):
+    tables_df = make_tables_df()
+    tables_df.loc[0, 'table_name'] = "Order Details"
+    original = tables_df.copy()
+    extract(tables_df, tmp_path, monkeypatch)
+    pd.testing.assert_frame_equal(tables_df, original)
@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+from lib.catalogue_store import read_table_map, write_table_map
+from lib.service_definition import service_definitions_from_dataframe
+from lib.service_extractor import ServiceExtractor
+from lib.sql_batch_reader import SqlBatchReader
+from lib.stored_procedure_to_table_mapper import StoredProcedureToTableMapper
+
+
+class IncrementalUpdater:
+    """
+    Updates the procedure map and the services from the results of the last run, so that only the
+    procedures that have changed are mapped again.
+
+    A manifest of the source file hashes, the procedure hashes and the service extractor's config is kept
+    in the results directory, along with the procedure map and the services from the last run.  On each run:
+    - if none of the source files have changed, the services from the last run are returned as they are,
+    - otherwise the procedures whose code has changed, or that are new, are mapped with the LLM and
+      the procedures that have been removed are dropped from the map,
+    - the new and changed procedures are assigned to the existing service with the nearest centroid,
+      with the extractor's assign_to_nearest_services, rather than clustering all the procedures again,
+      so the other services keep their procedures and their names.
+
+    The services are extracted from scratch with create_service_extractor(tables_df), which defaults to a
+    ServiceExtractor, on the first run, on a run without the results of a previous run, and on a run with
+    a different kind of extractor or different extractor settings from the last run, e.g. --graph-services.
+    The extractor's cache file is neither read nor written, since the services are kept in the results directory.
+
+    After each update, the procedure map is available in the tables_df attribute.
+    """
+
+    MANIFEST_FILE_NAME = 'incremental_manifest.json'
+    TABLES_FILE_NAME = 'incremental_tables_to_procs.parquet'
+    SERVICES_FILE_NAME = 'incremental_services.csv'
+
+    def __init__(self, sql_code_parser, results_directory="./results", batch_token_budget=None, create_service_extractor=ServiceExtractor, instrumentation=None) -> None:
+        self.sql_code_parser = sql_code_parser
+        self.mapper = StoredProcedureToTableMapper(sql_code_parser, use_cache=False, batch_token_budget=batch_token_budget, instrumentation=instrumentation)
+        self.results_directory = results_directory
+        self.create_service_extractor = create_service_extractor
+        self.changed_procedures = []
+        self.removed_procedures = []
+        self.tables_df = None
+
+
+    def _path(self, file_name):
+        return os.path.join(self.results_directory, file_name)
+
+
+    @staticmethod
+    def _hash(data):
+        return hashlib.sha256(data).hexdigest()
+
+
+    def source_file_hashes(self):
+        """
+        Returns the sha256 hash of each source file, by path.
+        """
+        reader = SqlBatchReader(self.sql_code_parser.source_directory, self.sql_code_parser.source_file_glob_pattern)
+        hashes = {}
+        for path in reader.file_paths():
+            digest = hashlib.sha256()
+            with open(path, 'rb') as file:
+                for block in iter(lambda: file.read(1 << 20), b''):
+                    digest.update(block)
+            hashes[path] = digest.hexdigest()
+        return hashes
+
+
+    def _read_manifest(self):
+        if not os.path.exists(self._path(self.MANIFEST_FILE_NAME)):
+            return {}
+        with open(self._path(self.MANIFEST_FILE_NAME)) as file:
+            return json.load(file)
+
+
+    def _write_manifest(self, manifest):
+        with open(self._path(self.MANIFEST_FILE_NAME), 'w') as file:
+            json.dump(manifest, file, indent=2, sort_keys=True)
+
+
+    def _read_csv(self, file_name):
+        path = self._path(file_name)
+        return pd.read_csv(path) if os.path.exists(path) else None
+
+
+    @staticmethod
+    def _procedures_with_code(procedure_code_by_name):
+        """
+        Drops the procedures whose code couldn't be found, as they can't be hashed or mapped.
+        """
+        missing = [name for name, code in procedure_code_by_name.items() if code is None]
+        if missing:
+            print(f"Skipping {len(missing)} procedures whose code couldn't be found: {missing}")
+        return {name: code for name, code in procedure_code_by_name.items() if code is not None}
+
+
+    def _read_table_map(self):
+        path = self._path(self.TABLES_FILE_NAME)
+        return read_table_map(path) if os.path.exists(path) else None
+
+
+    def _update_table_map(self, procedure_code_by_name, previous_tables_df, previous_hashes):
+        """
+        Maps the new and changed procedures, and merges them with the unchanged procedures from the last run.
+        """
+        procedure_hashes = {name: self._hash(code.encode('utf-8', errors='surrogateescape')) for name, code in procedure_code_by_name.items()}
+        if previous_tables_df is None:
+            previous_hashes = {}
+
+        self.changed_procedures = [name for name, code_hash in procedure_hashes.items() if previous_hashes.get(name) != code_hash]
+        self.removed_procedures = [name for name in previous_hashes if name not in procedure_hashes]
+
+        changed_tables_df = self.mapper.map_procedure_code({name: procedure_code_by_name[name] for name in self.changed_procedures})
+        if previous_tables_df is None:
+            return changed_tables_df, procedure_hashes
+
+        stale = set(self.changed_procedures) | set(self.removed_procedures)
+        unchanged_tables_df = previous_tables_df[~previous_tables_df['procedure_name'].isin(stale)]
+        tables_df = pd.concat([unchanged_tables_df, changed_tables_df], ignore_index=True)
+        return tables_df, procedure_hashes
+
+
+    def update(self, ddl_df):
+        """
+        Returns the service definitions for the procedures in the DDL statements DataFrame, updating the
+        results of the last run.
+        """
+        manifest = self._read_manifest()
+        file_hashes = self.source_file_hashes()
+        previous_services_df = self._read_csv(self.SERVICES_FILE_NAME)
+        previous_tables_df = self._read_table_map()
+
+        if manifest.get('files') == file_hashes and previous_services_df is not None:
+            if manifest.get('service_extractor') == self.create_service_extractor(previous_tables_df).config():
+                print("No source files have changed since the last run.")
+                self.changed_procedures, self.removed_procedures = [], []
+                self.tables_df = previous_tables_df
+                return service_definitions_from_dataframe(previous_services_df)
+
+        procedure_code_by_name = self._procedures_with_code(self.mapper.find_procedure_code(ddl_df))
+        tables_df, procedure_hashes = self._update_table_map(procedure_code_by_name, previous_tables_df, manifest.get('procedures', {}))
+        print(f"Mapped {len(self.changed_procedures)} new or changed procedures, removed {len(self.removed_procedures)} procedures.")
+
+        extractor = self.create_service_extractor(tables_df.copy())
+        extractor_config = extractor.config()
+        services_df = None
+        if previous_services_df is not None and manifest.get('service_extractor') != extractor_config:
+            print("The service extractor settings have changed since the last run.")
+        elif previous_services_df is not None:
+            services_df = extractor.assign_to_nearest_services(previous_services_df, self.changed_procedures)
+        if services_df is None:
+            print("Extracting the services from scratch.")
+            services_df = extractor.extract_dataframe_without_cache()
+
+        write_table_map(self._path(self.TABLES_FILE_NAME), tables_df)
+        self.tables_df = tables_df
+        services_df.to_csv(self._path(self.SERVICES_FILE_NAME), index=False)
+        self._write_manifest({'files': file_hashes, 'procedures': procedure_hashes, 'service_extractor': extractor_config})
+        return service_definitions_from_dataframe(services_df)
@@ -0,0 +1,102 @@
+import json
+import pandas as pd
+import pytest
+from lib.graph_service_extractor import GraphServiceExtractor
+from lib.incremental_updater import IncrementalUpdater
+from lib.service_extractor import ServiceExtractor
+from lib.sql_code_parser import SqlCodeParser
+from test_support.fake_llm import FakeTableChatModel
+
+
+def procedure_code(name, service):
+    return f"CREATE PROCEDURE {name} AS\nUPDATE Table{service} SET X = 1\nSELECT * FROM Lookup{service}\nGO\n"
+
+
+def write_source(source_directory, procedures):
+    code = "".join(procedure_code(name, service) for name, service in procedures.items())
+    (source_directory / "procs.sql").write_text(code)
+    return pd.DataFrame({
+        'db_object_name': list(procedures),
+        'sql_operation': 'CREATE PROCEDURE',
+        'sql_code': [procedure_code(name, service) for name, service in procedures.items()],
+    })
+
+
+@pytest.fixture
+def source_directory(tmp_path, monkeypatch):
+    monkeypatch.setattr(GraphServiceExtractor, 'CACHE_FILE_NAME', str(tmp_path / "graph_services.csv"))
+    monkeypatch.setattr(ServiceExtractor, 'CACHE_FILE_NAME', str(tmp_path / "services.csv"))
+    directory = tmp_path / "source"
+    directory.mkdir()
+    return directory
+
+
+def run(source_directory, procedures, create_service_extractor=GraphServiceExtractor, missing_procedures=()):
+    ddl_df = write_source(source_directory, procedures)
+    ddl_df = pd.concat([ddl_df, pd.DataFrame({'db_object_name': list(missing_procedures), 'sql_operation': 'CREATE PROCEDURE', 'sql_code': "GO\n"})])
+    chat_model = FakeTableChatModel()
+    parser = SqlCodeParser(
+        source_directory=str(source_directory),
+        use_cache=False,
+        debug=False,
+        result_cache_file_name=str(source_directory.parent / "results.sqlite"),
+        chat_model=chat_model,
+        use_table_access_analyzer=False,
+    )
+    updater = IncrementalUpdater(parser, results_directory=str(source_directory.parent), create_service_extractor=create_service_extractor)
+    service_definitions = updater.update(ddl_df)
+    procs_by_service = {s.service_name: set(s.procs) for s in service_definitions}
+    return procs_by_service, chat_model.calls
+
+
+def test_update_only_maps_changed_procedures(source_directory):
+    procedures = {f"S{service}P{p}": service for service in range(3) for p in range(4)}
+    first, calls = run(source_directory, procedures)
+    assert calls == 12
+    assert first["Table1"] == {f"S1P{p}" for p in range(4)}
+
+    second, calls = run(source_directory, procedures)
+    assert calls == 0
+    assert second == first
+
+    # Move a procedure to another service, add a new one and remove one.
+    procedures["S0P0"] = 2
+    procedures["S1P9"] = 1
+    del procedures["S2P3"]
+    third, calls = run(source_directory, procedures)
+    assert calls == 2
+    assert third["Table0"] == {"S0P1", "S0P2", "S0P3"}
+    assert third["Table1"] == {f"S1P{p}" for p in range(4)} | {"S1P9"}
+    assert third["Table2"] == {"S0P0", "S2P0", "S2P1", "S2P2"}
+
+
+def test_a_change_of_service_extractor_extracts_the_services_again(source_directory):
+    procedures = {f"S{service}P{p}": service for service in range(3) for p in range(4)}
+    run(source_directory, procedures)
+    manifest_path = source_directory.parent / IncrementalUpdater.MANIFEST_FILE_NAME
+    assert json.loads(manifest_path.read_text())['service_extractor']['kind'] == 'GraphServiceExtractor'
+
+    # The procedure map is reused, but the services are extracted with the new settings.
+    ignore_reads = lambda tables_df: GraphServiceExtractor(tables_df, min_partition_size=100, read_weight=0.0)
+    _, calls = run(source_directory, procedures, ignore_reads)
+    assert calls == 0
+    assert json.loads(manifest_path.read_text())['service_extractor']['read_weight'] == 0.0
+
+    # The extractor's cache file holds services from another run, which are ignored and left as they are.
+    stale_services = "procedure_name,table_name,cluster_label,service_name\nS0P0,Table0,0,Stale\n"
+    with open(ServiceExtractor.CACHE_FILE_NAME, 'w') as file:
+        file.write(stale_services)
+    create_service_extractor = lambda tables_df: ServiceExtractor(tables_df, number_of_clusters=2, use_cache=True)
+    services, calls = run(source_directory, procedures, create_service_extractor)
+    assert calls == 0
+    assert len(services) == 2 and "Stale" not in services
+    with open(ServiceExtractor.CACHE_FILE_NAME) as file:
+        assert file.read() == stale_services
+    assert json.loads(manifest_path.read_text())['service_extractor']['kind'] == 'ServiceExtractor'
+
+
+def test_procedures_without_code_are_skipped(source_directory):
+    procedures = {f"S{service}P{p}": service for service in range(2) for p in range(2)}
+    services, calls = run(source_directory, procedures, missing_procedures=["Missing"])
+    assert calls == 4
+    assert set().union(*services.values()) == set(procedures)
@@ -0,0 +1,217 @@
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+def percentile(values, fraction):
+    """
+    Returns the nearest rank percentile of the values, e.g. fraction=0.9 for the 90th percentile.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def peak_memory_bytes():
+    """
+    Returns the peak resident memory of this process and of its finished child processes, in bytes,
+    or None if it can't be measured on this platform.
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux.
+    return {
+        'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024,
+    }
+
+
+class Instrumentation:
+    """
+    Records where the time goes in a run of the pipeline, so that runs can be sized and regressions caught.
+
+    It records:
+    - the wall time of each stage, e.g. parsing the DDL statements or generating the diagrams,
+    - the wall time of each call within a stage, by call name, e.g. each PlantUML invocation,
+    - the latency and the prompt and completion token counts of each LLM request,
+    - the hits and misses of each cache,
+    - the number of bytes of source code read,
+    - the peak memory use of the process.
+
+    The components take an optional instrumentation object, so one can be shared by all the stages of
+    a run.  It is thread safe, as the LLM requests are sent from worker threads.  The results are
+    available as a dictionary from report(), as JSON or as OpenMetrics text.
+    """
+
+    METRIC_PREFIX = 'src_insights'
+
+    def __init__(self, clock=time.perf_counter) -> None:
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.calls = {}
+        self.llm_latencies = []
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.caches = {}
+        self.bytes_ingested = 0
+
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Times a stage of the pipeline.  The time is added to any earlier time recorded for the stage.
+        """
+        start = self.clock()
+        try:
+            yield
+        finally:
+            elapsed = self.clock() - start
+            with self.lock:
+                self.stages[name] = self.stages.get(name, 0.0) + elapsed
+
+
+    @contextmanager
+    def timed(self, name):
+        """
+        Times a single call.
+        """
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.record_call(name, self.clock() - start)
+
+
+    def record_call(self, name, seconds):
+        with self.lock:
+            self.calls.setdefault(name, []).append(seconds)
+
+
+    def record_llm_call(self, name, seconds, prompt_tokens, completion_tokens):
+        """
+        Records an LLM request, which is also recorded as a call named "llm.<name>".
+        """
+        with self.lock:
+            self.calls.setdefault(f"llm.{name}", []).append(seconds)
+            self.llm_latencies.append(seconds)
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+
+
+    def record_cache(self, name, hit):
+        with self.lock:
+            counts = self.caches.setdefault(name, {'hits': 0, 'misses': 0})
+            counts['hits' if hit else 'misses'] += 1
+
+
+    def add_bytes_ingested(self, count):
+        with self.lock:
+            self.bytes_ingested += count
+
+
+    @staticmethod
+    def _summarize(durations):
+        return {
+            'count': len(durations),
+            'total_seconds': sum(durations),
+            'p50_seconds': percentile(durations, 0.5),
+            'p90_seconds': percentile(durations, 0.9),
+            'p99_seconds': percentile(durations, 0.99),
+            'max_seconds': max(durations) if durations else None,
+        }
+
+
+    def report(self):
+        """
+        Returns the measurements as a dictionary.
+        """
+        with self.lock:
+            return {
+                'stages': {name: {'seconds': seconds} for name, seconds in self.stages.items()},
+                'calls': {name: self._summarize(durations) for name, durations in self.calls.items()},
+                'llm': {
+                    **self._summarize(self.llm_latencies),
+                    'prompt_tokens': self.prompt_tokens,
+                    'completion_tokens': self.completion_tokens,
+                },
+                'caches': {
+                    name: {**counts, 'hit_ratio': counts['hits'] / (counts['hits'] + counts['misses'])}
+                    for name, counts in self.caches.items()
+                },
+                'bytes_ingested': self.bytes_ingested,
+                'peak_memory_bytes': peak_memory_bytes(),
+            }
+
+
+    def write_json(self, file_name):
+        with open(file_name, 'w') as file:
+            json.dump(self.report(), file, indent=2)
+
+
+    @staticmethod
+    def _escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+    def openmetrics(self):
+        """
+        Returns the measurements in the OpenMetrics text format.
+        """
+        report = self.report()
+        prefix = self.METRIC_PREFIX
+        lines = []
+
+        def metric(name, metric_type, samples, unit=None):
+            lines.append(f"# TYPE {prefix}_{name} {metric_type}")
+            if unit:
+                lines.append(f"# UNIT {prefix}_{name} {unit}")
+            for suffix, labels, value in samples:
+                if value is None:
+                    continue
+                label_text = ",".join(f'{key}="{self._escape(label)}"' for key, label in labels.items())
+                lines.append(f"{prefix}_{name}{suffix}{{{label_text}}} {value}" if label_text else f"{prefix}_{name}{suffix} {value}")
+
+        metric('stage_seconds', 'gauge', [('', {'stage': name}, stage['seconds']) for name, stage in report['stages'].items()], 'seconds')
+
+        quantiles = [('0.5', 'p50_seconds'), ('0.9', 'p90_seconds'), ('0.99', 'p99_seconds')]
+        call_samples = []
+        for name, summary in report['calls'].items():
+            for quantile, key in quantiles:
+                call_samples.append(('', {'call': name, 'quantile': quantile}, summary[key]))
+            call_samples.append(('_sum', {'call': name}, summary['total_seconds']))
+            call_samples.append(('_count', {'call': name}, summary['count']))
+        metric('call_seconds', 'summary', call_samples, 'seconds')
+
+        llm = report['llm']
+        metric('llm_latency_seconds', 'summary', [('', {'quantile': quantile}, llm[key]) for quantile, key in quantiles] + [
+            ('_sum', {}, llm['total_seconds']),
+            ('_count', {}, llm['count']),
+        ], 'seconds')
+        metric('llm_tokens', 'counter', [
+            ('_total', {'kind': 'prompt'}, llm['prompt_tokens']),
+            ('_total', {'kind': 'completion'}, llm['completion_tokens']),
+        ])
+
+        metric('cache_hits', 'counter', [('_total', {'cache': name}, cache['hits']) for name, cache in report['caches'].items()])
+        metric('cache_misses', 'counter', [('_total', {'cache': name}, cache['misses']) for name, cache in report['caches'].items()])
+        metric('ingested_bytes', 'counter', [('_total', {}, report['bytes_ingested'])], 'bytes')
+        peak_memory = report['peak_memory_bytes'] or {}
+        metric('peak_memory_bytes', 'gauge', [('', {'process': name}, value) for name, value in peak_memory.items()], 'bytes')
+
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+    def write_openmetrics(self, file_name):
+        with open(file_name, 'w') as file:
+            file.write(self.openmetrics())
@@ -0,0 +1,111 @@
+from types import SimpleNamespace
+
+from langchain.schema import AIMessage
+
+from lib.instrumentation import Instrumentation, percentile
+from lib.sql_code_parser import SqlCodeParser
+from test_support.fake_llm import approximate_token_count
+
+
+class FakeClock:
+    """
+    A clock that advances by one second each time it is read.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        self.now += 1.0
+        return self.now
+
+
+class FakeGeneratingChatModel:
+    """
+    A local stand in for the OpenAI chat model, which reports the token usage of each request like the real one does.
+    """
+
+    def generate(self, messages_list):
+        message = AIMessage(content='[{"table_name": "Orders", "sql_operation": "SELECT"}]')
+        return SimpleNamespace(
+            generations=[[SimpleNamespace(message=message)]],
+            llm_output={'token_usage': {'prompt_tokens': 120, 'completion_tokens': 15}})
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 0.5) == 50
+    assert percentile(values, 0.9) == 90
+    assert percentile(values, 0.99) == 99
+    assert percentile([], 0.5) is None
+
+
+def test_stages_and_calls_are_timed():
+    instrumentation = Instrumentation(clock=FakeClock())
+    with instrumentation.stage('parse_ddl'):
+        with instrumentation.timed('plantuml'):
+            pass
+    with instrumentation.stage('parse_ddl'):
+        pass
+
+    report = instrumentation.report()
+    assert report['stages']['parse_ddl']['seconds'] == 4.0
+    assert report['calls']['plantuml']['count'] == 1
+    assert report['calls']['plantuml']['total_seconds'] == 1.0
+
+
+def test_report_includes_llm_tokens_and_cache_hit_ratios():
+    instrumentation = Instrumentation()
+    instrumentation.record_llm_call('ddl_statements', 0.5, 100, 10)
+    instrumentation.record_llm_call('ddl_statements', 1.5, 200, 20)
+    instrumentation.record_cache('llm_result_cache', True)
+    for _ in range(3):
+        instrumentation.record_cache('llm_result_cache', False)
+    instrumentation.add_bytes_ingested(2048)
+
+    report = instrumentation.report()
+    assert report['llm']['count'] == 2
+    assert report['llm']['prompt_tokens'] == 300
+    assert report['llm']['completion_tokens'] == 30
+    assert report['llm']['max_seconds'] == 1.5
+    assert report['calls']['llm.ddl_statements']['count'] == 2
+    assert report['caches']['llm_result_cache'] == {'hits': 1, 'misses': 3, 'hit_ratio': 0.25}
+    assert report['bytes_ingested'] == 2048
+
+
+def test_openmetrics():
+    instrumentation = Instrumentation(clock=FakeClock())
+    with instrumentation.stage('parse_ddl'):
+        pass
+    instrumentation.record_llm_call('ddl_statements', 0.5, 100, 10)
+    instrumentation.record_cache('parsed_code_cache', False)
+
+    text = instrumentation.openmetrics()
+    assert 'src_insights_stage_seconds{stage="parse_ddl"} 1.0' in text
+    assert 'src_insights_llm_tokens_total{kind="prompt"} 100' in text
+    assert 'src_insights_cache_misses_total{cache="parsed_code_cache"} 1' in text
+    assert text.endswith("# EOF\n")
+
+
+def test_parser_records_llm_token_usage_and_cache_hits(tmp_path):
+    instrumentation = Instrumentation()
+    parser = SqlCodeParser(
+        source_directory=str(tmp_path),
+        use_cache=True,
+        debug=False,
+        cache_file_name=str(tmp_path / "cache.parquet"),
+        result_cache_file_name=str(tmp_path / "results.sqlite"),
+        chat_model=FakeGeneratingChatModel(),
+        count_tokens=approximate_token_count,
+        use_table_access_analyzer=False,
+        instrumentation=instrumentation,
+    )
+    code = "CREATE PROCEDURE GetOrders AS\nSELECT * FROM Orders\nGO"
+    parser.find_tables_manipulated_by_procedure("GetOrders", code)
+    parser.find_tables_manipulated_by_procedure("GetOrders", code)
+
+    report = instrumentation.report()
+    assert report['calls']['llm.procedure_tables']['count'] == 1
+    assert report['llm']['prompt_tokens'] == 120
+    assert report['llm']['completion_tokens'] == 15
+    assert report['caches']['llm_result_cache'] == {'hits': 1, 'misses': 1, 'hit_ratio': 0.5}
@@ -0,0 +1,116 @@
+import threading
+
+
+class CompiledChatPrompt:
+    """
+    A chat prompt template whose fixed messages are formatted once, when it is compiled.
+
+    Most of a prompt is the system message and the examples, which are the same in every request, so only
+    the messages with input variables, e.g. the code to parse, are formatted for each request.  The messages
+    are the same as those of chat_prompt_template.format_prompt(...).to_messages().
+    """
+
+    def __init__(self, chat_prompt_template) -> None:
+        self.parts = [
+            message_template if message_template.input_variables else message_template.format()
+            for message_template in chat_prompt_template.messages
+        ]
+        self.input_variables = chat_prompt_template.input_variables
+
+
+    def format_messages(self, **variables):
+        """
+        Returns the chat messages for the variables.
+        """
+        return [
+            part.format(**{name: variables[name] for name in part.input_variables}) if hasattr(part, 'input_variables') else part
+            for part in self.parts
+        ]
+
+
+class LlmBackend:
+    """
+    A long-lived connection to the chat model, shared by all the requests of a SqlCodeParser.
+
+    The OpenAI chat model is created once, on the first request, and its requests are sent through one
+    requests session with a pool of up to max_connections keep-alive connections, so the connection to the
+    API is reused rather than opened for each request.  The pool should be at least as large as the number
+    of requests sent concurrently.
+
+    The openai package keeps its session in a module level setting, so the pooled session is installed for
+    all the OpenAI requests made in the process.
+
+    A chat_model can be provided to use instead of the OpenAI chat model, e.g. a fake model for testing.
+    """
+
+    DEFAULT_MODEL_NAME = "gpt-3.5-turbo"
+
+    def __init__(self, chat_model=None, model_name=DEFAULT_MODEL_NAME, temperature=0, max_connections=10,
+                 request_timeout=None, openai_api_base=None, openai_api_key=None) -> None:
+        self.chat_model = chat_model
+        self.model_name = getattr(chat_model, 'model_name', type(chat_model).__name__) if chat_model is not None else model_name
+        self.temperature = temperature
+        self.max_connections = max(1, max_connections)
+        self.request_timeout = request_timeout
+        self.openai_api_base = openai_api_base
+        self.openai_api_key = openai_api_key
+        self.session = None
+        self.lock = threading.Lock()
+
+
+    def _create_session(self):
+        """
+        Returns a requests session with a pool of keep-alive connections.
+        Retries are left to the LlmDispatcher, so the connection adapter doesn't retry.
+        """
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_connections, max_retries=0)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+
+    def _create_openai_chat_model(self):
+        import openai
+        from langchain.chat_models import ChatOpenAI
+
+        self.session = self._create_session()
+        openai.requestssession = self.session
+        options = {'openai_api_base': self.openai_api_base, 'openai_api_key': self.openai_api_key, 'request_timeout': self.request_timeout}
+        return ChatOpenAI(model=self.model_name, temperature=self.temperature, verbose=True,
+                          **{name: value for name, value in options.items() if value is not None})
+
+
+    def get_chat_model(self):
+        """
+        Returns the chat model, creating the OpenAI chat model on the first call.
+        """
+        if self.chat_model is None:
+            with self.lock:
+                if self.chat_model is None:
+                    self.chat_model = self._create_openai_chat_model()
+        return self.chat_model
+
+
+    def complete(self, messages):
+        """
+        Sends the messages to the chat model.
+        Returns the response text and the prompt and completion token counts reported by the model, if any.
+        """
+        chat = self.get_chat_model()
+        if not hasattr(chat, 'generate'):
+            return chat(messages).content, 0, 0
+        llm_result = chat.generate([messages])
+        token_usage = (llm_result.llm_output or {}).get('token_usage', {})
+        return llm_result.generations[0][0].message.content, token_usage.get('prompt_tokens', 0), token_usage.get('completion_tokens', 0)
+
+
+    def close(self):
+        """
+        Closes the pooled connections.
+        """
+        if self.session is not None:
+            self.session.close()
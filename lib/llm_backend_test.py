@@ -0,0 +1,66 @@
+import openai
+from langchain.schema import AIMessage
+
+from lib.llm_backend import CompiledChatPrompt, LlmBackend
+from lib.sql_code_parser import SqlCodeParser
+from test_support.fake_llm import approximate_token_count
+from test_support.stub_openai_server import StubOpenAiServer
+
+
+class FakeChatModel:
+    model_name = 'fake-model'
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, messages):
+        self.calls += 1
+        return AIMessage(content='[]')
+
+
+def create_parser(tmp_path, **kwargs):
+    return SqlCodeParser(
+        source_directory=str(tmp_path),
+        use_cache=False,
+        debug=False,
+        result_cache_file_name=str(tmp_path / "results.sqlite"),
+        count_tokens=approximate_token_count,
+        use_table_access_analyzer=False,
+        **kwargs)
+
+
+def test_compiled_prompts_match_the_prompt_templates(tmp_path):
+    parser = create_parser(tmp_path, chat_model=FakeChatModel())
+    variables = {'procedure_name': 'GetOrders', 'sql_code_fragment': 'CREATE PROCEDURE GetOrders AS SELECT * FROM Orders'}
+    templates = {
+        'ddl_statements': parser._ddl_statements_prompt(),
+        'procedure_tables': parser._procedure_tables_prompt(),
+        'procedure_tables_batch': parser._batch_procedure_tables_prompt(),
+    }
+    for name, template in templates.items():
+        template_variables = {variable: variables[variable] for variable in template.input_variables}
+        assert CompiledChatPrompt(template).format_messages(**template_variables) == template.format_prompt(**template_variables).to_messages()
+
+
+def test_backend_uses_the_chat_model_provided(tmp_path):
+    chat_model = FakeChatModel()
+    parser = create_parser(tmp_path, chat_model=chat_model)
+    parser.find_tables_manipulated_by_procedure("GetOrders", "CREATE PROCEDURE GetOrders AS SELECT * FROM Orders")
+
+    assert parser.llm_backend.model_name == 'fake-model'
+    assert parser.llm_backend.complete([AIMessage(content='x')]) == ('[]', 0, 0)
+    assert chat_model.calls == 2
+
+
+def test_backend_reuses_one_connection_for_all_requests(tmp_path, monkeypatch):
+    monkeypatch.setattr(openai, 'requestssession', None)
+    with StubOpenAiServer() as server:
+        backend = LlmBackend(openai_api_base=server.api_base, openai_api_key='stub')
+        parser = create_parser(tmp_path, llm_backend=backend)
+        for i in range(5):
+            assert parser.find_tables_manipulated_by_procedure(f"Proc{i}", f"CREATE PROCEDURE Proc{i} AS SELECT 1") == []
+        backend.close()
+
+    assert server.requests == 5
+    assert server.connections == 1
+    assert parser.instrumentation.report()['llm']['prompt_tokens'] == 500
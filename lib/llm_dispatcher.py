@@ -0,0 +1,130 @@
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class TokenBucketRateLimiter:
+    """
+    A thread safe token bucket that limits how many requests per second are sent to the LLM.
+
+    The bucket holds up to `burst` tokens and is refilled at `rate` tokens per second.
+    Each call to acquire() takes one token, blocking until one is available.
+    """
+
+    def __init__(self, rate, burst=1, clock=time.monotonic, sleep=time.sleep) -> None:
+        if rate <= 0:
+            raise ValueError(f"Rate must be greater than zero: {rate}")
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = float(self.burst)
+        self.last_refill = clock()
+        self.lock = threading.Lock()
+
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+
+    def acquire(self):
+        """
+        Take a token from the bucket, waiting for the bucket to refill if it is empty.
+        """
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            self.sleep(wait_time)
+
+
+class LlmDispatcher:
+    """
+    Runs LLM requests on a pool of worker threads.
+
+    Most of the time spent classifying code is spent waiting on the network, so sending several
+    requests at once gives a big speed up.  The dispatcher:
+    - limits the number of requests in flight to max_concurrency,
+    - optionally limits the request rate with a token bucket,
+    - retries failed requests with exponential backoff and jitter,
+    - returns the results in the same order as the inputs, so that the output is deterministic.
+
+    With max_concurrency=1 the requests are run one after another on the calling thread.
+    """
+
+    def __init__(self, max_concurrency=1, requests_per_second=None, max_retries=3, backoff_seconds=1.0, max_backoff_seconds=30.0, sleep=time.sleep) -> None:
+        if max_concurrency < 1:
+            raise ValueError(f"max_concurrency must be at least 1: {max_concurrency}")
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = TokenBucketRateLimiter(requests_per_second, burst=max_concurrency, sleep=sleep) if requests_per_second else None
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.sleep = sleep
+
+
+    def _backoff_delay(self, attempt):
+        """
+        Exponential backoff with full jitter, capped at max_backoff_seconds.
+        """
+        delay = min(self.max_backoff_seconds, self.backoff_seconds * (2 ** attempt))
+        return random.uniform(0, delay)
+
+
+    def call(self, func, *args):
+        """
+        Call func(*args), respecting the rate limit and retrying on failure.
+        The last exception is raised once all the retries have been used up.
+        """
+        attempt = 0
+        while True:
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+            try:
+                return func(*args)
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff_delay(attempt)
+                print(f"\nLLM request failed ({e}), retrying in {delay:.1f}s ...")
+                self.sleep(delay)
+                attempt += 1
+
+
+    def map(self, func, items, resolve=None):
+        """
+        Apply func to each item and yield the results in input order.
+
+        The items can be any iterable, including a generator.  At most 2 x max_concurrency items
+        are pulled from it ahead of the result being yielded, so memory use stays bounded.
+
+        If resolve is provided, it is called on each item first, on the calling thread.  If it returns
+        anything other than None, then that is used as the result and func is not called for the item.
+        """
+        if self.max_concurrency == 1:
+            for item in items:
+                result = resolve(item) if resolve else None
+                yield result if result is not None else self.call(func, item)
+            return
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            pending = deque()
+            for item in items:
+                result = resolve(item) if resolve else None
+                if result is not None:
+                    future = Future()
+                    future.set_result(result)
+                    pending.append(future)
+                else:
+                    pending.append(executor.submit(self.call, func, item))
+                if len(pending) >= 2 * self.max_concurrency:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
@@ -0,0 +1,60 @@
+import pytest
+import random
+import time
+from lib.llm_dispatcher import LlmDispatcher, TokenBucketRateLimiter
+
+
+def test_map_returns_results_in_input_order():
+    def slow_square(x):
+        time.sleep(random.uniform(0, 0.01))
+        return x * x
+
+    dispatcher = LlmDispatcher(max_concurrency=8)
+    assert list(dispatcher.map(slow_square, range(50))) == [x * x for x in range(50)]
+
+
+def test_map_accepts_a_generator():
+    dispatcher = LlmDispatcher(max_concurrency=4)
+    assert list(dispatcher.map(str, (x for x in range(10)))) == [str(x) for x in range(10)]
+
+
+def test_call_retries_with_backoff():
+    attempts = []
+    sleeps = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ConnectionError("network down")
+        return "ok"
+
+    dispatcher = LlmDispatcher(max_retries=3, backoff_seconds=1.0, sleep=sleeps.append)
+    assert dispatcher.call(flaky) == "ok"
+    assert len(attempts) == 3
+    assert len(sleeps) == 2
+    assert sleeps[0] <= 1.0 and sleeps[1] <= 2.0
+
+
+def test_call_raises_when_retries_are_exhausted():
+    def broken():
+        raise ConnectionError("network down")
+
+    dispatcher = LlmDispatcher(max_retries=2, sleep=lambda _: None)
+    with pytest.raises(ConnectionError):
+        dispatcher.call(broken)
+
+
+def test_rate_limiter_waits_for_tokens():
+    now = [0.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    limiter = TokenBucketRateLimiter(rate=2, burst=2, clock=lambda: now[0], sleep=sleep)
+    for _ in range(6):
+        limiter.acquire()
+
+    # The first two tokens are available immediately, the other four take half a second each.
+    assert sleeps == [0.5, 0.5, 0.5, 0.5]
@@ -0,0 +1,104 @@
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from lib.catalogue_store import write_ddl_statements, write_table_map
+from lib.sql_code_parser import SqlCodeParser
+from lib.stored_procedure_to_table_mapper import StoredProcedureToTableMapper
+
+# A source root to parse, and the pattern matching the lines that end a batch of code in its dialect.
+DialectSource = namedtuple('DialectSource', ['dialect', 'source_directory', 'batch_separator_pattern'])
+
+# The database dumps shipped in the source_code directory.
+#  - SQL Server batches end with GO.
+#  - Oracle PL/SQL blocks end with a / on a line of its own.
+#  - MySQL procedures are wrapped in DELIMITER $$ ... END$$.
+#  - Postgres and Informix statements end with a semicolon.
+DIALECT_SOURCES = {
+    'sql_server': DialectSource('sql_server', 'source_code/sql_server', r'^\s*go\s*$'),
+    'oracle': DialectSource('oracle', 'source_code/Oracle', r'^\s*/\s*$'),
+    'mysql': DialectSource('mysql', 'source_code/mysql', r'^\s*delimiter\s.*$|.*\$\$\s*$'),
+    'postgres': DialectSource('postgres', 'source_code/postgres', r'.*;\s*$'),
+    'informix': DialectSource('informix', 'source_code/informix', r'.*;\s*$'),
+}
+
+
+def process_dialect(source, results_directory, parser_options, map_procedures, batch_token_budget):
+    """
+    Parses the code in a single source root and maps its procedures to tables, in a worker process.
+
+    The caches are kept in a sub-directory of the results directory named after the dialect, so
+    that the dialects don't share cache files.  Returns the DDL statements and the procedure map,
+    each with a dialect column.
+    """
+    dialect_directory = os.path.join(results_directory, source.dialect)
+    os.makedirs(dialect_directory, exist_ok=True)
+
+    parser = SqlCodeParser(
+        source_directory=source.source_directory,
+        cache_file_name=os.path.join(dialect_directory, 'parsed_code_cache.parquet'),
+        result_cache_file_name=os.path.join(dialect_directory, 'llm_result_cache.sqlite'),
+        batch_separator_pattern=source.batch_separator_pattern,
+        **parser_options)
+    ddl_df = parser.find_ddl_statements()
+
+    if map_procedures:
+        mapper = StoredProcedureToTableMapper(
+            parser,
+            use_cache=parser.use_cache,
+            batch_token_budget=batch_token_budget,
+            cache_file_name=os.path.join(dialect_directory, 'tables_to_procs_cache.parquet'))
+        tables_df = mapper.map_procedures_to_tables(ddl_df)
+    else:
+        tables_df = pd.DataFrame(columns=['table_name', 'sql_operation', 'operation_type', 'procedure_name'])
+
+    ddl_df.insert(0, 'dialect', source.dialect)
+    tables_df.insert(0, 'dialect', source.dialect)
+    return ddl_df, tables_df
+
+
+class MultiDialectDriver:
+    """
+    Parses several source roots, e.g. one per SQL dialect, in one run.
+
+    Each source root is parsed by a worker process of its own, so the total time is close to the
+    time taken by the slowest root rather than the sum of them all.  The results are merged into one
+    catalogue of DDL statements and one procedure map, each with a dialect column.
+
+    parser_options are passed on to each SqlCodeParser, e.g. debug, use_cache or max_concurrency.
+    They are sent to the worker processes, so they must be picklable.
+    """
+
+    CATALOGUE_FILE_NAME = 'ddl_catalogue.parquet'
+    TABLES_CATALOGUE_FILE_NAME = 'tables_to_procs_catalogue.parquet'
+
+    def __init__(self, sources, results_directory="./results", max_workers=None, parser_options=None, map_procedures=True, batch_token_budget=None) -> None:
+        if not sources:
+            raise ValueError("At least one source root is needed")
+        self.sources = sources
+        self.results_directory = results_directory
+        self.max_workers = max_workers or len(sources)
+        self.parser_options = parser_options or {}
+        self.map_procedures = map_procedures
+        self.batch_token_budget = batch_token_budget
+
+
+    def run(self):
+        """
+        Parses all the source roots and returns the merged DDL statements and procedure map.
+        The merged data frames are also written to the results directory.
+        """
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [
+                executor.submit(process_dialect, source, self.results_directory, self.parser_options, self.map_procedures, self.batch_token_budget)
+                for source in self.sources
+            ]
+            results = [future.result() for future in futures]
+
+        ddl_df = pd.concat([ddl_df for ddl_df, _ in results], ignore_index=True)
+        tables_df = pd.concat([tables_df for _, tables_df in results], ignore_index=True)
+        write_ddl_statements(os.path.join(self.results_directory, self.CATALOGUE_FILE_NAME), ddl_df)
+        write_table_map(os.path.join(self.results_directory, self.TABLES_CATALOGUE_FILE_NAME), tables_df)
+        return ddl_df, tables_df
@@ -0,0 +1,46 @@
+import os
+import pytest
+from lib.multi_dialect_driver import DIALECT_SOURCES, DialectSource, MultiDialectDriver, process_dialect
+from test_support.fake_llm import FakeTableChatModel, approximate_token_count
+
+
+def test_run_merges_the_dialects(tmp_path):
+    sql_server = tmp_path / "sql_server"
+    sql_server.mkdir()
+    (sql_server / "schema.sql").write_text(
+        'CREATE TABLE "Orders" ("ID" int)\nGO\nCREATE PROCEDURE GetOrders AS\nSELECT * FROM Orders\nGO\n')
+    postgres = tmp_path / "postgres"
+    postgres.mkdir()
+    (postgres / "schema.sql").write_text('CREATE TABLE customers (id int);\nCREATE TABLE orders (id int);\n')
+
+    results_directory = tmp_path / "results"
+    results_directory.mkdir()
+    driver = MultiDialectDriver(
+        [
+            DialectSource('sql_server', str(sql_server), r'^\s*go\s*$'),
+            DialectSource('postgres', str(postgres), r'.*;\s*$'),
+        ],
+        results_directory=str(results_directory),
+        parser_options={'debug': False, 'chat_model': FakeTableChatModel(), 'count_tokens': approximate_token_count},
+    )
+    ddl_df, tables_df = driver.run()
+
+    assert ddl_df.columns.tolist() == ['dialect', 'db_object_name', 'sql_operation', 'sql_code']
+    assert list(zip(ddl_df['dialect'], ddl_df['db_object_name'])) == [
+        ('sql_server', 'Orders'), ('sql_server', 'GetOrders'), ('postgres', 'customers'), ('postgres', 'orders')]
+    assert tables_df[['dialect', 'table_name', 'procedure_name']].values.tolist() == [['sql_server', 'Orders', 'GetOrders']]
+    assert os.path.exists(results_directory / "sql_server" / "llm_result_cache.sqlite")
+    assert os.path.exists(results_directory / "postgres" / "parsed_code_cache.parquet")
+    assert os.path.exists(results_directory / MultiDialectDriver.CATALOGUE_FILE_NAME)
+
+
+@pytest.mark.parametrize('dialect', ['oracle', 'mysql'])
+def test_process_dialect_parses_the_sample_sources_with_default_options(tmp_path, dialect):
+    # The Oracle dump is UTF-16 and the MySQL dump is UTF-8 with a byte order mark and DELIMITER blocks.
+    parser_options = {'debug': False, 'chat_model': FakeTableChatModel(), 'count_tokens': approximate_token_count}
+    ddl_df, _ = process_dialect(DIALECT_SOURCES[dialect], str(tmp_path), parser_options, False, 2000)
+
+    tables = ddl_df.loc[ddl_df['sql_operation'] == 'CREATE TABLE', 'db_object_name'].str.lower().tolist()
+    assert len(tables) == 13
+    assert 'customers' in tables
+    assert (ddl_df['sql_operation'] == 'CREATE VIEW').sum() > 0
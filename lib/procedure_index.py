@@ -0,0 +1,151 @@
+import os
+import re
+from collections import namedtuple
+
+from lib.sql_batch_reader import SqlBatchReader
+from lib.sql_tokenizer import tokenize, is_keyword, normalize_object_name
+
+# The location of a procedure body in a source file, as byte offsets.
+ProcedureLocation = namedtuple('ProcedureLocation', ['path', 'start', 'end', 'encoding'])
+
+
+class ProcedureIndex:
+    """
+    An index of the stored procedure bodies in a set of SQL files.
+
+    The files are read once and split into batches at the GO statements.  Each batch that creates a
+    procedure is recorded against the normalised procedure name (see normalize_object_name), as the
+    byte offsets of the body in its file.  So looking up a procedure is a dictionary lookup followed by
+    a single read, and the whole body is returned however long it is.
+
+    The body runs from the CREATE PROCEDURE statement to the end of the GO statement.  If a procedure is
+    defined more than once, the first definition is used.
+    """
+
+    def __init__(self, batch_separator_pattern=SqlBatchReader.DEFAULT_BATCH_SEPARATOR_PATTERN) -> None:
+        self.batch_separator = re.compile(batch_separator_pattern, re.IGNORECASE)
+        self.locations = {}
+
+
+    @classmethod
+    def build(cls, source_directory, source_file_glob_pattern="**/*.sql", batch_separator_pattern=SqlBatchReader.DEFAULT_BATCH_SEPARATOR_PATTERN, worker_pool=None):
+        """
+        Builds an index of all the procedures in the files in the source directory.
+        If a worker_pool is given, then the files are indexed by its workers, sharded by file.
+        """
+        index = cls(batch_separator_pattern)
+        paths = SqlBatchReader(source_directory, source_file_glob_pattern).file_paths()
+        if worker_pool is None:
+            for path in paths:
+                index.add_file(path)
+            return index
+        # Merge the files in order, so the first definition of a procedure is used, as when indexing serially.
+        for locations in worker_pool.map(index_files, paths, batch_separator_pattern, weight=os.path.getsize):
+            for key, location in locations.items():
+                index.locations.setdefault(key, location)
+        return index
+
+
+    def add_file(self, path):
+        """
+        Adds the procedures in the file to the index.
+        """
+        encoding, offset = SqlBatchReader.detect_encoding(path)
+        # Keep the original line endings, so that the byte offsets can be calculated from the text.
+        with open(path, encoding=encoding, errors='surrogateescape', newline='') as file:
+            if offset:
+                file.read(1)
+            lines = []
+            for line in file:
+                lines.append(line)
+                if self.batch_separator.match(line):
+                    offset = self._add_batch(path, encoding, offset, ''.join(lines))
+                    lines = []
+            if lines:
+                self._add_batch(path, encoding, offset, ''.join(lines))
+
+
+    def _add_batch(self, path, encoding, offset, batch):
+        """
+        Records the procedure created by the batch, if there is one.
+        Returns the byte offset of the end of the batch.
+        """
+        end_of_batch = offset + len(batch.encode(encoding, errors='surrogateescape'))
+        procedure = self.find_procedure(batch)
+        if procedure is not None:
+            name, start = procedure
+            key = normalize_object_name(name)
+            if key not in self.locations:
+                start_offset = offset + len(batch[:start].encode(encoding, errors='surrogateescape'))
+                end_offset = start_offset + len(batch[start:].rstrip().encode(encoding, errors='surrogateescape'))
+                self.locations[key] = ProcedureLocation(path, start_offset, end_offset, encoding)
+        return end_of_batch
+
+
+    @staticmethod
+    def find_procedure(batch):
+        """
+        Returns the name of the procedure created by the batch and the character offset of the CREATE
+        statement, or None if the batch doesn't start with a CREATE PROCEDURE statement.
+        """
+        tokens = tokenize(batch)
+        for token in tokens:
+            if token.kind == 'separator':
+                continue
+            if not is_keyword(token, 'CREATE'):
+                return None
+            start = token.start
+            break
+        else:
+            return None
+
+        token = next(tokens, None)
+        while is_keyword(token, 'OR', 'ALTER', 'REPLACE'):
+            token = next(tokens, None)
+        if not is_keyword(token, 'PROC', 'PROCEDURE'):
+            return None
+
+        # Read the schema qualified name, e.g. "dbo"."Sales by Year"
+        name = None
+        expect_name_part = True
+        for token in tokens:
+            if expect_name_part and token.kind in ('word', 'identifier'):
+                name = token.value
+                expect_name_part = False
+            elif not expect_name_part and token.value == '.':
+                expect_name_part = True
+            else:
+                break
+        return (name, start) if name else None
+
+
+    def get_procedure_code(self, procedure_name):
+        """
+        Returns the code of the procedure, or None if the procedure isn't in the index.
+        """
+        location = self.locations.get(normalize_object_name(procedure_name))
+        if location is None:
+            return None
+        with open(location.path, 'rb') as file:
+            file.seek(location.start)
+            return file.read(location.end - location.start).decode(location.encoding, errors='replace')
+
+
+    def __contains__(self, procedure_name):
+        return normalize_object_name(procedure_name) in self.locations
+
+
+    def __len__(self):
+        return len(self.locations)
+
+
+def index_files(paths, batch_separator_pattern):
+    """
+    Returns the locations of the procedures in each of the files, e.g. in a worker process.
+    """
+    results = []
+    for path in paths:
+        index = ProcedureIndex(batch_separator_pattern)
+        index.add_file(path)
+        results.append(index.locations)
+    return results
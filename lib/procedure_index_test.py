@@ -0,0 +1,45 @@
+from lib.procedure_index import ProcedureIndex
+
+
+LONG_PROCEDURE = 'CREATE PROCEDURE "dbo"."Long Report"\nAS\n' + "SELECT OrderID FROM Orders\n" * 200 + "GO"
+
+CODE = f"""
+if exists (select * from sysobjects where id = object_id('dbo.Long Report') and sysstat & 0xf = 4)
+    drop procedure "dbo"."Long Report"
+GO
+{LONG_PROCEDURE}
+
+CREATE PROCEDURE [Sales (1997)+] @Year int
+AS
+SELECT * FROM [Order Details]
+GO
+CREATE PROCEDURE CustOrdersOrders @CustomerID nchar(5)
+AS
+SELECT OrderID FROM Orders WHERE CustomerID = @CustomerID
+"""
+
+
+def test_procedures_spanning_chunk_boundaries_are_returned_whole(tmp_path):
+    (tmp_path / "schema.sql").write_text(CODE)
+    index = ProcedureIndex.build(str(tmp_path))
+    assert len(LONG_PROCEDURE) > 2000
+    assert index.get_procedure_code("Long Report") == LONG_PROCEDURE
+
+
+def test_lookups_use_normalised_names(tmp_path):
+    (tmp_path / "schema.sql").write_text(CODE)
+    index = ProcedureIndex.build(str(tmp_path))
+    assert len(index) == 3
+    assert '"dbo"."Long Report"' in index
+    assert index.get_procedure_code("sales (1997)+") == "CREATE PROCEDURE [Sales (1997)+] @Year int\nAS\nSELECT * FROM [Order Details]\nGO"
+    assert index.get_procedure_code("CustOrdersOrders").endswith("WHERE CustomerID = @CustomerID")
+    assert index.get_procedure_code("Missing") is None
+
+
+def test_byte_offsets_are_correct_for_other_encodings(tmp_path):
+    code = "-- Commandes livrées\r\nGO\r\nCREATE PROCEDURE Livrées\r\nAS\r\nSELECT * FROM Commandes\r\nGO\r\n"
+    (tmp_path / "utf16.sql").write_text(code, encoding="utf-16", newline="")
+    (tmp_path / "utf8.sql").write_text(code.replace("Livrées", "Expédiées"), encoding="utf-8-sig", newline="")
+    index = ProcedureIndex.build(str(tmp_path))
+    assert index.get_procedure_code("Livrées") == "CREATE PROCEDURE Livrées\r\nAS\r\nSELECT * FROM Commandes\r\nGO"
+    assert index.get_procedure_code("Expédiées") == "CREATE PROCEDURE Expédiées\r\nAS\r\nSELECT * FROM Commandes\r\nGO"
@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class ResultCache:
+    """
+    A persistent cache of LLM results, stored in a SQLite database.
+
+    Entries are keyed by a hash of everything that determines the LLM response, i.e. the model name
+    and the fully rendered prompt, which includes the prompt template and the code being parsed.
+    So when a single procedure changes, only that procedure misses the cache and is sent to the LLM.
+
+    The cache is limited to max_bytes of stored results; the least recently used entries are evicted
+    once that size is exceeded.  The total size is kept in memory, so it is only summed when the cache
+    is opened.  Cache hits don't write to the database: the times they were used are held in memory and
+    written in one transaction on the next put, every USE_FLUSH_INTERVAL hits, or when flush is called.
+    """
+
+    DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+    # The number of cache hits whose last used times are held in memory before they are written.
+    USE_FLUSH_INTERVAL = 1000
+
+    # The number of entries read at a time when evicting.
+    EVICTION_BATCH_SIZE = 100
+
+    def __init__(self, file_name, max_bytes=DEFAULT_MAX_BYTES) -> None:
+        directory = os.path.dirname(file_name)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file_name = file_name
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(file_name, check_same_thread=False)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self.connection.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+        self.connection.commit()
+        self.total_size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        self.pending_uses = {}
+
+
+    @staticmethod
+    def make_key(*parts):
+        """
+        Returns a SHA-256 hash of the parts provided, for use as a cache key.
+        """
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(str(part).encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+
+    def get(self, key):
+        """
+        Returns the cached value for the key, or None if the key is not in the cache.
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self.pending_uses[key] = time.time()
+            if len(self.pending_uses) >= ResultCache.USE_FLUSH_INTERVAL:
+                self._write_pending_uses()
+                self.connection.commit()
+        return json.loads(row[0])
+
+
+    def flush(self):
+        """
+        Writes the last used times of the cache hits that are held in memory to the database.
+        """
+        with self.lock:
+            if self.pending_uses:
+                self._write_pending_uses()
+                self.connection.commit()
+
+
+    def _write_pending_uses(self):
+        self.connection.executemany(
+            "UPDATE results SET last_used = ? WHERE key = ?", [(used, key) for key, used in self.pending_uses.items()])
+        self.pending_uses.clear()
+
+
+    def put(self, key, value):
+        """
+        Stores a JSON serialisable value in the cache, evicting the least recently used entries if the cache is full.
+        """
+        text = json.dumps(value)
+        with self.lock:
+            self._write_pending_uses()
+            row = self.connection.execute("SELECT size FROM results WHERE key = ?", (key,)).fetchone()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO results (key, value, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, text, len(text), time.time()))
+            self.total_size += len(text) - (row[0] if row else 0)
+            if self.total_size > self.max_bytes:
+                self._evict()
+            self.connection.commit()
+
+
+    def _evict(self):
+        """
+        Deletes the least recently used entries until the cache is within max_bytes.
+        """
+        while self.total_size > self.max_bytes:
+            rows = self.connection.execute(
+                "SELECT key, size FROM results ORDER BY last_used, rowid LIMIT ?", (ResultCache.EVICTION_BATCH_SIZE,)).fetchall()
+            if not rows:
+                self.total_size = 0
+                break
+            evicted_keys = []
+            for key, size in rows:
+                if self.total_size <= self.max_bytes:
+                    break
+                evicted_keys.append((key,))
+                self.total_size -= size
+            self.connection.executemany("DELETE FROM results WHERE key = ?", evicted_keys)
+
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+
+def read_fingerprint(cache_file_name):
+    """
+    Returns the fingerprint of the inputs used to produce a cache file, or None if it is not known.
+    """
+    fingerprint_file_name = cache_file_name + '.fingerprint'
+    if not os.path.exists(fingerprint_file_name):
+        return None
+    with open(fingerprint_file_name) as file:
+        return file.read().strip()
+
+
+def write_fingerprint(cache_file_name, fingerprint):
+    """
+    Records the fingerprint of the inputs used to produce a cache file, alongside the cache file.
+    """
+    with open(cache_file_name + '.fingerprint', 'w') as file:
+        file.write(fingerprint)
@@ -0,0 +1,63 @@
+from lib.result_cache import ResultCache
+
+
+def test_get_returns_stored_values(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache.sqlite"))
+    key = ResultCache.make_key("gpt-3.5-turbo", "CREATE TABLE \"Products\"")
+    assert cache.get(key) is None
+
+    cache.put(key, [{"db_object_name": "Products", "sql_operation": "CREATE TABLE"}])
+    assert cache.get(key) == [{"db_object_name": "Products", "sql_operation": "CREATE TABLE"}]
+
+
+def test_values_persist_between_instances(tmp_path):
+    ResultCache(str(tmp_path / "cache.sqlite")).put("key", [])
+    assert ResultCache(str(tmp_path / "cache.sqlite")).get("key") == []
+
+
+def test_make_key_depends_on_every_part():
+    assert ResultCache.make_key("model", "code") != ResultCache.make_key("other model", "code")
+    assert ResultCache.make_key("model", "code") != ResultCache.make_key("model", "changed code")
+    assert ResultCache.make_key("ab", "c") != ResultCache.make_key("a", "bc")
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache.sqlite"), max_bytes=25)
+    cache.put("a", "x" * 8)
+    cache.put("b", "x" * 8)
+    cache.get("a")
+    cache.put("c", "x" * 8)
+
+    assert cache.get("a") == "x" * 8
+    assert cache.get("b") is None
+    assert cache.get("c") == "x" * 8
+
+
+def test_cache_hits_are_written_in_batches(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache.sqlite"))
+    cache.put("a", [])
+    last_used = lambda: ResultCache(str(tmp_path / "cache.sqlite")).connection.execute(
+        "SELECT last_used FROM results WHERE key = 'a'").fetchone()[0]
+    stored = last_used()
+
+    cache.get("a")
+    assert not cache.connection.in_transaction
+    assert last_used() == stored
+
+    cache.flush()
+    assert last_used() > stored
+
+
+def test_total_size_is_tracked_across_replacements_and_instances(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache.sqlite"), max_bytes=20)
+    cache.put("a", "x" * 8)
+    cache.put("a", "x" * 2)
+    cache.put("b", "x" * 8)
+    assert cache.total_size == 4 + 10
+
+    cache = ResultCache(str(tmp_path / "cache.sqlite"), max_bytes=20)
+    assert cache.total_size == 14
+    cache.put("c", "x" * 8)
+    assert cache.get("a") is None
+    assert cache.get("b") == "x" * 8
+    assert cache.total_size == 20
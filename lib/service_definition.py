@@ -1,11 +1,145 @@
+import sys
+
+import numpy as np
+import pandas as pd
+
+
+def _distinct_names(names):
+    """
+    Returns the names as a tuple without duplicates, in the order they first appear, with the strings interned.
+    """
+    return tuple(dict.fromkeys(sys.intern(name) if type(name) is str else name for name in names))
+
 
 class ServiceDefinition:
+    """
+    A service, with the procedures that make it up and the tables that they read and write.
 
-    def __init__(self, service_name, procs = [], read_tables = [], write_tables = []) -> None:
+    The procedures and tables are sets of names, held as tuples in the order the names were first given,
+    so a table that is read by several procedures of the service is only listed once.  The names are
+    interned, so each name is stored once however many services it is in, and the instances have
+    __slots__ rather than a __dict__, which keeps catalogues of hundreds of thousands of objects small.
+    """
+
+    __slots__ = ('service_name', '_procs', '_read_tables', '_write_tables')
+
+    def __init__(self, service_name, procs=(), read_tables=(), write_tables=()) -> None:
         self.service_name = service_name
         self.procs = procs
         self.read_tables = read_tables
         self.write_tables = write_tables
 
+
+    @property
+    def procs(self):
+        return self._procs
+
+
+    @procs.setter
+    def procs(self, names):
+        self._procs = _distinct_names(names)
+
+
+    @property
+    def read_tables(self):
+        return self._read_tables
+
+
+    @read_tables.setter
+    def read_tables(self, names):
+        self._read_tables = _distinct_names(names)
+
+
+    @property
+    def write_tables(self):
+        return self._write_tables
+
+
+    @write_tables.setter
+    def write_tables(self, names):
+        self._write_tables = _distinct_names(names)
+
+
+    @classmethod
+    def _from_distinct_names(cls, service_name, procs, read_tables, write_tables):
+        """
+        Returns a ServiceDefinition for names that are already distinct tuples of interned strings.
+        """
+        service_definition = cls.__new__(cls)
+        service_definition.service_name = service_name
+        service_definition._procs = procs
+        service_definition._read_tables = read_tables
+        service_definition._write_tables = write_tables
+        return service_definition
+
+
+    def __eq__(self, other):
+        if not isinstance(other, ServiceDefinition):
+            return NotImplemented
+        return (self.service_name == other.service_name and set(self.procs) == set(other.procs)
+                and set(self.read_tables) == set(other.read_tables) and set(self.write_tables) == set(other.write_tables))
+
+
+    __hash__ = None
+
+
     def __str__(self) -> str:
-        return f"ServiceDefinition: {self.service_name} (procs: {self.procs}, read_tables: {self.read_tables}, write_tables: {self.write_tables})"
+        return f"ServiceDefinition: {self.service_name} (procs: {list(self.procs)}, read_tables: {list(self.read_tables)}, write_tables: {list(self.write_tables)})"
+
+
+def unique_service_names(service_definitions):
+    """
+    Returns a name for each service that no other service has, in the same order.
+
+    The extractors name a service after the table that it writes to most, so two services can get the
+    same name, e.g. two clusters of procedures that both write to Orders.  The first service keeps the
+    name and the others are numbered, e.g. Orders, Orders_2, Orders_3.  Names are compared ignoring case,
+    as they are used for file names too.
+    """
+    used = {str(service_definition.service_name).lower() for service_definition in service_definitions}
+    seen = set()
+    names = []
+    for service_definition in service_definitions:
+        name = str(service_definition.service_name)
+        if name.lower() in seen:
+            number = 2
+            while f"{name}_{number}".lower() in used:
+                number += 1
+            name = f"{name}_{number}"
+            used.add(name.lower())
+        seen.add(name.lower())
+        names.append(name)
+    return names
+
+
+def service_definitions_from_dataframe(df):
+    """
+    Returns a ServiceDefinition for each cluster of a data frame with the cluster_label, service_name,
+    procedure_name, table_name and operation_type columns, in the order the clusters first appear.
+
+    The names are replaced by integer codes, so the rows are grouped by cluster with a single sort and the
+    duplicates are removed by comparing integers, and each distinct name is only interned once.  The time
+    taken grows with the number of rows, rather than with the number of rows times the number of clusters.
+    """
+    cluster_codes, cluster_labels = pd.factorize(df['cluster_label'], use_na_sentinel=False)
+    procedure_codes, procedure_names = pd.factorize(df['procedure_name'], use_na_sentinel=False)
+    table_codes, table_names = pd.factorize(df['table_name'], use_na_sentinel=False)
+    procedure_names = _distinct_names(procedure_names)
+    table_names = _distinct_names(table_names)
+    operation_types = df['operation_type'].to_numpy()
+    is_read = operation_types == 'READ'
+    is_write = operation_types == 'WRITE'
+    service_name_by_row = df['service_name'].to_numpy()
+
+    order = np.argsort(cluster_codes, kind='stable')
+    boundaries = np.searchsorted(cluster_codes[order], np.arange(len(cluster_labels) + 1))
+    result = []
+    for start, end in zip(boundaries[:-1], boundaries[1:]):
+        rows = order[start:end]
+        result.append(ServiceDefinition._from_distinct_names(
+            service_name_by_row[rows[0]],
+            tuple(procedure_names[code] for code in pd.unique(procedure_codes[rows])),
+            tuple(table_names[code] for code in pd.unique(table_codes[rows[is_read[rows]]])),
+            tuple(table_names[code] for code in pd.unique(table_codes[rows[is_write[rows]]])),
+        ))
+    return result
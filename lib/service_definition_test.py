@@ -0,0 +1,44 @@
+import pandas as pd
+
+from lib.service_definition import ServiceDefinition, service_definitions_from_dataframe, unique_service_names
+
+
+def test_names_are_distinct_and_interned():
+    service_definition = ServiceDefinition('Orders', ['UpdateOrder', 'AddOrder', 'UpdateOrder'], iter(['Customers']), ['Orders', 'Orders'])
+    assert service_definition.procs == ('UpdateOrder', 'AddOrder')
+    assert service_definition.read_tables == ('Customers',)
+    assert service_definition.write_tables == ('Orders',)
+    assert ServiceDefinition('Orders', [''.join(['Update', 'Order'])]).procs[0] is service_definition.procs[0]
+    assert ServiceDefinition('Orders', ['AddOrder', 'UpdateOrder'], ['Customers'], ['Orders']) == service_definition
+
+    service_definition.procs = ['AddOrder', 'AddOrder']
+    assert service_definition.procs == ('AddOrder',)
+    assert not hasattr(service_definition, '__dict__')
+
+
+def test_defaults_are_not_shared():
+    first = ServiceDefinition('First')
+    second = ServiceDefinition('Second')
+    first.procs = ['Proc']
+    assert second.procs == ()
+
+
+def test_the_services_are_built_from_the_clustered_table_map():
+    df = pd.DataFrame([
+        (7, 'Orders', 'UpdateOrder', 'Orders', 'WRITE'),
+        (7, 'Orders', 'UpdateOrder', 'Customers', 'READ'),
+        (3, 'Products', 'AddProduct', 'Products', 'WRITE'),
+        (7, 'Orders', 'AddOrder', 'Orders', 'WRITE'),
+        (7, 'Orders', 'AddOrder', 'Customers', 'READ'),
+        (3, 'Products', 'ListProducts', 'Products', 'READ'),
+    ], columns=['cluster_label', 'service_name', 'procedure_name', 'table_name', 'operation_type'])
+
+    orders, products = service_definitions_from_dataframe(df)
+    assert (orders.service_name, orders.procs, orders.read_tables, orders.write_tables) == ('Orders', ('UpdateOrder', 'AddOrder'), ('Customers',), ('Orders',))
+    assert (products.service_name, products.procs, products.read_tables, products.write_tables) == ('Products', ('AddProduct', 'ListProducts'), ('Products',), ('Products',))
+    assert service_definitions_from_dataframe(df.iloc[:0]) == []
+
+
+def test_unique_service_names_numbers_repeated_names():
+    services = [ServiceDefinition(name) for name in ['Orders', 'orders', 'Orders_2', 'Customers', 'Orders']]
+    assert unique_service_names(services) == ['Orders', 'orders_3', 'Orders_2', 'Customers', 'Orders_4']
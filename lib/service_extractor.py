@@ -1,9 +1,10 @@
 import os
+import numpy as np
 import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.cluster import KMeans
 
-from lib.service_definition import ServiceDefinition
+from lib.clustering import build_procedure_vectors
+from lib.instrumentation import Instrumentation
+from lib.service_definition import service_definitions_from_dataframe
 
 class ServiceExtractor:
     """
@@ -16,14 +17,40 @@ class ServiceExtractor:
     - procedure_name: The name of the stored procedure
     - table_name: The name of the table that the stored procedure reads from or writes to
     - operation_type: The type of operation that the stored procedure performs on the table (read or write)
+
+    By default the table operations are clustered with KMeans into number_of_clusters clusters.  If a
+    clustering_backend is provided, e.g. a MiniBatchKMeansBackend, then each procedure is represented
+    by a single vector and is clustered by the backend, so that every procedure is in exactly one service.
+
+    The services from an earlier extraction can be updated with assign_to_nearest_services, rather than
+    clustering all the procedures again.
     """
 
     CACHE_FILE_NAME = './results/service_candidates_cache.csv'
 
-    def __init__(self, tables_df, number_of_clusters=5, use_cache=False) -> None:
+    # The services clustered by a clustering backend are cached in a file of their own, so that they are
+    # never returned in place of the services clustered without one, or the other way round.
+    CLUSTERED_CACHE_FILE_NAME = './results/clustered_service_candidates_cache.csv'
+
+    def __init__(self, tables_df, number_of_clusters=5, use_cache=False, clustering_backend=None, instrumentation=None) -> None:
         self.tables_df = tables_df
         self.number_of_clusters = number_of_clusters
         self.use_cache = use_cache
+        self.clustering_backend = clustering_backend
+        self.instrumentation = instrumentation or Instrumentation()
+        self.cache_file_name = self.CLUSTERED_CACHE_FILE_NAME if clustering_backend is not None else self.CACHE_FILE_NAME
+
+
+    def config(self):
+        """
+        Returns the kind of extractor and the settings that determine the services it extracts, as a JSON
+        serialisable dictionary, so that a change of settings between runs can be detected.
+        """
+        return {
+            'kind': type(self).__name__,
+            'number_of_clusters': self.number_of_clusters,
+            'clustering_backend': self.clustering_backend.config() if self.clustering_backend is not None else None,
+        }
 
 
     def _cluster_procedures_by_table_and_operation(self, df):
@@ -34,9 +61,12 @@ class ServiceExtractor:
         - cluster_label: The cluster label that the procedure belongs to
         - combined_feature: The combined feature that was used to cluster the procedure
         """
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.cluster import KMeans
+
         # Step 1: Define the features that you want to use to cluster the records
         # Combine 'table_name' and 'procedure_name' into a single feature
-        df['combined_feature'] = df['table_name'] + ' ' + df['procedure_name'] + ' ' + df['operation_type']
+        df['combined_feature'] = df['table_name'] + ' ' + df['procedure_name'] + ' ' + df['operation_type'].astype(str)
 
         # Convert the 'combined_feature' column to a matrix of TF-IDF features
         vectorizer = TfidfVectorizer()
@@ -50,8 +80,29 @@ class ServiceExtractor:
         # Assign the cluster labels to the records
         df['cluster_label'] = kmeans.labels_
         return df
+
+
+    def _cluster_procedures_with_backend(self, df):
+        """
+        Cluster the procedures with the clustering backend, using one vector per procedure.
+
+        Adds the cluster_label column to the data frame.
+        """
+        procedure_names, vectors = build_procedure_vectors(df)
+        labels = self.clustering_backend.fit_predict(vectors)
+        df['cluster_label'] = df['procedure_name'].map(dict(zip(procedure_names, labels)))
+        return df
     
 
+    def _assign_clusters(self, df):
+        """
+        Adds the cluster_label column to the data frame, using the clustering backend if there is one.
+        """
+        if self.clustering_backend is not None:
+            return self._cluster_procedures_with_backend(df)
+        return self._cluster_procedures_by_table_and_operation(df)
+
+
     def _replace_spaces_with_underscores_in_names(self, df):
         """
         Replace spaces with underscores in the service_name, table_name and procedure_name columns
@@ -96,32 +147,86 @@ class ServiceExtractor:
         """
         Converts the dataframe to a list of ServiceDefinition objects.
         """
-        result = []
-        for cluster_label in df['cluster_label'].unique():
-            cluster_df = df[df['cluster_label'] == cluster_label]
-            
-            service_name = cluster_df['service_name'].iloc[0]
-            procs = cluster_df['procedure_name'].tolist()
-            read_tables = cluster_df[cluster_df['operation_type'] == 'READ']['table_name'].tolist()
-            write_tables = cluster_df[cluster_df['operation_type'] == 'WRITE']['table_name'].tolist()
-            result.append(ServiceDefinition(service_name, procs, read_tables, write_tables))
-        
-        return result
+        return service_definitions_from_dataframe(df)
+
+
+    def assign_to_nearest_services(self, services_df, changed_procedures=()):
+        """
+        Updates the services from an earlier extraction for the tables in tables_df.
+
+        services_df is the data frame returned by extract_dataframe for the earlier tables.  The procedures
+        that are in it, and aren't in changed_procedures, keep their services.  The other procedures are
+        assigned to the service with the nearest centroid, the centroid of a service being the mean of the
+        vectors of the procedures that it keeps.  Returns the table map with the cluster_label and
+        service_name columns added, or None if there are no services to assign to.
+        """
+        import scipy.sparse as sp
+
+        df = self._replace_spaces_with_underscores_in_names(self.tables_df.copy())
+        changed = {name.replace(' ', '_') for name in changed_procedures}
+
+        services_df = services_df.drop_duplicates(subset='procedure_name')
+        previous_labels = dict(zip(services_df['procedure_name'], services_df['cluster_label']))
+        service_names = dict(zip(services_df['cluster_label'], services_df['service_name']))
+
+        procedure_names, vectors = build_procedure_vectors(df)
+        labels = {name: previous_labels[name] for name in procedure_names if name not in changed and name in previous_labels}
+        if not labels:
+            return None
+
+        cluster_labels = sorted(set(labels.values()))
+        cluster_index = {label: i for i, label in enumerate(cluster_labels)}
+        rows = [i for i, name in enumerate(procedure_names) if name in labels]
+        membership = sp.csr_matrix(
+            (np.ones(len(rows)), ([cluster_index[labels[procedure_names[i]]] for i in rows], rows)),
+            shape=(len(cluster_labels), len(procedure_names)))
+        counts = np.asarray(membership.sum(axis=1)).ravel()
+        centroids = sp.diags(1.0 / counts) @ membership @ vectors
+
+        unassigned = [i for i, name in enumerate(procedure_names) if name not in labels]
+        if unassigned:
+            similarity = (vectors[unassigned] @ centroids.T).toarray()
+            norms = np.sqrt(np.asarray(centroids.multiply(centroids).sum(axis=1)).ravel())
+            nearest = np.argmax(similarity / np.maximum(norms, 1e-12), axis=1)
+            for i, cluster in zip(unassigned, nearest):
+                labels[procedure_names[i]] = cluster_labels[cluster]
+
+        df['cluster_label'] = df['procedure_name'].map(labels)
+        df['service_name'] = df['cluster_label'].map(service_names)
+        return df
+
+
+    def extract_dataframe_without_cache(self):
+        """
+        Clusters the procedures into services, without reading or writing the cache file, returning the
+        table map with the cluster_label and service_name columns added.  The tables_df isn't changed.
+        """
+        df = self._replace_spaces_with_underscores_in_names(self.tables_df.copy())
+        df = self._assign_clusters(df)
+        return self._add_derived_service_name_for_each_cluster_based_on_most_common_table_name(df)
+
+
+    def extract_dataframe(self):
+        """
+        Perform the service extraction process, returning the table map with the cluster_label and
+        service_name columns added.
+        """
+        with self.instrumentation.stage('extract_services'):
+            # If the cache file exists, then read the results from the cache file and don't alter it.
+            # This allows for manual tweaking of the cached information.
+            if self.use_cache:
+                self.instrumentation.record_cache('service_candidates_cache', os.path.exists(self.cache_file_name))
+            if self.use_cache and os.path.exists(self.cache_file_name):
+                df = pd.read_csv(self.cache_file_name)
+            else:
+                df = self.extract_dataframe_without_cache()
+                df.to_csv(self.cache_file_name, index=False)
+            return df
 
 
     def extract(self):
         """
         Perform the service extraction process.
         """
-        # If the cache file exists, then read the results from the cache file and don't alter it.
-        # This allows for manual tweaking of the cached information.
-        if self.use_cache and os.path.exists(self.CACHE_FILE_NAME):
-            df = pd.read_csv(self.CACHE_FILE_NAME)
-        else:
-            df = self._replace_spaces_with_underscores_in_names(self.tables_df)
-            df = self._cluster_procedures_by_table_and_operation(df)
-            df = self._add_derived_service_name_for_each_cluster_based_on_most_common_table_name(df)
-            df.to_csv(self.CACHE_FILE_NAME, index=False)
-
-        return self._convert_dataframe_to_service_definitions(df)
+        return self._convert_dataframe_to_service_definitions(self.extract_dataframe())
 
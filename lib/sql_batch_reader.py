@@ -0,0 +1,115 @@
+import codecs
+import glob
+import os
+import re
+
+
+class SqlBatchReader:
+    """
+    Streams the SQL code in a directory of files as a sequence of code fragments.
+
+    The files are read through buffered readers a line at a time, so only one fragment needs to be
+    held in memory, however large the files are.  Each fragment is made up of whole batches of code,
+    i.e. the code between GO statements, packed together up to window_size characters.  Batches larger
+    than window_size are split at line boundaries, and lines longer than window_size are split too.
+
+    The reader detects UTF-8 and UTF-16 byte order marks, and converts all line endings to newlines.
+    """
+
+    DEFAULT_BATCH_SEPARATOR_PATTERN = r'^\s*go\s*$'
+
+    def __init__(self, source_directory, source_file_glob_pattern="**/*.sql", window_size=2000, batch_separator_pattern=DEFAULT_BATCH_SEPARATOR_PATTERN) -> None:
+        if window_size < 1:
+            raise ValueError(f"window_size must be at least 1: {window_size}")
+        self.source_directory = source_directory
+        self.source_file_glob_pattern = source_file_glob_pattern
+        self.window_size = window_size
+        self.batch_separator = re.compile(batch_separator_pattern, re.IGNORECASE)
+
+
+    def file_paths(self):
+        """
+        Returns the paths of the files to read, in a deterministic order.
+        """
+        pattern = os.path.join(self.source_directory, self.source_file_glob_pattern)
+        return sorted(path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path))
+
+
+    @staticmethod
+    def detect_encoding(path):
+        """
+        Returns the encoding of the file, based on its byte order mark, and the length of the mark in bytes.
+        Defaults to UTF-8 with no mark.  The encoding is that of the text following the mark, so byte offsets
+        into the file can be calculated from the decoded text.
+        """
+        with open(path, 'rb') as file:
+            start = file.read(4)
+        if start.startswith(codecs.BOM_UTF8):
+            return 'utf-8', len(codecs.BOM_UTF8)
+        if start.startswith(codecs.BOM_UTF16_LE):
+            return 'utf-16-le', len(codecs.BOM_UTF16_LE)
+        if start.startswith(codecs.BOM_UTF16_BE):
+            return 'utf-16-be', len(codecs.BOM_UTF16_BE)
+        return 'utf-8', 0
+
+
+    @classmethod
+    def open_text(cls, path, errors='replace', newline=None):
+        """
+        Opens the file for reading as text in its detected encoding, positioned after the byte order mark.
+        """
+        encoding, mark_length = cls.detect_encoding(path)
+        file = open(path, encoding=encoding, errors=errors, newline=newline)
+        if mark_length:
+            file.read(1)
+        return file
+
+
+    def read_batches(self, path):
+        """
+        Yields the batches of code in the file, each ending with its GO statement.
+        Batches longer than window_size characters are yielded in pieces.
+        """
+        with self.open_text(path) as file:
+            lines = []
+            size = 0
+            while True:
+                line = file.readline(self.window_size)
+                if not line:
+                    break
+                if size + len(line) > self.window_size and lines:
+                    yield ''.join(lines)
+                    lines, size = [], 0
+                lines.append(line)
+                size += len(line)
+                if self.batch_separator.match(line):
+                    yield ''.join(lines)
+                    lines, size = [], 0
+            if lines:
+                yield ''.join(lines)
+
+
+    def read_fragments(self):
+        """
+        Yields the code fragments from all the files, packing whole batches into fragments of up to
+        window_size characters.  Fragments never span more than one file.
+        """
+        for path in self.file_paths():
+            yield from self.read_file_fragments(path)
+
+
+    def read_file_fragments(self, path):
+        """
+        Yields the code fragments from a single file, packing whole batches into fragments of up to
+        window_size characters.
+        """
+        fragment = []
+        size = 0
+        for batch in self.read_batches(path):
+            if size + len(batch) > self.window_size and fragment:
+                yield ''.join(fragment)
+                fragment, size = [], 0
+            fragment.append(batch)
+            size += len(batch)
+        if fragment:
+            yield ''.join(fragment)
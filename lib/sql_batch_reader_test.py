@@ -0,0 +1,33 @@
+from lib.sql_batch_reader import SqlBatchReader
+
+
+def test_read_fragments_packs_whole_batches(tmp_path):
+    batch = 'CREATE TABLE "T" (\n    "ID" int\n)\nGO\n'
+    (tmp_path / "schema.sql").write_text(batch * 10)
+    fragments = list(SqlBatchReader(str(tmp_path), window_size=len(batch) * 3).read_fragments())
+    assert fragments == [batch * 3, batch * 3, batch * 3, batch]
+
+
+def test_large_batches_and_long_lines_are_split_to_fit_the_window(tmp_path):
+    code = "INSERT INTO T VALUES (1)\n" * 100 + "x" * 250 + "\nGO\n"
+    (tmp_path / "data.sql").write_text(code)
+    fragments = list(SqlBatchReader(str(tmp_path), window_size=100).read_fragments())
+    assert "".join(fragments) == code
+    assert max(len(fragment) for fragment in fragments) <= 100
+
+
+def test_files_are_decoded_and_read_in_order(tmp_path):
+    (tmp_path / "b.sql").write_text("CREATE TABLE B (ID int)\r\nGO\r\n", encoding="utf-16")
+    (tmp_path / "a.sql").write_text("CREATE TABLE A (ID int)\nGO\n", encoding="utf-8-sig")
+    reader = SqlBatchReader(str(tmp_path))
+    assert list(reader.read_fragments()) == ["CREATE TABLE A (ID int)\nGO\n", "CREATE TABLE B (ID int)\nGO\n"]
+
+
+def test_detect_encoding_returns_the_encoding_after_the_byte_order_mark(tmp_path):
+    for encoding, expected in [("utf-8", ("utf-8", 0)), ("utf-8-sig", ("utf-8", 3)), ("utf-16", ("utf-16-le", 2))]:
+        (tmp_path / "code.sql").write_text("GO\n", encoding=encoding)
+        assert SqlBatchReader.detect_encoding(str(tmp_path / "code.sql")) == expected
+    (tmp_path / "code.sql").write_bytes(b"\xfe\xff" + "GO\n".encode("utf-16-be"))
+    assert SqlBatchReader.detect_encoding(str(tmp_path / "code.sql")) == ("utf-16-be", 2)
+    with SqlBatchReader.open_text(str(tmp_path / "code.sql")) as file:
+        assert file.read() == "GO\n"
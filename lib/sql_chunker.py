@@ -0,0 +1,179 @@
+import re
+
+from lib.ddl_recognizer import DdlRecognizer
+from lib.sql_tokenizer import TOKEN_PATTERN, tokenize, is_keyword
+
+
+class TokenAwareSqlChunker:
+    """
+    Splits SQL code into chunks for the LLM, sized by token count rather than by characters.
+
+    The code is split into statements first: batches end at a batch separator (GO, or / on a line of
+    its own), and batches that are too large for a chunk are split after each semicolon that isn't
+    inside brackets.  Statements that create a procedure, function, trigger or view are never split,
+    as their bodies contain statements of their own.  Whole statements are then packed into chunks
+    of up to max_tokens tokens.  A statement that is larger than max_tokens on its own is put in a
+    chunk by itself, rather than being cut in half.
+
+    count_tokens is a function that returns the number of tokens in a piece of text, e.g. using tiktoken.
+    batch_separator_pattern is an optional regular expression for the lines that end a batch in the
+    dialect, e.g. a line ending with a semicolon, as used by the SqlBatchReader.
+    """
+
+    def __init__(self, count_tokens, max_tokens=2000, batch_separator_pattern=None) -> None:
+        if max_tokens < 1:
+            raise ValueError(f"max_tokens must be at least 1: {max_tokens}")
+        self.count_tokens = count_tokens
+        self.max_tokens = max_tokens
+        self.batch_separator = re.compile(batch_separator_pattern, re.IGNORECASE | re.MULTILINE) if batch_separator_pattern else None
+
+
+    @staticmethod
+    def _end_of_line(sql_code, offset):
+        """
+        Returns the offset of the start of the next line, or offset if there is code after it on the line.
+        """
+        end = offset
+        while end < len(sql_code) and sql_code[end] in ' \t\r':
+            end += 1
+        if end < len(sql_code) and sql_code[end] == '\n':
+            return end + 1
+        return offset if end < len(sql_code) else end
+
+
+    def split_batches(self, sql_code):
+        """
+        Yields the batches in the code, each ending with its batch separator: GO or / on a line of its own,
+        or a line that matches the batch_separator_pattern.  Separators inside strings and comments are ignored.
+        """
+        start = 0
+        for match in TOKEN_PATTERN.finditer(sql_code):
+            if match.lastgroup == 'separator':
+                end = self._end_of_line(sql_code, match.end())
+            elif match.lastgroup == 'space' and match.group() == '\n' and self.batch_separator is not None:
+                end = match.end()
+                line_start = sql_code.rfind('\n', 0, match.start()) + 1
+                if not self.batch_separator.match(sql_code, line_start, end):
+                    continue
+            else:
+                continue
+            if end > start:
+                yield sql_code[start:end]
+                start = end
+        if sql_code[start:].strip():
+            yield sql_code[start:]
+
+
+    def split_statements(self, batch):
+        """
+        Yields the statements in a batch, each ending with its semicolon.
+
+        A statement that creates an object with a body is kept whole.  In a batch that ends with a batch
+        separator it runs from its CREATE to the separator.  In a batch without one, e.g. a file with no
+        GO statements, it ends at the END of its outermost BEGIN block, or at the first semicolon if it
+        has no block, e.g. a view.
+        """
+        tokens = list(tokenize(batch))
+        has_separator = any(token.kind == 'separator' for token in tokens)
+        start = 0
+        depth = 0
+        i = 0
+        while i < len(tokens):
+            token = tokens[i]
+            if token.value == '(':
+                depth += 1
+            elif token.value == ')':
+                depth -= 1
+            elif token.value == ';' and depth == 0:
+                end = self._end_of_line(batch, token.end)
+                yield batch[start:end]
+                start = end
+            elif depth == 0 and is_keyword(token, 'CREATE', 'ALTER') and self._creates_body_object(tokens, i + 1):
+                line_start = batch.rfind('\n', 0, token.start) + 1
+                body_start = line_start if line_start >= start and not batch[line_start:token.start].strip() else token.start
+                if batch[start:body_start].strip():
+                    yield batch[start:body_start]
+                    start = body_start
+                end = len(batch) if has_separator else self._end_of_body(batch, tokens, i + 1)
+                yield batch[start:end]
+                start = end
+                while i < len(tokens) and tokens[i].start < end:
+                    i += 1
+                continue
+            i += 1
+        if batch[start:].strip():
+            yield batch[start:]
+
+
+    @staticmethod
+    def _creates_body_object(tokens, i):
+        while i < len(tokens) and is_keyword(tokens[i], *DdlRecognizer.CREATE_MODIFIERS, 'DEFINER', 'ALTER'):
+            i += 1
+        return i < len(tokens) and is_keyword(tokens[i], 'PROC', 'PROCEDURE', 'FUNCTION', 'TRIGGER', 'VIEW', 'PACKAGE')
+
+
+    def _end_of_body(self, batch, tokens, i):
+        """
+        Returns the offset of the end of a body statement that starts before token i, in a batch without a separator.
+        The statement ends at the line of the END of its outermost BEGIN block, e.g. END; or END $$, or at the
+        first semicolon outside a block.
+        """
+        depth = 0
+        block_depth = 0
+        has_block = False
+        while i < len(tokens):
+            token = tokens[i]
+            following = tokens[i + 1] if i + 1 < len(tokens) else None
+            if token.value == '(':
+                depth += 1
+            elif token.value == ')':
+                depth -= 1
+            elif is_keyword(token, 'BEGIN') and not is_keyword(following, 'TRAN', 'TRANSACTION', 'DISTRIBUTED'):
+                block_depth += 1
+                has_block = True
+            elif is_keyword(token, 'CASE'):
+                block_depth += 1
+            elif is_keyword(token, 'END'):
+                if is_keyword(following, 'IF', 'LOOP', 'WHILE', 'REPEAT'):
+                    i += 2
+                    continue
+                if is_keyword(following, 'CASE'):
+                    i += 1
+                block_depth -= 1
+                if block_depth <= 0 and has_block:
+                    line_end = batch.find('\n', token.end)
+                    return len(batch) if line_end == -1 else line_end + 1
+            elif token.value == ';' and depth == 0 and block_depth == 0:
+                return self._end_of_line(batch, token.end)
+            i += 1
+        return len(batch)
+
+
+    def _statements(self, sql_code):
+        """
+        Yields the statements in the code with their token counts.
+        """
+        for batch in self.split_batches(sql_code):
+            batch_tokens = self.count_tokens(batch)
+            if batch_tokens <= self.max_tokens:
+                yield batch, batch_tokens
+            else:
+                for statement in self.split_statements(batch):
+                    yield statement, self.count_tokens(statement)
+
+
+    def chunk(self, sql_code):
+        """
+        Yields the chunks of the code.  Joining the chunks together gives back the original code,
+        apart from any white space at the end.
+        """
+        chunk = []
+        chunk_tokens = 0
+        for statement, statement_tokens in self._statements(sql_code):
+            if chunk and chunk_tokens + statement_tokens > self.max_tokens:
+                yield ''.join(chunk)
+                chunk, chunk_tokens = [], 0
+            chunk.append(statement)
+            chunk_tokens += statement_tokens
+        if chunk:
+            yield ''.join(chunk)
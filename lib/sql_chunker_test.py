@@ -0,0 +1,74 @@
+import pytest
+from lib.sql_chunker import TokenAwareSqlChunker
+
+
+def count_words(text):
+    return len(text.split())
+
+
+def test_chunk_packs_whole_batches():
+    code = "".join(f"CREATE TABLE T{i} (ID int)\nGO\n" for i in range(10))
+    chunks = list(TokenAwareSqlChunker(count_words, max_tokens=12).chunk(code))
+    assert chunks == ["".join(f"CREATE TABLE T{i} (ID int)\nGO\n" for i in range(j, j + 2)) for j in range(0, 10, 2)]
+
+
+def test_chunk_returns_the_original_code():
+    code = "-- header\nCREATE TABLE A (ID int);\nINSERT INTO A VALUES (1);\nGO\n\nCREATE TABLE B (ID int)\ngo\nSELECT 1\n"
+    for max_tokens in (1, 5, 10, 1000):
+        assert "".join(TokenAwareSqlChunker(count_words, max_tokens=max_tokens).chunk(code)) == code
+
+
+def test_chunk_splits_large_batches_at_semicolons():
+    code = "CREATE TABLE A (ID int, Name varchar(10));\nINSERT INTO A VALUES (1, 'a;b');\nCREATE TABLE B (ID int);\n"
+    chunks = list(TokenAwareSqlChunker(count_words, max_tokens=6).chunk(code))
+    assert chunks == [
+        "CREATE TABLE A (ID int, Name varchar(10));\n",
+        "INSERT INTO A VALUES (1, 'a;b');\n",
+        "CREATE TABLE B (ID int);\n",
+    ]
+
+
+def test_chunk_never_splits_procedure_bodies():
+    procedure = "CREATE PROCEDURE P AS\nBEGIN\n  DELETE FROM A;\n  DELETE FROM B;\nEND\nGO\n"
+    code = "CREATE TABLE A (ID int)\nGO\n" + procedure + "CREATE TABLE B (ID int)\nGO\n"
+    chunks = list(TokenAwareSqlChunker(count_words, max_tokens=5).chunk(code))
+    assert procedure in chunks
+
+
+def test_chunk_ignores_separators_in_strings():
+    code = "INSERT INTO A VALUES ('\nGO\n')\nGO\n"
+    assert list(TokenAwareSqlChunker(count_words, max_tokens=1).chunk(code)) == [code]
+
+
+def test_max_tokens_must_be_positive():
+    with pytest.raises(ValueError):
+        TokenAwareSqlChunker(count_words, max_tokens=0)
+
+
+def test_chunk_splits_code_without_separators_within_the_budget():
+    # e.g. a MySQL or Oracle dump, with no GO statements.
+    procedure = (
+        "DELIMITER $$\n"
+        "CREATE PROCEDURE `CustOrderHist`(in AtCustomerID varchar(5))\nBEGIN\n"
+        "  SELECT CASE WHEN Quantity > 1 THEN 1 END FROM Orders WHERE CustomerID = AtCustomerID;\n"
+        "  IF AtCustomerID IS NULL THEN\n    DELETE FROM Orders;\n  END IF;\n"
+        "END $$\n"
+        "DELIMITER ;\n"
+    )
+    view = "CREATE VIEW `Orders Qry` AS\nSELECT CASE WHEN OrderID > 1 THEN 1 END AS X\nFROM Orders;\n"
+    code = "".join(f"CREATE TABLE T{i} (ID int);\nINSERT INTO T{i} VALUES (1);\n" for i in range(200)) + view + procedure
+    code += "".join(f"INSERT INTO T{i} VALUES (2);\n" for i in range(200))
+    max_tokens = 60
+    chunks = list(TokenAwareSqlChunker(count_words, max_tokens=max_tokens).chunk(code))
+    assert "".join(chunks) == code
+    assert all(count_words(chunk) <= max_tokens for chunk in chunks)
+    assert any(view in chunk for chunk in chunks)
+    body = procedure[procedure.index("CREATE"):procedure.index("DELIMITER ;")]
+    assert any(body in chunk for chunk in chunks)
+
+
+def test_split_batches_ends_batches_at_lines_matching_the_separator_pattern():
+    code = "CREATE TABLE a (x int);\n/* not the end;\n*/ CREATE TABLE b (s varchar(9) DEFAULT 'x;\n');\n"
+    chunker = TokenAwareSqlChunker(count_words, batch_separator_pattern=r'.*;\s*$')
+    assert list(chunker.split_batches(code)) == [
+        "CREATE TABLE a (x int);\n", "/* not the end;\n*/ CREATE TABLE b (s varchar(9) DEFAULT 'x;\n');\n"]
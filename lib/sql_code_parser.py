@@ -1,50 +1,222 @@
-from langchain.document_loaders import DirectoryLoader, TextLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.chat_models import ChatOpenAI
-from langchain.prompts.chat import (
-    ChatPromptTemplate,
-    SystemMessagePromptTemplate,
-    AIMessagePromptTemplate,
-    HumanMessagePromptTemplate,
-)
 import pandas as pd
 import json
 import re
-import json
 import os
+import glob
+import itertools
+import functools
+import threading
+
+from lib.catalogue_store import read_ddl_statements, write_ddl_statements
+from lib.chunk_filter import DataLoadChunkFilter
+from lib.instrumentation import Instrumentation
+from lib.ddl_recognizer import DdlRecognizer
+from lib.llm_backend import CompiledChatPrompt, LlmBackend
+from lib.llm_dispatcher import LlmDispatcher
+from lib.procedure_index import ProcedureIndex
+from lib.result_cache import ResultCache, read_fingerprint, write_fingerprint
+from lib.sql_batch_reader import SqlBatchReader
+from lib.sql_chunker import TokenAwareSqlChunker
+from lib.table_access_analyzer import TableAccessAnalyzer, analyze_all
+from lib.worker_pool import WorkerPool
+
+@functools.lru_cache(maxsize=1)
+def _tiktoken_encoding():
+    import tiktoken
+    return tiktoken.encoding_for_model("gpt-3.5-turbo")
+
+
+def count_tiktoken_tokens(text):
+    """
+    Returns the number of tokens in the text, for the gpt-3.5-turbo model.
+    """
+    return len(_tiktoken_encoding().encode(text, disallowed_special=()))
+
+
+def read_code_fragments(path, options):
+    """
+    Yields the code fragments to parse from a file.  The options are those of the SqlCodeParser.
+
+    In streaming mode the file is read a batch at a time, so memory use is bounded by the stream_window_size
+    rather than by the size of the file.  Otherwise the file is loaded into memory and then split into chunks
+    of whole statements, sized by token count.  Either way the encoding is detected from the byte order mark,
+    and batches end at the dialect's batch separators.
+    """
+    if options['streaming']:
+        reader = SqlBatchReader(os.path.dirname(path), window_size=options['stream_window_size'],
+                                batch_separator_pattern=options['batch_separator_pattern'])
+        yield from reader.read_file_fragments(path)
+        return
+
+    with SqlBatchReader.open_text(path) as file:
+        code = file.read()
+    chunker = TokenAwareSqlChunker(options['count_tokens'], max_tokens=options['chunk_token_budget'],
+                                   batch_separator_pattern=options['batch_separator_pattern'])
+    yield from chunker.chunk(code)
+
+
+def classify_files(paths, options):
+    """
+    Splits each file into code fragments, drops the fragments that only load data and classifies the rest
+    with the DDL recognizer, e.g. in a worker process.  The options are those of the SqlCodeParser.
+
+    Returns, for each file, a list of (fragment, ddl_statements) pairs, where ddl_statements is None if the
+    fragment needs to be sent to the LLM, and the number and total size in bytes of the fragments skipped.
+    """
+    ddl_recognizer = DdlRecognizer() if options['use_ddl_recognizer'] else None
+    chunk_filter = options['chunk_filter']
+    results = []
+    for path in paths:
+        pairs = []
+        skipped_chunks = skipped_bytes = 0
+        for fragment in read_code_fragments(path, options):
+            if chunk_filter is not None and chunk_filter.is_data_only(fragment):
+                skipped_chunks += 1
+                skipped_bytes += len(fragment.encode('utf-8'))
+            else:
+                pairs.append((fragment, ddl_recognizer.recognize(fragment) if ddl_recognizer else None))
+        results.append((pairs, skipped_chunks, skipped_bytes))
+    return results
+
+
+class InvalidLlmResponseError(Exception):
+    """
+    Raised when the response from the LLM is not in the expected format.
+    """
+
 
 class SqlCodeParser:
     """
     This class contains the functions for parsing SQL code.
     """
 
-    CACHE_FILE_NAME = './results/parsed_code_cache.csv'
+    CACHE_FILE_NAME = './results/parsed_code_cache.parquet'
+    RESULT_CACHE_FILE_NAME = './results/llm_result_cache.sqlite'
 
-    def __init__(self, source_directory, source_file_glob_pattern="**/*.sql", use_cache=True, debug=True, cache_file_name=CACHE_FILE_NAME):
+    def __init__(self, source_directory, source_file_glob_pattern="**/*.sql", use_cache=True, debug=True, cache_file_name=CACHE_FILE_NAME,
+                 max_concurrency=1, requests_per_second=None, max_retries=3, chat_model=None,
+                 result_cache_file_name=RESULT_CACHE_FILE_NAME, result_cache_max_bytes=ResultCache.DEFAULT_MAX_BYTES,
+                 use_ddl_recognizer=True, chunk_filter=None, use_chunk_filter=True, streaming=False, stream_window_size=2000,
+                 chunk_token_budget=2000, count_tokens=None, batch_separator_pattern=SqlBatchReader.DEFAULT_BATCH_SEPARATOR_PATTERN,
+                 instrumentation=None, llm_backend=None, use_table_access_analyzer=True, min_table_access_confidence=0.8, worker_pool=None):
         """
         Initialise the class with the source directory and the glob pattern for the SQL files to parse.
+
+        The code fragments are sent to the LLM max_concurrency at a time, at no more than
+        requests_per_second (unlimited if None).  Failed requests are retried max_retries times.
+
+        The requests are sent through the llm_backend, which keeps a pool of connections to the API for the
+        life of the parser.  By default it uses the OpenAI chat model, or the chat_model if one is provided,
+        e.g. a fake model for testing.  The prompts are compiled once, when they are first used.
+
+        Every LLM result is stored in a persistent result cache, keyed by a hash of the model name and prompt.
+        When use_cache is True, results are served from that cache so only new or changed code is sent to the LLM.
+
+        When use_ddl_recognizer is True, code fragments that contain only simple DDL statements and data are
+        classified locally by the DdlRecognizer, and only the remaining fragments are sent to the LLM.
+
+        Likewise, when use_table_access_analyzer is True, the tables manipulated by each procedure are found by the
+        TableAccessAnalyzer, and only the procedures it analyzes with a confidence below min_table_access_confidence,
+        e.g. those using dynamic SQL, are sent to the LLM.
+
+        Code fragments that only load data are dropped before parsing if chunk_filter.is_data_only(fragment)
+        returns True.  The chunk_filter defaults to a DataLoadChunkFilter.  Set use_chunk_filter to False to parse
+        every fragment.
+
+        In streaming mode the source files are read a batch at a time instead of being loaded into memory,
+        and are split into fragments of up to stream_window_size characters.  Otherwise the code is split into
+        fragments of whole statements, of up to chunk_token_budget tokens each.
+
+        count_tokens is a function that counts the tokens in a piece of text.  It defaults to counting with
+        tiktoken, using the encoding for the gpt-3.5-turbo model.
+
+        batch_separator_pattern matches the lines that end a batch of code, e.g. GO for SQL Server.  It is used
+        to find the procedure declarations and to read the files in streaming mode.
+
+        The timings, LLM token counts and cache hits are recorded in the instrumentation object, if one is given.
+
+        If a worker_pool with more than one worker is given, then the local work is sharded across its processes:
+        the files are split into fragments and classified, and the procedure index is built, a shard of files
+        at a time, and the procedures are analyzed by the table access analyzer a shard of procedures at a time.
+        count_tokens and chunk_filter are sent to the workers, so they must be picklable.
         """
         self.source_directory = source_directory
         self.source_file_glob_pattern = source_file_glob_pattern
         self.use_cache = use_cache
         self.debug = debug
         self.cache_file_name = cache_file_name
+        self.llm_backend = llm_backend or LlmBackend(chat_model, max_connections=max_concurrency)
+        self.dispatcher = LlmDispatcher(max_concurrency=max_concurrency, requests_per_second=requests_per_second, max_retries=max_retries)
+        self.result_cache = ResultCache(result_cache_file_name, max_bytes=result_cache_max_bytes)
+        self.ddl_recognizer = DdlRecognizer() if use_ddl_recognizer else None
+        self.table_access_analyzer = TableAccessAnalyzer() if use_table_access_analyzer else None
+        self.min_table_access_confidence = min_table_access_confidence
+        self.chunk_filter = (chunk_filter or DataLoadChunkFilter()) if use_chunk_filter else None
+        self.streaming = streaming
+        self.stream_window_size = stream_window_size
+        self.chunk_token_budget = chunk_token_budget
+        self.batch_separator_pattern = batch_separator_pattern
+        self.instrumentation = instrumentation or Instrumentation()
+        self.count_tokens = count_tokens or count_tiktoken_tokens
+        self.worker_pool = worker_pool or WorkerPool()
+        self._procedure_index = None
+        self._single_prompt_overhead = 0
+        self._batch_prompt_overhead = 0
+        self._statistics_lock = threading.Lock()
+        self.batch_statistics = {}
+        self._prompts = None
+        self.parse_statistics = {}
+        self.table_access_statistics = {'local_procedures': 0, 'llm_procedures': 0}
+
+
+    @property
+    def prompts(self):
+        """
+        The compiled prompts, by name.  They are compiled once, on first use, rather than for every request,
+        and not at all if every result comes from the caches.
+        """
+        if self._prompts is None:
+            self._prompts = {
+                'ddl_statements': CompiledChatPrompt(self._ddl_statements_prompt()),
+                'procedure_tables': CompiledChatPrompt(self._procedure_tables_prompt()),
+                'procedure_tables_batch': CompiledChatPrompt(self._batch_procedure_tables_prompt()),
+            }
+        return self._prompts
 
 
-    def _find_ddl_statements_in_code_segment(self, sql_code):
+    def _get_json_completion(self, messages, call_name='llm'):
         """
-        Find all the Data Definition Language (DDL) statements in the SQL CODE fragment
-        provided and extract the statement type and the name of the database object 
-        being created, altered or dropped.
+        Get a chat completion for the messages and parse it as JSON.
 
-        Output Format:
-        An array, containing the name of the database object and the DDL statement type in UPPERCASE text.
-        
-        Example:
-        [{"db_object_name": "EmployeeID", "sql_operation": "CREATE INDEX"}]
+        The result is served from the result cache if the same prompt has been sent to the same model before.
+        Raises an InvalidLlmResponseError if the response is not valid JSON, in which case nothing is cached.
+        The request is recorded in the instrumentation under the call_name.
+        """
+        key = ResultCache.make_key(self.llm_backend.model_name, *[f"{message.type}: {message.content}" for message in messages])
+        if self.use_cache:
+            result = self.result_cache.get(key)
+            self.instrumentation.record_cache('llm_result_cache', result is not None)
+            if result is not None:
+                return result
+
+        start = self.instrumentation.clock()
+        content, prompt_tokens, completion_tokens = self.llm_backend.complete(messages)
+        self.instrumentation.record_llm_call(call_name, self.instrumentation.clock() - start, prompt_tokens, completion_tokens)
+        try:
+            result = json.loads(content)
+        except json.JSONDecodeError:
+            raise InvalidLlmResponseError(f"Failed to parse the following response into JSON:\n{content}")
+
+        self.result_cache.put(key, result)
+        return result
+
+
+    def _ddl_statements_prompt(self):
+        """
+        Returns the prompt for finding the DDL statements in a code fragment.
         """
+        from langchain.prompts.chat import ChatPromptTemplate, SystemMessagePromptTemplate, AIMessagePromptTemplate, HumanMessagePromptTemplate
 
-        chat = ChatOpenAI(model="gpt-3.5-turbo", temperature=0, verbose=True)
         system_message_prompt = SystemMessagePromptTemplate.from_template("""
             Your are a SQL code parser.
 
@@ -86,7 +258,7 @@ class SqlCodeParser:
 
         Output:
         """)
-        chat_prompt = ChatPromptTemplate.from_messages([
+        return ChatPromptTemplate.from_messages([
             system_message_prompt, 
             example1_prompt, example1_response,
             example2_prompt, example2_response,
@@ -96,17 +268,116 @@ class SqlCodeParser:
             final_prompt
         ])
 
+
+    def _find_ddl_statements_in_code_segment(self, sql_code):
+        """
+        Find all the Data Definition Language (DDL) statements in the SQL CODE fragment
+        provided and extract the statement type and the name of the database object 
+        being created, altered or dropped.
+
+        Output Format:
+        An array, containing the name of the database object and the DDL statement type in UPPERCASE text.
+        
+        Example:
+        [{"db_object_name": "EmployeeID", "sql_operation": "CREATE INDEX"}]
+        """
         # get a chat completion from the formatted messages
-        llm_response = chat(chat_prompt.format_prompt(sql_code_fragment=sql_code).to_messages())
         try:
-            result = json.loads(llm_response.content)
-        except:
-            print(f"\nFailed to parse the following response into JSON:\n{llm_response.content}\n\nThis content will be excluded.\n\nThe input SQL code was:\n{sql_code}\n\n")
+            result = self._get_json_completion(self.prompts['ddl_statements'].format_messages(sql_code_fragment=sql_code), 'ddl_statements')
+        except InvalidLlmResponseError as e:
+            print(f"\n{e}\n\nThis content will be excluded.\n\nThe input SQL code was:\n{sql_code}\n\n")
             result = []
 
         return result
 
 
+    def _fragment_options(self):
+        """
+        Returns the options used to read and classify the code fragments, as passed to read_code_fragments and classify_files.
+        """
+        return {
+            'use_ddl_recognizer': self.ddl_recognizer is not None,
+            'chunk_filter': self.chunk_filter,
+            'streaming': self.streaming,
+            'stream_window_size': self.stream_window_size,
+            'batch_separator_pattern': self.batch_separator_pattern,
+            'chunk_token_budget': self.chunk_token_budget,
+            'count_tokens': self.count_tokens,
+        }
+
+
+    def _load_code_fragments(self, source_files):
+        """
+        Yields the code fragments to parse from the source files, in order.
+        The files are read in the same way as by the workers, see read_code_fragments.
+        """
+        options = self._fragment_options()
+        for path in source_files:
+            yield from read_code_fragments(path, options)
+
+
+    def _filter_data_only_fragments(self, fragments):
+        """
+        Drops the fragments that only load data, as they don't contain any DDL statements.
+        """
+        for content in fragments:
+            if self.chunk_filter is not None and self.chunk_filter.is_data_only(content):
+                self.parse_statistics['skipped_chunks'] += 1
+                self.parse_statistics['skipped_bytes'] += len(content.encode('utf-8'))
+            else:
+                yield content
+
+
+    def _classify_code_segment_locally(self, sql_code):
+        """
+        Classifies the code fragment with the DDL recognizer, if possible.
+        Returns the code and its DDL statements, or None if the fragment needs to be sent to the LLM.
+        """
+        database_objects = self.ddl_recognizer.recognize(sql_code) if self.ddl_recognizer else None
+        if database_objects is None:
+            self.parse_statistics['llm_chunks'] += 1
+            return None
+        self.parse_statistics['local_chunks'] += 1
+        return sql_code, database_objects
+
+
+    def _classify_fragments_in_workers(self, source_files):
+        """
+        Splits the source files into fragments and classifies them with the DDL recognizer on the worker pool,
+        sharded by file.  Returns the (fragment, ddl_statements) pairs in file order, where ddl_statements is
+        None for the fragments that need to be sent to the LLM.
+        """
+        options = self._fragment_options()
+        pairs = []
+        for file_pairs, skipped_chunks, skipped_bytes in self.worker_pool.map(classify_files, source_files, options, weight=os.path.getsize):
+            pairs.extend(file_pairs)
+            self.parse_statistics['skipped_chunks'] += skipped_chunks
+            self.parse_statistics['skipped_bytes'] += skipped_bytes
+        return pairs
+
+
+    def _count_classified_fragment(self, fragment):
+        """
+        Returns the fragment and its DDL statements if it was classified locally by a worker, or None if it
+        needs to be sent to the LLM.
+        """
+        content, database_objects = fragment
+        if database_objects is None:
+            self.parse_statistics['llm_chunks'] += 1
+            return None
+        self.parse_statistics['local_chunks'] += 1
+        return content, database_objects
+
+
+    def _find_ddl_statements_in_fragment(self, fragment):
+        """
+        Returns the fragment and the DDL statements found in it by the LLM.
+        The fragment is either the code, or a (code, None) pair from the workers.
+        """
+        content = fragment if isinstance(fragment, str) else fragment[0]
+        return content, self._find_ddl_statements_in_code_segment(content)
+
+
     def _search_all_sql_files_for_ddl_statements(self):
         """
         Reads the SQL code from the files in the source directory and parse the code to 
@@ -138,54 +409,97 @@ class SqlCodeParser:
         if not os.path.exists(self.source_directory):
             raise Exception(f"Source directory does not exist: {self.source_directory}")
 
-        # Load the code to analyse
-        loader = DirectoryLoader(
-            self.source_directory, glob=self.source_file_glob_pattern, loader_cls=TextLoader, show_progress=True
-        )
-        documents = loader.load()
-
-        # Split the code into chunks, ideally where there is a GO statement which indicates the end of a significant code block.
-        splitter = RecursiveCharacterTextSplitter(
-            separators=["GO\n", "go\n", "\n\n", "\n"], chunk_size=2000, chunk_overlap=0, keep_separator=True
-        )
-        chunks = splitter.split_documents(documents)
+        self.parse_statistics = {'skipped_chunks': 0, 'skipped_bytes': 0, 'local_chunks': 0, 'llm_chunks': 0}
+        source_files = SqlBatchReader(self.source_directory, self.source_file_glob_pattern).file_paths()
+        self.instrumentation.add_bytes_ingested(sum(os.path.getsize(path) for path in source_files))
+        if self.worker_pool.workers > 1:
+            fragments = self._classify_fragments_in_workers(source_files)
+            classify_locally = self._count_classified_fragment
+        else:
+            fragments = self._filter_data_only_fragments(self._load_code_fragments(source_files))
+            classify_locally = self._classify_code_segment_locally
 
         # In debug mode we only process a few chunks to save time and cost.
-        sample_chunks = chunks[0:3] if self.debug else chunks
-
-        print(f"Parsing {len(sample_chunks)} code fragments.")
-        ddl_statements_df = pd.DataFrame(columns=['db_object_name', 'sql_operation', 'sql_code'])
-        for chunk in sample_chunks:
+        fragments = itertools.islice(fragments, 3) if self.debug else fragments
+
+        # Classify the simple fragments locally, then send the rest to the LLM.
+        # The fragments are sent to the LLM concurrently, the results come back in the original order.
+        print("Parsing code fragments.")
+        results = self.dispatcher.map(
+            lambda fragment: self._find_ddl_statements_in_fragment(fragment),
+            fragments,
+            resolve=classify_locally)
+
+        # Accumulate the records in columns and build the data frame once at the end.
+        columns = {'db_object_name': [], 'sql_operation': [], 'sql_code': []}
+        for content, database_objects in results:
             print(".", end="") # progress indicator
-            content = chunk.page_content
-            database_objects = self._find_ddl_statements_in_code_segment(content)
-            if len(database_objects) > 0:
-                temp_df = pd.DataFrame(database_objects)
-                temp_df['sql_code'] = content
-                ddl_statements_df = pd.concat([ddl_statements_df, temp_df], ignore_index=True)
-
+            for database_object in database_objects:
+                columns['db_object_name'].append(database_object.get('db_object_name'))
+                columns['sql_operation'].append(database_object.get('sql_operation'))
+                columns['sql_code'].append(content)
+        ddl_statements_df = pd.DataFrame(columns)
+        self.result_cache.flush()
+
+        print(f"\nSkipped {self.parse_statistics['skipped_chunks']} code fragments ({self.parse_statistics['skipped_bytes']} bytes) that only load data.")
+        print(f"Classified {self.parse_statistics['local_chunks']} code fragments locally and {self.parse_statistics['llm_chunks']} with the LLM.")
         return ddl_statements_df
 
 
-    def find_ddl_statements(self):
+    def source_fingerprint(self):
+        """
+        Returns a fingerprint of the source files, based on their paths, sizes and modification times,
+        and of the options that change how the files are split into code fragments.
+        """
+        paths = sorted(glob.glob(os.path.join(self.source_directory, self.source_file_glob_pattern), recursive=True))
+        parts = [f"debug={self.debug}", f"streaming={self.streaming}", f"chunk_token_budget={self.chunk_token_budget}",
+                 f"batch_separator_pattern={self.batch_separator_pattern}"]
+        for path in paths:
+            stat = os.stat(path)
+            parts.append(f"{path}:{stat.st_size}:{stat.st_mtime_ns}")
+        return ResultCache.make_key(*parts)
+
+
+    def find_ddl_statements(self, columns=None):
         """
         Finds all DDL statements in the SQL code in the source directory.
         Uses cached results if they exist and the use_cache parameter is set to True.
+
+        The cached results are only used as a whole if the source files have not changed since they were
+        parsed.  Otherwise the code is parsed again, but only new or changed code fragments are sent to the LLM.
+        The results are cached in Parquet files, with each code chunk stored once (see catalogue_store).
         
         The output is a dataframe with the following columns:
         - db_object_name: The name of the database object being created, altered or dropped.
-        - sql_operation: The type of DDL statement.
+        - sql_operation: The type of DDL statement, as a categorical column.
         - sql_code: The SQL code that was parsed.
+
+        If columns is given, then only those columns are returned, and only those columns are read from the cache.
         """
-        if self.use_cache and os.path.exists(self.cache_file_name):
-            df = pd.read_csv(self.cache_file_name)
-        else:
+        with self.instrumentation.stage('parse_ddl'):
+            fingerprint = self.source_fingerprint()
+            cache_hit = self.use_cache and os.path.exists(self.cache_file_name) and read_fingerprint(self.cache_file_name) == fingerprint
+            if self.use_cache:
+                self.instrumentation.record_cache('parsed_code_cache', cache_hit)
+            if cache_hit:
+                return read_ddl_statements(self.cache_file_name, columns)
+
             df = self._search_all_sql_files_for_ddl_statements()
-            df.to_csv(self.cache_file_name, index=False)
-        
-        return df
+            write_ddl_statements(self.cache_file_name, df)
+            write_fingerprint(self.cache_file_name, fingerprint)
+        df['sql_operation'] = df['sql_operation'].astype('category')
+        return df if columns is None else df[columns]
             
 
+    @staticmethod
+    @functools.lru_cache(maxsize=1024)
+    def _procedure_declaration_pattern(procedure_name):
+        """
+        Returns a compiled regular expression that matches the declaration of the procedure.
+        """
+        return re.compile(r'(CREATE PROCEDURE +?"?%s"?.+?(\nGO|$))' % re.escape(procedure_name), re.DOTALL | re.IGNORECASE)
+
+
     def extract_procedure_declaration_from_code(self, procedure_name, sql_code):
         """
         Extract the procedure declaration from the SQL code.
@@ -193,10 +507,7 @@ class SqlCodeParser:
         Uses a regular expression to fetch the code between the CREATE PROCEDURE 
         statement and the GO statement.
         """
-        regex_pattern = r'(CREATE PROCEDURE +?"?%s"?.+?(\nGO|$))' % procedure_name
-        # regex_pattern = r'(CREATE PROCEDURE +?"?%s"?[^GO]+?(\nGO|$))' % procedure_name
-        match = re.search(regex_pattern, sql_code, re.DOTALL | re.IGNORECASE)
-        # match = re.search(regex_pattern, sql_code, re.IGNORECASE)
+        match = self._procedure_declaration_pattern(procedure_name).search(sql_code)
         if match:
             procedure_code = match.group(1)
         else:
@@ -204,22 +515,48 @@ class SqlCodeParser:
         return procedure_code
 
 
-    def find_tables_manipulated_by_procedure(self, procedure_name, sql_code):
+    @property
+    def procedure_index(self):
         """
-        Find all the database tables that are manipulated by the procedure.
+        The index of the procedure bodies in the source files, built the first time it is used.
+        """
+        if self._procedure_index is None:
+            if os.path.exists(self.source_directory):
+                worker_pool = self.worker_pool if self.worker_pool.workers > 1 else None
+                self._procedure_index = ProcedureIndex.build(self.source_directory, self.source_file_glob_pattern, self.batch_separator_pattern, worker_pool)
+            else:
+                self._procedure_index = ProcedureIndex(self.batch_separator_pattern)
+        return self._procedure_index
 
-        Returns a list of dictionaries containing the name of the table and the 
-        DML statement type (i.e. SELECT, INSERT, UPDATE, or DELETE).
 
-        Example:
-        [
-            { "table_name": "Order Details", "sql_operation": "SELECT"},
-            { "table_name": "Order Details", "sql_operation": "INSERT"},
-            { "table_name": "Order Details", "sql_operation": "UPDATE"},
-            { "table_name": "Order Details", "sql_operation": "DELETE"},
-        ]
+    def reload_sources(self):
+        """
+        Forgets the procedure index, so that it is rebuilt from the source files the next time it is used,
+        e.g. after the source files have changed.
+        """
+        self._procedure_index = None
+
+
+    def find_procedure_declaration(self, procedure_name, sql_code):
+        """
+        Find the code of the procedure.
+
+        The procedure index is used if the procedure is in it, since the index holds the whole body of
+        the procedure, even if it spans several code fragments.  Otherwise the declaration is extracted
+        from the sql_code fragment that the procedure was found in.
+        """
+        procedure_code = self.procedure_index.get_procedure_code(procedure_name)
+        if procedure_code is None:
+            procedure_code = self.extract_procedure_declaration_from_code(procedure_name, sql_code)
+        return procedure_code
+
+
+    def _procedure_tables_prompt(self):
+        """
+        Returns the prompt for finding the tables manipulated by a single procedure.
         """
-        chat = ChatOpenAI(model="gpt-3.5-turbo", temperature=0, verbose=True)
+        from langchain.prompts.chat import ChatPromptTemplate, SystemMessagePromptTemplate, AIMessagePromptTemplate, HumanMessagePromptTemplate
+
         system_message_prompt = SystemMessagePromptTemplate.from_template("""
             Your are a SQL code parser.
 
@@ -264,15 +601,267 @@ class SqlCodeParser:
 
         final_prompt = HumanMessagePromptTemplate.from_template("{sql_code_fragment}")
 
-        chat_prompt = ChatPromptTemplate.from_messages([
+        return ChatPromptTemplate.from_messages([
             system_message_prompt, 
             example1_prompt, example1_response,
             example2_prompt, example2_response,
             final_prompt
         ])
 
+
+    def find_tables_manipulated_by_procedure(self, procedure_name, sql_code):
+        """
+        Find all the database tables that are manipulated by the procedure.
+
+        The procedure is analyzed locally by the table access analyzer, and is only sent to the LLM if the
+        analyzer isn't confident of the result.
+
+        Returns a list of dictionaries containing the name of the table and the 
+        DML statement type (i.e. SELECT, INSERT, UPDATE, or DELETE).
+
+        Example:
+        [
+            { "table_name": "Order Details", "sql_operation": "SELECT"},
+            { "table_name": "Order Details", "sql_operation": "INSERT"},
+            { "table_name": "Order Details", "sql_operation": "UPDATE"},
+            { "table_name": "Order Details", "sql_operation": "DELETE"},
+        ]
+        """
+        tables = self._find_tables_locally(sql_code)
+        if tables is not None:
+            return tables
+        return self.find_tables_with_llm(procedure_name, sql_code)
+
+
+    def _find_tables_locally(self, sql_code):
+        """
+        Finds the tables manipulated by the procedure with the table access analyzer.
+        Returns None if the analyzer isn't confident of the result, so the procedure needs to be sent to the LLM.
+        """
+        if self.table_access_analyzer is None:
+            return None
+        with self.instrumentation.timed('table_access_analyzer'):
+            analysis = self.table_access_analyzer.analyze(sql_code)
+        local = analysis.confidence >= self.min_table_access_confidence
+        with self._statistics_lock:
+            self.table_access_statistics['local_procedures' if local else 'llm_procedures'] += 1
+        return analysis.tables if local else None
+
+
+    def find_tables_locally(self, procedures):
+        """
+        Finds the tables manipulated by each of the (procedure_name, sql_code) pairs with the table access analyzer,
+        on the worker pool.  Returns a dictionary of the tables by procedure name, for the procedures that the
+        analyzer is confident about; the rest need to be sent to the LLM.
+        """
+        procedures = list(procedures)
+        if self.table_access_analyzer is None or not procedures:
+            return {}
+        with self.instrumentation.timed('table_access_analyzer'):
+            analyses = self.worker_pool.map(analyze_all, [sql_code for _, sql_code in procedures], weight=len)
+        results = {
+            procedure_name: analysis.tables
+            for (procedure_name, _), analysis in zip(procedures, analyses)
+            if analysis.confidence >= self.min_table_access_confidence
+        }
+        with self._statistics_lock:
+            self.table_access_statistics['local_procedures'] += len(results)
+            self.table_access_statistics['llm_procedures'] += len(procedures) - len(results)
+        return results
+
+
+    def find_tables_with_llm(self, procedure_name, sql_code):
+        """
+        Find the tables manipulated by the procedure with the LLM, without trying the table access analyzer first.
+        """
         # get a chat completion from the formatted messages
-        llm_response = chat(chat_prompt.format_prompt(procedure_name=procedure_name, sql_code_fragment=sql_code).to_messages())
-        result = json.loads(llm_response.content)
-        return result
+        messages = self.prompts['procedure_tables'].format_messages(procedure_name=procedure_name, sql_code_fragment=sql_code)
+        return self._get_json_completion(messages, 'procedure_tables')
+
+
+    def _batch_procedure_tables_prompt(self):
+        """
+        Returns the prompt for finding the tables manipulated by several procedures in one request.
+        """
+        from langchain.prompts.chat import ChatPromptTemplate, SystemMessagePromptTemplate, AIMessagePromptTemplate, HumanMessagePromptTemplate
+
+        system_message_prompt = SystemMessagePromptTemplate.from_template("""
+            Your are a SQL code parser.
+
+            The SQL CODE provided contains several stored procedures, each starting with a ## PROCEDURE: <name> ## header.
+            For each procedure, find all the tables that are queried, inserted into, updated or deleted from and extract the 
+            table name and database operation type (i.e. SELECT, INSERT, UPDATE, or DELETE).
+
+            ## OUTPUT FORMAT ##
+            json object, with one key for each procedure name, containing a json object array of the table names and the DML statement types in UPPERCASE text.
+            Example:
+            {{ "CustOrdersOrders": [{{ "table_name": "Orders", "sql_operation": "SELECT"}}] }}
+
+            If a procedure doesn't manipulate any tables, then return an empty json array for it.
+        """)
+        example_prompt = HumanMessagePromptTemplate.from_template("""
+        ## PROCEDURE: CustOrdersDetail ##
+        CREATE PROCEDURE CustOrdersDetail @OrderID int
+        AS
+        SELECT ProductName,
+            UnitPrice=ROUND(Od.UnitPrice, 2),
+            Quantity,
+            Discount=CONVERT(int, Discount * 100), 
+            ExtendedPrice=ROUND(CONVERT(money, Quantity * (1 - Discount) * Od.UnitPrice), 2)
+        FROM Products P, [Order Details] Od
+        WHERE Od.ProductID = P.ProductID and Od.OrderID = @OrderID
+        go
+
+        ## PROCEDURE: CustOrdersOrders ##
+        CREATE PROCEDURE CustOrdersOrders @CustomerID nchar(5)
+        AS
+        SELECT OrderID, 
+            OrderDate,
+            RequiredDate,
+            ShippedDate
+        FROM Orders
+        WHERE CustomerID = @CustomerID
+        ORDER BY OrderID
+        GO
+        """)
+        example_response = AIMessagePromptTemplate.from_template(
+            '{{ "CustOrdersDetail": [{{ "table_name": "Products", "sql_operation": "SELECT"}}, {{ "table_name": "Order Details", "sql_operation": "SELECT"}}], '
+            '"CustOrdersOrders": [{{ "table_name": "Orders", "sql_operation": "SELECT"}}] }}')
+
+        final_prompt = HumanMessagePromptTemplate.from_template("{sql_code_fragment}")
+
+        return ChatPromptTemplate.from_messages([
+            system_message_prompt,
+            example_prompt, example_response,
+            final_prompt
+        ])
+
+
+    def _count_tokens(self, text):
+        """
+        Returns the number of tokens in the text, counted with count_tokens.
+        """
+        return self.count_tokens(text)
+
+
+    def _count_prompt_tokens(self, messages):
+        """
+        Returns the approximate number of tokens in a list of chat messages, allowing 4 tokens per message for the formatting.
+        """
+        return sum(self._count_tokens(message.content) + 4 for message in messages)
+
+
+    def _format_procedures_for_batch(self, procedures):
+        return "\n\n".join(f"## PROCEDURE: {procedure_name} ##\n{sql_code}" for procedure_name, sql_code in procedures)
+
+
+    def _find_tables_for_batch(self, procedures):
+        """
+        Find the tables manipulated by a batch of (procedure_name, sql_code) pairs, in a single request.
+
+        If the response isn't a json object with a json array for every procedure in the batch, then the
+        batch is split in half and each half is sent straight away.  Single procedures use the single procedure
+        prompt.  Failed requests aren't retried here, so the dispatcher's retries apply to the batch as a
+        whole, and the parts that were answered before a failure are served from the result cache on a retry.
+        Returns a dictionary of the results by procedure name.
+        """
+        if len(procedures) == 1:
+            procedure_name, sql_code = procedures[0]
+            self._record_batch_request(self._single_prompt_overhead)
+            return {procedure_name: self.find_tables_with_llm(procedure_name, sql_code)}
+
+        messages = self.prompts['procedure_tables_batch'].format_messages(sql_code_fragment=self._format_procedures_for_batch(procedures))
+        self._record_batch_request(self._batch_prompt_overhead)
+        try:
+            result = self._get_json_completion(messages, 'procedure_tables_batch')
+        except InvalidLlmResponseError:
+            result = None
+
+        procedure_names = [procedure_name for procedure_name, _ in procedures]
+        if isinstance(result, dict) and all(isinstance(result.get(procedure_name), list) for procedure_name in procedure_names):
+            return {procedure_name: result[procedure_name] for procedure_name in procedure_names}
+
+        print(f"\nThe response for a batch of {len(procedures)} procedures was malformed, splitting the batch.")
+        middle = len(procedures) // 2
+        results = self._find_tables_for_batch(procedures[:middle])
+        results.update(self._find_tables_for_batch(procedures[middle:]))
+        return results
+
+
+    def _record_batch_request(self, prompt_overhead_tokens):
+        with self._statistics_lock:
+            self.batch_statistics['requests'] += 1
+            self.batch_statistics['prompt_overhead_tokens'] += prompt_overhead_tokens
+
+
+    def _pack_procedures_into_batches(self, procedures, token_budget):
+        """
+        Packs the (procedure_name, sql_code) pairs into batches, so that each batch prompt fits in the token budget.
+        A procedure that doesn't fit in the budget on its own is put in a batch by itself.
+        """
+        batches = []
+        batch = []
+        batch_tokens = self._batch_prompt_overhead
+        for procedure_name, sql_code in procedures:
+            procedure_tokens = self._count_tokens(self._format_procedures_for_batch([(procedure_name, sql_code)])) + 2
+            if batch and batch_tokens + procedure_tokens > token_budget:
+                batches.append(batch)
+                batch = []
+                batch_tokens = self._batch_prompt_overhead
+            batch.append((procedure_name, sql_code))
+            batch_tokens += procedure_tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+
+    def find_tables_manipulated_by_procedures(self, procedures, token_budget=3000):
+        """
+        Find all the database tables that are manipulated by each of the procedures, packing several
+        procedures into each request to avoid repeating the prompt and examples for every procedure.
+
+        procedures is an iterable of (procedure_name, sql_code) pairs.  The procedures are packed into batches
+        whose prompts fit in the token_budget, counted with tiktoken, and the batches are sent to the LLM
+        concurrently.  The results of each procedure are cached individually, so only new or changed
+        procedures are sent to the LLM.  Procedures that the table access analyzer is confident about
+        aren't sent at all.
+
+        Returns a dictionary of the results by procedure name, in the same format as
+        find_tables_manipulated_by_procedure.  The batch_statistics attribute records the number of
+        requests made and an estimate of the prompt tokens saved compared with one request per procedure.
+        """
+        procedures = list(procedures)
+        model_name = self.llm_backend.model_name
+        results = self.find_tables_locally(procedures)
+        uncached_procedures = []
+        for procedure_name, sql_code in procedures:
+            if procedure_name in results:
+                continue
+            key = ResultCache.make_key(model_name, 'batched procedure tables', procedure_name, sql_code)
+            cached_result = self.result_cache.get(key) if self.use_cache else None
+            if cached_result is not None:
+                results[procedure_name] = cached_result
+            else:
+                uncached_procedures.append((procedure_name, sql_code))
+        self.result_cache.flush()
+
+        self.batch_statistics = {'procedures': len(uncached_procedures), 'requests': 0, 'prompt_overhead_tokens': 0, 'prompt_tokens_saved': 0}
+        if not uncached_procedures:
+            return results
+
+        # The tokens used by the prompt and examples, which are repeated in every request.
+        self._single_prompt_overhead = self._count_prompt_tokens(self.prompts['procedure_tables'].format_messages(procedure_name="", sql_code_fragment=""))
+        self._batch_prompt_overhead = self._count_prompt_tokens(self.prompts['procedure_tables_batch'].format_messages(sql_code_fragment=""))
+
+        batches = self._pack_procedures_into_batches(uncached_procedures, token_budget)
+        for batch_results in self.dispatcher.map(self._find_tables_for_batch, batches):
+            results.update(batch_results)
+
+        for procedure_name, sql_code in uncached_procedures:
+            key = ResultCache.make_key(model_name, 'batched procedure tables', procedure_name, sql_code)
+            self.result_cache.put(key, results[procedure_name])
+
+        self.batch_statistics['prompt_tokens_saved'] = (
+            self._single_prompt_overhead * len(uncached_procedures) - self.batch_statistics['prompt_overhead_tokens'])
+        return results
 
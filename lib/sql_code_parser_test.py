@@ -1,17 +1,27 @@
 import pytest
+from lib.chunk_filter import DataLoadChunkFilter
 from lib.sql_code_parser import SqlCodeParser
 import pandas as pd
 import re
+import json
+import random
+import time
+from langchain.schema import AIMessage
+from test_support.fake_llm import approximate_token_count
+
 
 @pytest.fixture(scope="module")
-def uncached_sql_code_parser():
+def uncached_sql_code_parser(tmp_path_factory):
     # Setup logic
+    cache_directory = tmp_path_factory.mktemp("uncached_sql_code_parser")
     instance = SqlCodeParser(
         source_directory="source_code/sql_server",
         source_file_glob_pattern="**/*.sql",
         use_cache=False,
         debug=True,
-        cache_file_name="./results/sql_code_parser_tests_cache.csv",
+        cache_file_name=str(cache_directory / "sql_code_parser_tests_cache.parquet"),
+        result_cache_file_name=str(cache_directory / "llm_result_cache.sqlite"),
+        count_tokens=approximate_token_count,
     )
 
     # Your test will run here
@@ -138,3 +148,291 @@ ORDER BY ProductName
 """
     tables = uncached_sql_code_parser.find_tables_manipulated_by_procedure(procedure_name, code)
     assert tables == [{'table_name': 'Order Details', 'sql_operation': 'SELECT'}, {'table_name': 'Orders', 'sql_operation': 'SELECT'}, {'table_name': 'Products', 'sql_operation': 'SELECT'}, {'table_name': 'Categories', 'sql_operation': 'SELECT'}]
+
+
+class FakeChatModel:
+    """
+    A local stand in for the OpenAI chat model, which answers with the tables created in the code fragment.
+    The responses are delayed by a varying amount, so that concurrent requests complete out of order.
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, messages):
+        self.calls += 1
+        code = messages[-1].content
+        time.sleep(random.uniform(0, 0.01))
+        tables = re.findall(r'CREATE TABLE "(.+?)"', code)
+        return AIMessage(content=json.dumps([{"db_object_name": t, "sql_operation": "CREATE TABLE"} for t in tables]))
+
+
+@pytest.fixture
+def fake_source_directory(tmp_path):
+    code = "".join(f'CREATE TABLE "Table{i}" (\n    "ID" int NOT NULL\n)\nGO\n\n' for i in range(40))
+    (tmp_path / "schema.sql").write_text(code)
+    return tmp_path
+
+
+def test_find_ddl_statements_concurrently_keeps_chunk_order(fake_source_directory):
+    chat_model = FakeChatModel()
+    parser = SqlCodeParser(
+        source_directory=str(fake_source_directory),
+        use_cache=False,
+        debug=False,
+        cache_file_name=str(fake_source_directory / "cache.parquet"),
+        result_cache_file_name=str(fake_source_directory / "results.sqlite"),
+        max_concurrency=8,
+        chat_model=chat_model,
+        use_ddl_recognizer=False,
+        chunk_token_budget=100,
+        count_tokens=approximate_token_count,
+    )
+    df = parser.find_ddl_statements()
+    assert df['db_object_name'].tolist() == [f"Table{i}" for i in range(40)]
+    assert chat_model.calls > 1
+
+
+def test_find_ddl_statements_only_sends_changed_code_to_the_llm(fake_source_directory):
+    def create_parser(chat_model):
+        return SqlCodeParser(
+            source_directory=str(fake_source_directory),
+            use_cache=True,
+            debug=False,
+            cache_file_name=str(fake_source_directory / "cache.parquet"),
+            result_cache_file_name=str(fake_source_directory / "results.sqlite"),
+            chat_model=chat_model,
+            use_ddl_recognizer=False,
+            count_tokens=approximate_token_count,
+        )
+
+    first_model = FakeChatModel()
+    first_df = create_parser(first_model).find_ddl_statements()
+
+    schema_file = fake_source_directory / "schema.sql"
+    schema_file.write_text(schema_file.read_text().replace('"Table0"', '"Tablex"'))
+    second_model = FakeChatModel()
+    second_df = create_parser(second_model).find_ddl_statements()
+
+    assert second_model.calls == 1
+    assert second_df['db_object_name'].tolist() == ["Tablex"] + first_df['db_object_name'].tolist()[1:]
+
+
+def test_find_ddl_statements_parses_again_when_the_chunk_token_budget_changes(fake_source_directory):
+    def create_parser(chat_model, chunk_token_budget):
+        return SqlCodeParser(
+            source_directory=str(fake_source_directory),
+            use_cache=True,
+            debug=False,
+            cache_file_name=str(fake_source_directory / "cache.parquet"),
+            result_cache_file_name=str(fake_source_directory / "results.sqlite"),
+            chat_model=chat_model,
+            use_ddl_recognizer=False,
+            chunk_token_budget=chunk_token_budget,
+            count_tokens=approximate_token_count,
+        )
+
+    first_df = create_parser(FakeChatModel(), 2000).find_ddl_statements()
+    second_model = FakeChatModel()
+    second_df = create_parser(second_model, 100).find_ddl_statements()
+
+    assert second_model.calls > 0
+    assert second_df['sql_code'].str.len().max() < first_df['sql_code'].str.len().max()
+
+
+def test_find_ddl_statements_only_sends_unrecognized_code_to_the_llm(tmp_path):
+    code = 'CREATE TABLE "Products" (\n    "ProductID" int NOT NULL\n)\nGO\n\n' * 80 + 'ALTER SESSION SET NLS_DATE_FORMAT = \'YYYY-MM-DD\'\n'
+    (tmp_path / "schema.sql").write_text(code)
+    chat_model = FakeChatModel()
+    parser = SqlCodeParser(
+        source_directory=str(tmp_path),
+        use_cache=False,
+        debug=False,
+        cache_file_name=str(tmp_path / "cache.parquet"),
+        result_cache_file_name=str(tmp_path / "results.sqlite"),
+        chat_model=chat_model,
+        chunk_token_budget=200,
+        count_tokens=approximate_token_count,
+    )
+    df = parser.find_ddl_statements()
+    assert df['db_object_name'].tolist() == ["Products"] * 80
+    assert parser.parse_statistics['llm_chunks'] == chat_model.calls == 1
+    assert parser.parse_statistics['local_chunks'] >= 1
+
+
+def test_find_ddl_statements_skips_data_only_code(tmp_path):
+    data = "".join(f"INSERT INTO Products (ProductID, ProductName) VALUES ({i}, 'Product {i}');\n" for i in range(200))
+    (tmp_path / "schema.sql").write_text('CREATE TABLE "Products" ("ProductID" int NOT NULL)\nGO\n\n' + data)
+    parser = SqlCodeParser(
+        source_directory=str(tmp_path),
+        use_cache=False,
+        debug=False,
+        cache_file_name=str(tmp_path / "cache.parquet"),
+        result_cache_file_name=str(tmp_path / "results.sqlite"),
+        chat_model=FakeChatModel(),
+        chunk_token_budget=200,
+        count_tokens=approximate_token_count,
+    )
+    df = parser.find_ddl_statements()
+    assert df['db_object_name'].tolist() == ["Products"]
+    assert parser.parse_statistics['skipped_chunks'] >= 3
+    assert parser.parse_statistics['skipped_bytes'] > 0.9 * len(data)
+
+
+def test_each_parser_gets_a_chunk_filter_of_its_own(tmp_path):
+    def create_parser(**options):
+        return SqlCodeParser(source_directory=str(tmp_path), use_cache=False, debug=False,
+                             result_cache_file_name=str(tmp_path / "results.sqlite"), chat_model=FakeChatModel(), **options)
+
+    first_parser, second_parser = create_parser(), create_parser()
+    assert isinstance(first_parser.chunk_filter, DataLoadChunkFilter)
+    assert first_parser.chunk_filter is not second_parser.chunk_filter
+    assert create_parser(use_chunk_filter=False).chunk_filter is None
+
+
+def test_find_ddl_statements_in_streaming_mode(fake_source_directory):
+    parser = SqlCodeParser(
+        source_directory=str(fake_source_directory),
+        use_cache=False,
+        debug=False,
+        cache_file_name=str(fake_source_directory / "cache.parquet"),
+        result_cache_file_name=str(fake_source_directory / "results.sqlite"),
+        chat_model=FakeChatModel(),
+        max_concurrency=4,
+        streaming=True,
+        stream_window_size=500,
+    )
+    df = parser.find_ddl_statements()
+    assert df['db_object_name'].tolist() == [f"Table{i}" for i in range(40)]
+    assert df['sql_code'].str.len().max() <= 500
+
+
+def test_extract_procedure_declaration_with_special_characters_in_the_name(uncached_sql_code_parser):
+    code = 'GO\ncreate procedure "Sales (1997)+" AS\nSELECT * FROM Orders\nGO\n'
+    segment = uncached_sql_code_parser.extract_procedure_declaration_from_code("Sales (1997)+", code)
+    assert segment == 'create procedure "Sales (1997)+" AS\nSELECT * FROM Orders\nGO'
+
+
+class FakeBatchChatModel:
+    """
+    A local stand in for the OpenAI chat model, which answers batch prompts with the tables selected by each procedure.
+    If malformed_batch_size is set, then batches of that size or larger get a response that isn't keyed by procedure.
+    """
+
+    def __init__(self, malformed_batch_size=None):
+        self.calls = 0
+        self.batch_sizes = []
+        self.malformed_batch_size = malformed_batch_size
+
+    def __call__(self, messages):
+        self.calls += 1
+        code = messages[-1].content
+        procedures = re.findall(r'## PROCEDURE: (.+?) ##\n(.*?)(?=\n\n## PROCEDURE|\Z)', code, re.DOTALL)
+        self.batch_sizes.append(len(procedures))
+        if not procedures:
+            tables = re.findall(r'FROM (\w+)', code)
+            return AIMessage(content=json.dumps([{"table_name": t, "sql_operation": "SELECT"} for t in tables]))
+        if self.malformed_batch_size and len(procedures) >= self.malformed_batch_size:
+            return AIMessage(content='[{"table_name": "Orders", "sql_operation": "SELECT"}]')
+        result = {name: [{"table_name": t, "sql_operation": "SELECT"} for t in re.findall(r'FROM (\w+)', body)] for name, body in procedures}
+        return AIMessage(content=json.dumps(result))
+
+
+def create_batch_parser(tmp_path, chat_model):
+    return SqlCodeParser(
+        source_directory=str(tmp_path),
+        use_cache=True,
+        debug=False,
+        cache_file_name=str(tmp_path / "cache.parquet"),
+        result_cache_file_name=str(tmp_path / "results.sqlite"),
+        chat_model=chat_model,
+        count_tokens=approximate_token_count,
+        use_table_access_analyzer=False,
+    )
+
+
+def make_procedures(n):
+    return [(f"GetTable{i}", f"CREATE PROCEDURE GetTable{i} AS\nSELECT * FROM Table{i}\nGO") for i in range(n)]
+
+
+def test_find_tables_manipulated_by_procedures_in_batches(tmp_path):
+    chat_model = FakeBatchChatModel()
+    parser = create_batch_parser(tmp_path, chat_model)
+    results = parser.find_tables_manipulated_by_procedures(make_procedures(20), token_budget=600)
+
+    assert results == {f"GetTable{i}": [{"table_name": f"Table{i}", "sql_operation": "SELECT"}] for i in range(20)}
+    assert 1 < chat_model.calls < 20
+    assert parser.batch_statistics['requests'] == chat_model.calls
+    assert parser.batch_statistics['prompt_tokens_saved'] > 0
+
+    # The results are cached per procedure, so only the new procedure is sent to the LLM.
+    second_model = FakeBatchChatModel()
+    parser = create_batch_parser(tmp_path, second_model)
+    results = parser.find_tables_manipulated_by_procedures(make_procedures(21), token_budget=600)
+    assert len(results) == 21
+    assert second_model.calls == 1
+    assert parser.batch_statistics['procedures'] == 1
+
+
+def test_find_tables_manipulated_by_procedures_accepts_a_generator(tmp_path):
+    chat_model = FakeBatchChatModel()
+    parser = create_batch_parser(tmp_path, chat_model)
+    results = parser.find_tables_manipulated_by_procedures((procedure for procedure in make_procedures(5)), token_budget=600)
+
+    assert results == {f"GetTable{i}": [{"table_name": f"Table{i}", "sql_operation": "SELECT"}] for i in range(5)}
+
+
+def test_find_tables_manipulated_by_procedures_splits_malformed_batches(tmp_path):
+    chat_model = FakeBatchChatModel(malformed_batch_size=3)
+    parser = create_batch_parser(tmp_path, chat_model)
+    results = parser.find_tables_manipulated_by_procedures(make_procedures(8), token_budget=100000)
+
+    assert results == {f"GetTable{i}": [{"table_name": f"Table{i}", "sql_operation": "SELECT"}] for i in range(8)}
+    assert chat_model.batch_sizes == [8, 4, 2, 2, 4, 2, 2]
+
+
+class FailingSingleProcedureChatModel(FakeBatchChatModel):
+    """
+    Answers batches of two or more procedures with a malformed response, and fails every single procedure request.
+    """
+
+    def __init__(self):
+        super().__init__(malformed_batch_size=2)
+
+    def __call__(self, messages):
+        if '## PROCEDURE:' not in messages[-1].content:
+            self.batch_sizes.append(1)
+            raise ConnectionError("connection reset")
+        return super().__call__(messages)
+
+
+def test_split_batches_are_retried_as_a_whole_a_limited_number_of_times(tmp_path):
+    chat_model = FailingSingleProcedureChatModel()
+    parser = create_batch_parser(tmp_path, chat_model)
+    delays = []
+    parser.dispatcher.sleep = delays.append
+    with pytest.raises(ConnectionError):
+        parser.find_tables_manipulated_by_procedures(make_procedures(4), token_budget=100000)
+
+    # The malformed responses are cached, so each retry of the batch only sends the first procedure again.
+    assert chat_model.batch_sizes == [4, 2, 1, 1, 1, 1]
+    assert len(delays) == parser.dispatcher.max_retries
+
+
+def test_only_procedures_the_analyzer_is_unsure_of_are_sent_to_the_llm(tmp_path):
+    chat_model = FakeBatchChatModel()
+    parser = SqlCodeParser(
+        source_directory=str(tmp_path),
+        use_cache=False,
+        debug=False,
+        result_cache_file_name=str(tmp_path / "results.sqlite"),
+        chat_model=chat_model,
+        count_tokens=approximate_token_count,
+    )
+    dynamic_procedure = ("Search", "CREATE PROCEDURE Search @sql nvarchar(max) AS\nEXEC sp_executesql @sql -- FROM Orders\nGO")
+    results = parser.find_tables_manipulated_by_procedures(make_procedures(5) + [dynamic_procedure], token_budget=600)
+
+    assert results["GetTable3"] == [{"table_name": "Table3", "sql_operation": "SELECT"}]
+    assert results["Search"] == [{"table_name": "Orders", "sql_operation": "SELECT"}]
+    assert chat_model.calls == 1
+    assert parser.table_access_statistics == {'local_procedures': 5, 'llm_procedures': 1}
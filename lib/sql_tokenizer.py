@@ -0,0 +1,72 @@
+import re
+from collections import namedtuple
+
+# A lexical token in SQL code.
+# - kind: one of 'word', 'identifier', 'string', 'number', 'punctuation', 'separator' or 'unterminated'
+# - value: the token text; quotes and brackets are removed from identifiers
+# - start, end: the character offsets of the token in the code
+Token = namedtuple('Token', ['kind', 'value', 'start', 'end'])
+
+TOKEN_PATTERN = re.compile(r"""
+      (?P<line_comment>--[^\n]*|\#(?=\s)[^\n]*)
+    | (?P<block_comment>/\*.*?\*/)
+    | (?P<separator>^[ \t]*(?:go|/)[ \t\r]*$)
+    | (?P<string>N?'(?:[^']|'')*')
+    | (?P<quoted>"(?:[^"]|"")*")
+    | (?P<bracketed>\[[^\]]*\])
+    | (?P<backtick>`[^`]*`)
+    | (?P<unterminated>(?:/\*|N?'|["\[`]).*\Z)
+    | (?P<word>[A-Za-z_@#][\w@#$]*)
+    | (?P<number>0x[0-9a-f]+|\d+(?:\.\d+)?)
+    | (?P<space>\n|[^\S\n]+)
+    | (?P<punctuation>.)
+""", re.VERBOSE | re.DOTALL | re.MULTILINE | re.IGNORECASE)
+
+
+def tokenize(sql_code):
+    """
+    Splits SQL code into tokens, skipping whitespace and comments.
+
+    Quoted ("Order Details"), bracketed ([Order Details]) and back-ticked identifiers are returned as
+    'identifier' tokens, with the quotes removed.  Batch separators, i.e. GO or / on a line of their own,
+    are returned as 'separator' tokens.  A string, identifier or comment that is not closed before
+    the end of the code is returned as a single 'unterminated' token, running to the end of the code.
+    """
+    for match in TOKEN_PATTERN.finditer(sql_code):
+        kind = match.lastgroup
+        text = match.group()
+        if kind in ('space', 'line_comment', 'block_comment'):
+            continue
+        elif kind == 'separator':
+            yield Token('separator', text.strip(), match.start(), match.end())
+        elif kind == 'quoted':
+            yield Token('identifier', text[1:-1].replace('""', '"'), match.start(), match.end())
+        elif kind in ('bracketed', 'backtick'):
+            yield Token('identifier', text[1:-1], match.start(), match.end())
+        else:
+            yield Token(kind, text, match.start(), match.end())
+
+
+def is_keyword(token, *keywords):
+    """
+    Returns True if the token is a word matching one of the keywords, ignoring case.
+    """
+    return token is not None and token.kind == 'word' and token.value.upper() in keywords
+
+
+def normalize_object_name(name):
+    """
+    Normalises a database object name for lookups: removes quotes, brackets and the schema name,
+    collapses white space and converts to lower case.
+
+    e.g. '"dbo"."Sales by Year"', 'dbo.Sales by Year' and '[Sales  by Year]' all become 'sales by year'.
+    """
+    parts = [[]]
+    for token in tokenize(name):
+        if token.value == '.':
+            parts.append([])
+        else:
+            parts[-1].append(token.value)
+    if parts[-1]:
+        name = ' '.join(parts[-1])
+    return ' '.join(name.split()).lower()
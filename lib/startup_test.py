@@ -0,0 +1,15 @@
+import subprocess
+import sys
+
+HEAVY_MODULES = ['langchain', 'openai', 'tiktoken', 'sklearn', 'scipy', 'joblib', 'requests']
+
+
+def test_importing_the_pipeline_does_not_import_heavy_libraries():
+    code = (
+        "import sys\n"
+        "import lib.sql_code_parser, lib.stored_procedure_to_table_mapper, lib.service_extractor, lib.graph_service_extractor\n"
+        "import lib.clustering, lib.incremental_updater, lib.multi_dialect_driver, lib.diagram_generator\n"
+        f"print(','.join(module for module in {HEAVY_MODULES!r} if module in sys.modules))\n"
+    )
+    completed = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    assert completed.stdout.strip() == ''
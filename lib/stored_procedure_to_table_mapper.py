@@ -1,6 +1,10 @@
 import os
 import pandas as pd
 
+from lib.catalogue_store import read_table_map, write_table_map
+from lib.instrumentation import Instrumentation
+from lib.result_cache import ResultCache, read_fingerprint, write_fingerprint
+
 class StoredProcedureToTableMapper:
     """
     This class knows the structure of the DDL statements DataFrame and and iterates through each row
@@ -11,11 +15,24 @@ class StoredProcedureToTableMapper:
 
     Code parsing is delegated to the sql_code_parser object.
     """
-    CACHE_FILE_NAME = './results/tables_to_procs_cache.csv'
+    CACHE_FILE_NAME = './results/tables_to_procs_cache.parquet'
+
+    def __init__(self, sql_code_parser, use_cache=True, batch_token_budget=None, cache_file_name=CACHE_FILE_NAME, instrumentation=None, code_index=None) -> None:
+        """
+        If batch_token_budget is set, then several procedures are packed into each LLM request, up to
+        that many prompt tokens.  Otherwise each procedure is sent in a request of its own.
+
+        If a code_index is given, then the code of each procedure is looked up in it, and only the
+        procedures that aren't in it are found by the code parser.
 
-    def __init__(self, sql_code_parser, use_cache=True) -> None:
+        The time taken and the cache hits are recorded in the instrumentation object, if one is given.
+        """
         self.sql_code_parser = sql_code_parser
         self.use_cache = use_cache
+        self.batch_token_budget = batch_token_budget
+        self.cache_file_name = cache_file_name
+        self.instrumentation = instrumentation or Instrumentation()
+        self.code_index = code_index
 
 
     def _map_sql_operation_to_read_write(self, operation):
@@ -31,39 +48,94 @@ class StoredProcedureToTableMapper:
             return 'NONE' # In cases where there is neither a READ nor WRITE, such as calling a stored procedure.
 
 
-    def _execute_mapping(self, ddl_df):
+    def find_procedure_code(self, ddl_df):
+        """
+        Returns the code of each procedure in the DDL statements DataFrame, by procedure name.
+        The first definition of each procedure is used.
+        """
         procedures_ds = ddl_df[ddl_df['sql_operation'] == 'CREATE PROCEDURE']
-        procedure_names = procedures_ds['db_object_name'].tolist()
+        procedures_ds = procedures_ds.drop_duplicates(subset='db_object_name')
+        procedure_code_by_name = {}
+        for procedure_name, sql_code in zip(procedures_ds['db_object_name'], procedures_ds['sql_code']):
+            procedure_code = self.code_index.get_procedure_code(procedure_name) if self.code_index is not None else None
+            if procedure_code is None:
+                procedure_code = self.sql_code_parser.find_procedure_declaration(procedure_name, sql_code)
+            procedure_code_by_name[procedure_name] = procedure_code
+        return procedure_code_by_name
 
-        output_df = pd.DataFrame(columns=['table_name', 'sql_operation', 'operation_type', 'procedure_name'])
-        
-        for procedure_name in procedure_names:
-            
-            sql_code = procedures_ds[procedures_ds['db_object_name'] == procedure_name]['sql_code'].values[0]
-            procedure_code = self.sql_code_parser.extract_procedure_declaration_from_code(procedure_name, sql_code)
-            
-            tables = self.sql_code_parser.find_tables_manipulated_by_procedure(procedure_name, procedure_code)
+
+    def map_procedure_code(self, procedure_code_by_name):
+        """
+        Find the tables that are manipulated by each of the procedures, given the code of each procedure by name.
+        Returns a data frame with the table_name, sql_operation, operation_type and procedure_name columns.
+        """
+        # Accumulate the rows in columns and build the data frame once at the end.
+        columns = {'table_name': [], 'sql_operation': [], 'operation_type': [], 'procedure_name': []}
+
+        if self.batch_token_budget:
+            tables_by_procedure_name = self._find_tables_in_batches(procedure_code_by_name)
+        else:
+            # Analyze all the procedures locally first, so the parser can shard them across its workers.
+            tables_by_procedure_name = self.sql_code_parser.find_tables_locally(procedure_code_by_name.items())
+
+        for procedure_name, procedure_code in procedure_code_by_name.items():
+            tables = tables_by_procedure_name.get(procedure_name)
+            if tables is None:
+                tables = self.sql_code_parser.find_tables_with_llm(procedure_name, procedure_code)
             
             for table in tables:
-                new_row = pd.DataFrame([{
-                    'table_name': table['table_name'], 
-                    'sql_operation': table['sql_operation'], 
-                    'operation_type': self._map_sql_operation_to_read_write(table['sql_operation']),
-                    'procedure_name': procedure_name
-                }])
-                output_df = pd.concat([output_df, new_row], ignore_index=True)
+                columns['table_name'].append(table['table_name'])
+                columns['sql_operation'].append(table['sql_operation'])
+                columns['operation_type'].append(self._map_sql_operation_to_read_write(table['sql_operation']))
+                columns['procedure_name'].append(procedure_name)
         
-        return output_df
+        return pd.DataFrame(columns)
+
+
+    def _execute_mapping(self, ddl_df):
+        return self.map_procedure_code(self.find_procedure_code(ddl_df))
+
+
+    def _find_tables_in_batches(self, procedure_code_by_name):
+        """
+        Find the tables manipulated by all the procedures, packing several procedures into each request.
+        """
+        procedures = list(procedure_code_by_name.items())
+        tables_by_procedure_name = self.sql_code_parser.find_tables_manipulated_by_procedures(procedures, self.batch_token_budget)
+
+        statistics = self.sql_code_parser.batch_statistics
+        print(f"Mapped {statistics['procedures']} procedures in {statistics['requests']} requests, "
+              f"saving about {statistics['prompt_tokens_saved']} prompt tokens")
+        return tables_by_procedure_name
+
+
+    def _procedures_fingerprint(self, ddl_df):
+        """
+        Returns a fingerprint of the procedure names and code in the DDL statements DataFrame.
+        """
+        procedures_ds = ddl_df[ddl_df['sql_operation'] == 'CREATE PROCEDURE']
+        return ResultCache.make_key(*procedures_ds['db_object_name'].tolist(), *procedures_ds['sql_code'].tolist())
 
 
     def map_procedures_to_tables(self, ddl_df):
         """
         Iterate through each procedure and find the tables that are manipulated by each procedure.
+
+        The cached map is only used if the procedures have not changed since it was created.  Otherwise the
+        mapping is executed again, with the code parser only sending new or changed procedures to the LLM.
+        The map is cached in a Parquet file, with the sql_operation and operation_type columns stored as categories.
         """
-        if self.use_cache and os.path.exists(StoredProcedureToTableMapper.CACHE_FILE_NAME):
-            return pd.read_csv(StoredProcedureToTableMapper.CACHE_FILE_NAME)
-        else:
-            result = self._execute_mapping(ddl_df)
-            result.to_csv(StoredProcedureToTableMapper.CACHE_FILE_NAME, index=False)
-            return result
+        with self.instrumentation.stage('map_procedures'):
+            fingerprint = self._procedures_fingerprint(ddl_df)
+            cache_file_name = self.cache_file_name
+            cache_hit = self.use_cache and os.path.exists(cache_file_name) and read_fingerprint(cache_file_name) == fingerprint
+            if self.use_cache:
+                self.instrumentation.record_cache('tables_to_procs_cache', cache_hit)
+            if cache_hit:
+                return read_table_map(cache_file_name)
+            else:
+                result = self._execute_mapping(ddl_df)
+                write_table_map(cache_file_name, result)
+                write_fingerprint(cache_file_name, fingerprint)
+                return result
     
\ No newline at end of file
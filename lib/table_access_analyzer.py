@@ -0,0 +1,384 @@
+from collections import namedtuple
+
+from lib.sql_tokenizer import tokenize, is_keyword
+
+# The tables found in a procedure, in the same format as the LLM results, and how sure the analyzer is of them.
+# - tables: a list of dictionaries with the table_name and sql_operation, e.g. {"table_name": "Orders", "sql_operation": "SELECT"}
+# - confidence: from 0, when the code couldn't be analyzed, to 1, when every statement was understood
+# - reasons: why the confidence was lowered, if it was
+TableAccessAnalysis = namedtuple('TableAccessAnalysis', ['tables', 'confidence', 'reasons'])
+
+
+class _Statement:
+    """
+    The table references of one statement, so that aliases are resolved within the statement they're declared in.
+    """
+
+    def __init__(self, kind) -> None:
+        self.kind = kind
+        self.aliases = {}
+        self.targets = []
+        self.reads = []
+        self.target_read = False
+        self.case_depth = 0
+
+
+class _TableAccessScan:
+    """
+    The state of the analysis of one piece of code, so that a TableAccessAnalyzer can be shared by threads.
+    """
+
+    DYNAMIC_SQL_CONFIDENCE = 0.2
+    REMOTE_QUERY_CONFIDENCE = 0.3
+    MERGE_CONFIDENCE = 0.5
+    UNRECOGNIZED_REFERENCE_CONFIDENCE = 0.5
+    FUNCTION_CONFIDENCE = 0.7
+    # Each common table expression multiplies the confidence by this, so that code with several is sent to the LLM.
+    CTE_CONFIDENCE_FACTOR = 0.9
+
+    STATEMENT_KEYWORDS = {
+        'SELECT', 'INSERT', 'UPDATE', 'DELETE', 'MERGE', 'TRUNCATE', 'WITH', 'IF', 'ELSE', 'WHILE', 'BEGIN', 'END',
+        'RETURN', 'DECLARE', 'SET', 'EXEC', 'EXECUTE', 'PRINT', 'RAISERROR', 'FETCH', 'OPEN', 'CLOSE', 'DEALLOCATE',
+        'CREATE', 'ALTER', 'DROP', 'COMMIT', 'ROLLBACK', 'BREAK', 'CONTINUE', 'GOTO', 'WAITFOR',
+    }
+
+    # Words that can't be a table name or an alias.
+    RESERVED_WORDS = STATEMENT_KEYWORDS | {
+        'FROM', 'INTO', 'WHERE', 'JOIN', 'INNER', 'LEFT', 'RIGHT', 'FULL', 'CROSS', 'OUTER', 'APPLY', 'ON', 'GROUP',
+        'ORDER', 'HAVING', 'UNION', 'EXCEPT', 'INTERSECT', 'OPTION', 'VALUES', 'OUTPUT', 'WHEN', 'THEN', 'CASE',
+        'FOR', 'USING', 'AS', 'AND', 'OR', 'NOT', 'TABLESAMPLE', 'PIVOT', 'UNPIVOT', 'DEFAULT', 'TOP', 'DISTINCT',
+        'ALL', 'BY', 'IS', 'NULL', 'EXISTS', 'IN', 'LIKE', 'BETWEEN', 'NOLOCK',
+    }
+
+    REMOTE_QUERY_FUNCTIONS = {'OPENQUERY', 'OPENROWSET', 'OPENDATASOURCE', 'OPENXML'}
+
+
+    def __init__(self, sql_code) -> None:
+        self.tokens = list(tokenize(sql_code))
+        self.accesses = []
+        self.cte_names = set()
+        self.confidence = 1.0
+        self.reasons = []
+
+
+    def run(self):
+        self._analyze()
+        return TableAccessAnalysis(self._tables(), self.confidence, self.reasons)
+
+
+    def _lower_confidence(self, confidence, reason):
+        self.confidence = min(self.confidence, confidence)
+        if reason not in self.reasons:
+            self.reasons.append(reason)
+
+
+    def _tables(self):
+        tables = []
+        seen = set()
+        for _, table_name, sql_operation in sorted(self.accesses, key=lambda access: access[0]):
+            key = (table_name.lower(), sql_operation)
+            if table_name.lower() not in self.cte_names and key not in seen:
+                seen.add(key)
+                tables.append({'table_name': table_name, 'sql_operation': sql_operation})
+        return tables
+
+
+    def _token(self, i):
+        return self.tokens[i] if i < len(self.tokens) else None
+
+
+    def _value(self, i):
+        token = self._token(i)
+        return token.value if token is not None and token.kind == 'punctuation' else None
+
+
+    def _analyze(self):
+        statement = _Statement(None)
+        depth = 0
+        i = 0
+        while i < len(self.tokens):
+            token = self.tokens[i]
+            if token.kind == 'unterminated':
+                self._lower_confidence(0.0, 'unterminated string, identifier or comment')
+                break
+            if token.kind == 'separator' or (token.value == ';' and token.kind == 'punctuation'):
+                self._end_statement(statement)
+                statement = _Statement(None)
+                depth = 0
+                i += 1
+                continue
+            if token.kind == 'punctuation':
+                if token.value == '(':
+                    depth += 1
+                elif token.value == ')':
+                    depth = max(0, depth - 1)
+                elif token.value == ',' and depth == 0 and statement.kind == 'WITH':
+                    self._common_table_expression(i + 1)
+                i += 1
+                continue
+            if token.kind != 'word':
+                i += 1
+                continue
+
+            keyword = token.value.upper()
+            if token.value.lower() == 'sp_executesql':
+                self._lower_confidence(self.DYNAMIC_SQL_CONFIDENCE, 'dynamic SQL')
+            if keyword in self.REMOTE_QUERY_FUNCTIONS:
+                self._lower_confidence(self.REMOTE_QUERY_CONFIDENCE, 'remote query')
+            if keyword == 'CASE':
+                statement.case_depth += 1
+                i += 1
+                continue
+            if keyword == 'END' and statement.case_depth:
+                statement.case_depth -= 1
+                i += 1
+                continue
+
+            if depth == 0 and not statement.case_depth:
+                if keyword in self.STATEMENT_KEYWORDS and self._starts_statement(keyword, statement, i):
+                    self._end_statement(statement)
+                    statement = _Statement(keyword)
+                elif statement.kind == 'WITH' and keyword in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'MERGE'):
+                    statement.kind = keyword
+
+            i = self._keyword(keyword, statement, i)
+        self._end_statement(statement)
+
+
+    def _starts_statement(self, keyword, statement, i):
+        """
+        Returns True if the keyword starts a new statement, rather than continuing the current one.
+        """
+        previous = self._token(i - 1) if i > 0 else None
+        if statement.kind == 'WITH' and keyword in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'MERGE'):
+            return False
+        if statement.kind == 'MERGE' and keyword in ('INSERT', 'UPDATE', 'DELETE', 'SET'):
+            return False
+        if keyword == 'SELECT':
+            return statement.kind != 'INSERT' and not is_keyword(previous, 'UNION', 'ALL', 'EXCEPT', 'INTERSECT')
+        if keyword == 'SET':
+            return statement.kind != 'UPDATE'
+        if keyword == 'UPDATE':
+            return not is_keyword(previous, 'FOR') and self._value(i + 1) != '('
+        if keyword == 'WITH':
+            return self._common_table_expression(i + 1, record=False) is not None
+        return True
+
+
+    def _keyword(self, keyword, statement, i):
+        """
+        Handles a keyword of the statement.  Returns the index of the next token to look at.
+        """
+        if keyword == 'FROM':
+            if statement.kind == 'FETCH':
+                return i + 1
+            if statement.kind == 'DELETE' and not statement.target_read:
+                return self._target(i + 1, statement, 'DELETE')
+            return self._table_list(i + 1, statement)
+        if keyword in ('JOIN', 'APPLY'):
+            return self._table_reference(i + 1, statement)
+        if keyword == 'INTO' and statement.kind == 'SELECT' and not statement.target_read:
+            return self._target(i + 1, statement, 'INSERT')
+        if keyword == 'WITH' and statement.kind == 'WITH':
+            return self._common_table_expression(i + 1) or i + 1
+        if statement.kind == keyword:
+            if keyword in ('INSERT', 'UPDATE', 'DELETE') and not statement.target_read:
+                return self._target(i + 1, statement, keyword)
+            if keyword == 'TRUNCATE' and is_keyword(self._token(i + 1), 'TABLE'):
+                return self._target(i + 2, statement, 'DELETE')
+            if keyword == 'MERGE':
+                self._lower_confidence(self.MERGE_CONFIDENCE, 'MERGE statement')
+                return self._target(i + 1, statement, 'UPDATE')
+            if keyword in ('EXEC', 'EXECUTE'):
+                following = self._token(i + 1)
+                if self._value(i + 1) == '(' or (following is not None and following.value.startswith('@') and self._value(i + 2) != '='):
+                    self._lower_confidence(self.DYNAMIC_SQL_CONFIDENCE, 'dynamic SQL')
+        return i + 1
+
+
+    def _common_table_expression(self, i, record=True):
+        """
+        Reads the name of a common table expression, i.e. name [(columns)] AS (...
+        Returns the index of the token after AS, or None if there isn't one at i.
+        """
+        token = self._token(i)
+        if token is None or token.kind not in ('word', 'identifier') or token.value.upper() in self.RESERVED_WORDS:
+            return None
+        j = i + 1
+        if self._value(j) == '(':
+            while j < len(self.tokens) and self._value(j) != ')':
+                j += 1
+            j += 1
+        if not is_keyword(self._token(j), 'AS') or self._value(j + 1) != '(':
+            return None
+        if record:
+            self.cte_names.add(token.value.lower())
+            self.confidence *= self.CTE_CONFIDENCE_FACTOR
+            if 'common table expression' not in self.reasons:
+                self.reasons.append('common table expression')
+        return j + 1
+
+
+    def _name(self, i):
+        """
+        Reads a table name, which may be qualified by the schema and database, e.g. Northwind..[Order Details].
+        Returns the last part of the name and the index of the next token, or None and i if there isn't a name at i.
+        """
+        name = None
+        j = i
+        while j < len(self.tokens):
+            token = self.tokens[j]
+            if token.kind == 'identifier' or (token.kind == 'word' and token.value.upper() not in self.RESERVED_WORDS):
+                name = token.value
+                j += 1
+                if self._value(j) != '.':
+                    break
+                j += 1
+            elif token.value == '.' and token.kind == 'punctuation':
+                j += 1
+            else:
+                break
+        return (name, j) if name is not None else (None, i)
+
+
+    def _skip_top(self, i):
+        """
+        Skips a TOP (n) [PERCENT] clause.
+        """
+        if not is_keyword(self._token(i), 'TOP'):
+            return i
+        i += 1
+        if self._value(i) == '(':
+            while i < len(self.tokens) and self._value(i) != ')':
+                i += 1
+        i += 1
+        return i + 1 if is_keyword(self._token(i), 'PERCENT') else i
+
+
+    def _skip_table_hints(self, i):
+        """
+        Skips table hints, e.g. WITH (NOLOCK).
+        """
+        if is_keyword(self._token(i), 'WITH') and self._value(i + 1) == '(':
+            i += 2
+            while i < len(self.tokens) and self._value(i) != ')':
+                i += 1
+            i += 1
+        return i
+
+
+    def _alias(self, i, statement, table_name):
+        """
+        Reads an optional alias, [AS] alias, and records it against the table.  Returns the index of the next token.
+        """
+        j = i + 1 if is_keyword(self._token(i), 'AS') else i
+        token = self._token(j)
+        if token is not None and (token.kind == 'identifier' or (token.kind == 'word' and token.value.upper() not in self.RESERVED_WORDS)):
+            statement.aliases[token.value.lower()] = table_name
+            return j + 1
+        return i
+
+
+    def _table_reference(self, i, statement):
+        """
+        Reads a table in a FROM, JOIN or APPLY clause.  Returns the index of the next token.
+        Derived tables, i.e. subqueries, are left to the main loop.
+        """
+        if self._value(i) == '(':
+            return i
+        name, j = self._name(i)
+        if name is None:
+            self._lower_confidence(self.UNRECOGNIZED_REFERENCE_CONFIDENCE, 'unrecognized table reference')
+            return i
+        if self._value(j) == '(':
+            if name.upper() in self.REMOTE_QUERY_FUNCTIONS:
+                self._lower_confidence(self.REMOTE_QUERY_CONFIDENCE, 'remote query')
+            else:
+                self._lower_confidence(self.FUNCTION_CONFIDENCE, 'table valued function')
+            return j
+        if not name.startswith(('@', '#')):
+            statement.reads.append((self.tokens[i].start, name))
+        j = self._alias(j, statement, name)
+        return self._skip_table_hints(j)
+
+
+    def _table_list(self, i, statement):
+        """
+        Reads the comma separated tables in a FROM clause.  Returns the index of the next token.
+        """
+        while True:
+            j = self._table_reference(i, statement)
+            if j == i or self._value(j) != ',':
+                return j
+            i = j + 1
+
+
+    def _target(self, i, statement, sql_operation):
+        """
+        Reads the table changed by an INSERT, UPDATE, DELETE, MERGE or SELECT ... INTO statement.
+        Returns the index of the next token.
+        """
+        statement.target_read = True
+        i = self._skip_top(i)
+        if is_keyword(self._token(i), 'INTO', 'FROM'):
+            i += 1
+        name, j = self._name(i)
+        if name is None:
+            if self._value(i) != '(':
+                self._lower_confidence(self.UNRECOGNIZED_REFERENCE_CONFIDENCE, f"unrecognized {sql_operation} target")
+            return i
+        statement.targets.append((self.tokens[i].start, name, sql_operation))
+        if sql_operation == 'UPDATE' and statement.kind == 'MERGE':
+            j = self._alias(j, statement, name)
+        return self._skip_table_hints(j)
+
+
+    def _end_statement(self, statement):
+        """
+        Records the tables of the statement, resolving the aliases of the tables that it changes.
+        Tables that are changed aren't also recorded as queried by the same statement.
+        """
+        changed_tables = set()
+        for position, name, sql_operation in statement.targets:
+            table_name = statement.aliases.get(name.lower(), name)
+            if table_name.startswith(('@', '#')):
+                continue
+            self.accesses.append((position, table_name, sql_operation))
+            if sql_operation in ('UPDATE', 'DELETE'):
+                changed_tables.add(table_name.lower())
+        for position, table_name in statement.reads:
+            if table_name.lower() not in changed_tables:
+                self.accesses.append((position, table_name, 'SELECT'))
+
+
+class TableAccessAnalyzer:
+    """
+    A local, static analyzer that finds the tables queried and changed by the code of a stored procedure,
+    producing the same records as the LLM, e.g.
+
+        [{"table_name": "Order Details", "sql_operation": "SELECT"}]
+
+    Tables are found in the FROM, JOIN and APPLY clauses, which are queried, and the targets of INSERT [INTO],
+    SELECT ... INTO, UPDATE, DELETE [FROM] and TRUNCATE TABLE statements.  Aliases are resolved within each
+    statement, so UPDATE o ... FROM Orders o updates Orders.  Names are returned without their schema, quotes
+    or brackets.  Temporary tables, table variables and common table expressions aren't returned.
+
+    Each analysis has a confidence, which is lowered by code whose tables can't be seen statically, i.e.
+    dynamic SQL, remote queries, table valued functions, MERGE statements and common table expressions.
+    Code with a low confidence should be sent to the LLM instead.
+    """
+
+    def analyze(self, sql_code):
+        """
+        Finds the tables queried and changed by the code.
+        Returns a TableAccessAnalysis with the tables, in the order they appear in the code, and the confidence.
+        """
+        return _TableAccessScan(sql_code).run()
+
+
+def analyze_all(sql_codes):
+    """
+    Analyzes each piece of code, e.g. in a worker process.  Returns a TableAccessAnalysis for each.
+    """
+    analyzer = TableAccessAnalyzer()
+    return [analyzer.analyze(sql_code) for sql_code in sql_codes]
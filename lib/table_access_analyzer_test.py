@@ -0,0 +1,72 @@
+from lib.table_access_analyzer import TableAccessAnalyzer
+
+
+def tables(sql_code):
+    return [(table['table_name'], table['sql_operation']) for table in TableAccessAnalyzer().analyze(sql_code).tables]
+
+
+def test_finds_the_tables_queried_with_aliases_and_bracketed_names():
+    code = """
+CREATE PROCEDURE CustOrdersDetail @OrderID int
+AS
+SELECT ProductName,
+    UnitPrice=ROUND(Od.UnitPrice, 2),
+    Discount=CONVERT(int, Discount * 100)
+FROM Products P, [Order Details] Od
+WHERE Od.ProductID = P.ProductID and Od.OrderID = @OrderID
+go
+"""
+    analysis = TableAccessAnalyzer().analyze(code)
+    assert analysis.tables == [{'table_name': 'Products', 'sql_operation': 'SELECT'}, {'table_name': 'Order Details', 'sql_operation': 'SELECT'}]
+    assert analysis.confidence == 1.0
+
+
+def test_finds_the_tables_changed_and_resolves_aliases():
+    code = """
+CREATE PROCEDURE ShipOrders @ShipperID int
+AS
+UPDATE o SET ShipVia = CASE WHEN o.Freight > 10 THEN @ShipperID ELSE 1 END
+FROM dbo.Orders o WITH (NOLOCK)
+INNER JOIN Customers c ON c.CustomerID = o.CustomerID
+INSERT INTO [dbo].[Order History] (OrderID) SELECT OrderID FROM Orders WHERE ShippedDate IS NOT NULL
+DELETE FROM "Order Details" WHERE OrderID IN (SELECT OrderID FROM #Cancelled)
+DELETE s FROM Shippers AS s LEFT JOIN @Used u ON u.ShipperID = s.ShipperID
+SELECT * INTO Archive FROM Orders
+TRUNCATE TABLE Logs
+GO
+"""
+    assert tables(code) == [
+        ('Orders', 'UPDATE'), ('Customers', 'SELECT'), ('Order History', 'INSERT'), ('Orders', 'SELECT'),
+        ('Order Details', 'DELETE'), ('Shippers', 'DELETE'), ('Archive', 'INSERT'), ('Logs', 'DELETE'),
+    ]
+
+
+def test_cursors_temporary_tables_and_common_table_expressions_are_not_tables():
+    code = """
+CREATE PROCEDURE Totals
+AS
+DECLARE c CURSOR FOR SELECT OrderID FROM Orders FOR UPDATE
+FETCH NEXT FROM c INTO @OrderID
+WITH Recent AS (SELECT * FROM Orders WHERE OrderDate > @Since)
+SELECT * INTO #Totals FROM Recent JOIN Products p ON p.ProductID = Recent.ProductID
+"""
+    analysis = TableAccessAnalyzer().analyze(code)
+    assert tables(code) == [('Orders', 'SELECT'), ('Products', 'SELECT')]
+    assert 0.8 <= analysis.confidence < 1.0
+    assert analysis.reasons == ['common table expression']
+
+
+def test_code_whose_tables_cant_be_seen_has_a_low_confidence():
+    for code, reason in [
+        ("CREATE PROCEDURE Search @sql nvarchar(max) AS EXEC sp_executesql @sql", 'dynamic SQL'),
+        ("CREATE PROCEDURE Search @Table sysname AS EXEC ('SELECT * FROM ' + @Table)", 'dynamic SQL'),
+        ("CREATE PROCEDURE Remote AS SELECT * FROM OPENQUERY(Server, 'SELECT * FROM Orders')", 'remote query'),
+        ("CREATE PROCEDURE Upsert AS MERGE Orders AS t USING Staging s ON t.ID = s.ID WHEN MATCHED THEN UPDATE SET t.X = s.X;", 'MERGE statement'),
+        ("CREATE PROCEDURE Broken AS SELECT * FROM Orders WHERE Name = 'unterminated", 'unterminated string, identifier or comment'),
+    ]:
+        analysis = TableAccessAnalyzer().analyze(code)
+        assert analysis.confidence < 0.8, code
+        assert reason in analysis.reasons
+
+    # Calling a procedure with EXEC isn't dynamic SQL.
+    assert TableAccessAnalyzer().analyze("CREATE PROCEDURE Outer AS EXEC @Result = dbo.Inner @ID = 1").confidence == 1.0
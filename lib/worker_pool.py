@@ -0,0 +1,85 @@
+import math
+from concurrent.futures import ProcessPoolExecutor
+
+
+class WorkerPool:
+    """
+    Runs the CPU bound local stages of the pipeline on several worker processes, e.g. splitting the source
+    files, classifying the DDL statements, analyzing the procedures and rendering the diagram text.
+
+    The items of a stage, e.g. the source files or the procedures, are divided into shards of consecutive
+    items, shards_per_worker for each worker, so that a slow shard doesn't hold up the whole stage.  Each shard
+    is sent to a worker as a single task, which returns a list with a result for each of its items, so the
+    items and results are pickled once per shard rather than once per item.  The results are returned in the
+    order of the items, so the output doesn't depend on the number of workers.
+
+    With a single worker, the stages run in the calling process and no pool is started.  The pool is started
+    on first use and kept until close() is called, so its processes are shared by the stages.
+
+    The functions run by the pool must be defined at module level, and their arguments and results must be
+    picklable.
+    """
+
+    def __init__(self, workers=1, shards_per_worker=4) -> None:
+        self.workers = max(1, workers)
+        self.shards_per_worker = shards_per_worker
+        self.executor = None
+
+
+    def _shards(self, items, weight):
+        """
+        Divides the items into shards of consecutive items, with about the same total weight in each.
+        """
+        number_of_shards = min(len(items), self.workers * self.shards_per_worker)
+        weights = [weight(item) for item in items] if weight else [1] * len(items)
+        target = math.ceil(sum(weights) / number_of_shards) or 1
+        shards = []
+        shard = []
+        shard_weight = 0
+        for item, item_weight in zip(items, weights):
+            if shard and shard_weight + item_weight > target:
+                shards.append(shard)
+                shard, shard_weight = [], 0
+            shard.append(item)
+            shard_weight += item_weight
+        if shard:
+            shards.append(shard)
+        return shards
+
+
+    def map(self, function, items, *arguments, weight=None):
+        """
+        Calls function(shard, *arguments) for shards of the items, on the workers, and returns the results of
+        all the shards as one list, in the order of the items.  function must return a list with one result
+        for each item in the shard.
+
+        The shards are balanced by weight(item), e.g. the size of a file, or by the number of items.
+        """
+        items = list(items)
+        if self.workers == 1 or len(items) < 2:
+            return list(function(items, *arguments))
+
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        shards = self._shards(items, weight)
+        results = []
+        for shard_results in self.executor.map(function, shards, *[[argument] * len(shards) for argument in arguments]):
+            results.extend(shard_results)
+        return results
+
+
+    def close(self):
+        """
+        Stops the worker processes.
+        """
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
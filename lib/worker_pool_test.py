@@ -0,0 +1,84 @@
+import os
+
+import pytest
+
+from test_support.fake_llm import FakeChatModel, approximate_token_count
+from test_support.synthetic_schema import write_schema
+from lib.diagram_generator import DiagramGenerator
+from lib.procedure_index import ProcedureIndex
+from lib.service_definition import ServiceDefinition
+from lib.sql_code_parser import SqlCodeParser
+from lib.worker_pool import WorkerPool
+
+
+def square_all(numbers, offset):
+    return [number * number + offset for number in numbers]
+
+
+def test_results_are_returned_in_the_order_of_the_items():
+    with WorkerPool(workers=2) as pool:
+        assert pool.map(square_all, range(50), 1) == [number * number + 1 for number in range(50)]
+    assert WorkerPool().map(square_all, [3], 0) == [9]
+
+
+def test_shards_are_balanced_by_weight():
+    pool = WorkerPool(workers=2, shards_per_worker=1)
+    assert pool._shards([1, 1, 1, 1, 4], weight=lambda item: item) == [[1, 1, 1, 1], [4]]
+    assert pool._shards(list(range(5)), weight=None) == [[0, 1, 2], [3, 4]]
+
+
+def create_parser(tmp_path, name, workers, streaming=True):
+    return SqlCodeParser(
+        source_directory=str(tmp_path / "source"),
+        use_cache=False,
+        debug=False,
+        cache_file_name=str(tmp_path / f"{name}.parquet"),
+        result_cache_file_name=str(tmp_path / f"{name}.sqlite"),
+        chat_model=FakeChatModel(),
+        count_tokens=approximate_token_count,
+        streaming=streaming,
+        worker_pool=WorkerPool(workers),
+    )
+
+
+def test_sharded_stages_give_the_same_results_as_a_single_process(tmp_path):
+    write_schema(str(tmp_path / "source"), 3000)
+    serial = create_parser(tmp_path, "serial", workers=1)
+    sharded = create_parser(tmp_path, "sharded", workers=2)
+
+    ddl_df = serial.find_ddl_statements()
+    assert sharded.find_ddl_statements().equals(ddl_df)
+    assert sharded.parse_statistics == serial.parse_statistics
+
+    serial_index = ProcedureIndex.build(str(tmp_path / "source"))
+    assert sharded.procedure_index.locations == serial_index.locations
+
+    procedures = [(f"Proc{i}", serial.procedure_index.get_procedure_code(f"Proc{i}")) for i in range(0, 3000, 7)]
+    assert sharded.find_tables_locally(procedures) == serial.find_tables_locally(procedures)
+    sharded.worker_pool.close()
+
+
+@pytest.mark.parametrize('streaming', [True, False])
+def test_files_are_loaded_in_the_same_way_by_a_single_process_and_by_workers(tmp_path, streaming):
+    write_schema(str(tmp_path / "source"), 300)
+    (tmp_path / "source" / "a_utf16.sql").write_text('CREATE TABLE "Ünits" ("ID" int)\nGO\n', encoding='utf-16')
+    serial = create_parser(tmp_path, "serial", workers=1, streaming=streaming)
+    sharded = create_parser(tmp_path, "sharded", workers=2, streaming=streaming)
+
+    ddl_df = serial.find_ddl_statements()
+    assert ddl_df['db_object_name'].iloc[0] == 'Ünits'
+    assert sharded.find_ddl_statements().equals(ddl_df)
+    assert sharded.parse_statistics == serial.parse_statistics
+    sharded.worker_pool.close()
+
+
+def test_diagrams_rendered_by_workers_match(tmp_path):
+    services = [ServiceDefinition(f"Service{i}", [f"Proc{i}"], [f"Table{i}"], [f"Table{i + 1}"]) for i in range(10)]
+    run = lambda cmd, check: None
+    for name, workers in [("serial", 1), ("sharded", 2)]:
+        os.makedirs(tmp_path / name)
+        with WorkerPool(workers) as pool:
+            DiagramGenerator(output_directory=str(tmp_path / name), run=run, worker_pool=pool).generate(services)
+
+    for i in range(10):
+        assert (tmp_path / "serial" / f"Service{i}.puml").read_text() == (tmp_path / "sharded" / f"Service{i}.puml").read_text()
@@ -1,9 +1,19 @@
 from dotenv import load_dotenv
 import argparse
+import sys
+from lib.analysis_server import AnalysisServer
+from lib.clustering import MiniBatchKMeansBackend
+from lib.code_index import CodeIndex, HashingEmbedding
+from lib.dependency_graph import DependencyGraph
 from lib.diagram_generator import DiagramGenerator
+from lib.graph_service_extractor import GraphServiceExtractor
+from lib.incremental_updater import IncrementalUpdater
+from lib.instrumentation import Instrumentation
+from lib.multi_dialect_driver import DIALECT_SOURCES, MultiDialectDriver
 from lib.service_extractor import ServiceExtractor
 from lib.sql_code_parser import SqlCodeParser
 from lib.stored_procedure_to_table_mapper import StoredProcedureToTableMapper
+from lib.worker_pool import WorkerPool
 
 load_dotenv()
 
@@ -15,19 +25,145 @@ parser.add_argument('--debug',
 
 parser.add_argument('--no-cache',
                     action='store_true',
-                    help='if true, then a cache of previously parsed files will be used; the cache is in CSV format')
+                    help='if true, then cached results are not used; by default cached results are reused for any code that has not changed')
+parser.add_argument('--max-concurrency',
+                    type=int,
+                    default=1,
+                    help='the number of requests to send to the LLM at the same time')
+
+parser.add_argument('--requests-per-second',
+                    type=float,
+                    default=None,
+                    help='the maximum number of requests per second to send to the LLM; unlimited by default')
+parser.add_argument('--streaming',
+                    action='store_true',
+                    help='read the source files a batch at a time, rather than loading them into memory')
+parser.add_argument('--chunk-token-budget',
+                    type=int,
+                    default=2000,
+                    help='the maximum number of tokens of code to send in each DDL parsing request')
+parser.add_argument('--batch-token-budget',
+                    type=int,
+                    default=None,
+                    help='pack several procedures into each table mapping request, up to this many prompt tokens')
+parser.add_argument('--workers',
+                    type=int,
+                    default=1,
+                    help='split the files, classify the code, analyze the procedures and render the diagrams on this many processes')
+parser.add_argument('--auto-clusters',
+                    action='store_true',
+                    help='cluster each procedure once with MiniBatchKMeans, choosing the number of services automatically')
+parser.add_argument('--graph-services',
+                    action='store_true',
+                    help='extract services by partitioning the graph of procedures and the tables they write to')
+parser.add_argument('--incremental',
+                    action='store_true',
+                    help='only map the procedures that have changed since the last run, and add them to the existing services')
+parser.add_argument('--dialects',
+                    nargs='+',
+                    choices=sorted(DIALECT_SOURCES),
+                    help='parse the source code of each of these dialects in parallel, and merge the results into one catalogue')
+parser.add_argument('--code-index',
+                    action='store_true',
+                    help='keep a vector index of the SQL code in ./results/code_index, and look up the procedure code in it')
+parser.add_argument('--code-index-features',
+                    type=int,
+                    default=HashingEmbedding.DEFAULT_N_FEATURES,
+                    help='the number of hashed word features in the code index vectors; each batch of code takes 4 bytes per feature')
+parser.add_argument('--find-code',
+                    metavar='NAME',
+                    default=None,
+                    help='print the batches of SQL code that touch this database object, using the code index, and exit')
+parser.add_argument('--impact',
+                    metavar='NAME',
+                    default=None,
+                    help='print the procedures, views, tables and services that depend on this database object, using the dependency graph of the last run, and exit')
+parser.add_argument('--report-file',
+                    default='./results/run_report.json',
+                    help='write the time taken by each stage, the LLM token counts and the cache hit ratios to this JSON file')
+parser.add_argument('--openmetrics-file',
+                    default=None,
+                    help='also write the measurements to this file in the OpenMetrics text format')
+parser.add_argument('--serve',
+                    action='store_true',
+                    help='after the run, keep the results in memory and answer queries about them over HTTP on localhost')
+parser.add_argument('--port',
+                    type=int,
+                    default=AnalysisServer.DEFAULT_PORT,
+                    help='the port to serve the results on')
 args = parser.parse_args()
 use_cache = not args.no_cache
 
 print("Running in debug mode") if args.debug else print("Running in production mode")
 print("Not using cached results") if args.no_cache else print("Using cached results if they exist")
 
+if args.impact:
+    # Answer from the dependency graph saved by the last run, without parsing the code again.
+    dependency_graph = DependencyGraph.load()
+    if dependency_graph is None:
+        sys.exit(f"There is no dependency graph in {DependencyGraph.DEFAULT_DIRECTORY}; run main.py without --impact first.")
+    try:
+        impact = dependency_graph.impact(args.impact)
+    except KeyError as e:
+        sys.exit(e.args[0])
+    for kind, names in impact.items():
+        print(f"{kind}: {names}")
+    sys.exit(0)
+
+# Measure the time taken by each stage, the LLM requests and the cache hits of the run.
+instrumentation = Instrumentation()
+
+def write_run_report():
+    instrumentation.write_json(args.report_file)
+    print(f"The run report has been written to {args.report_file}")
+    if args.openmetrics_file:
+        instrumentation.write_openmetrics(args.openmetrics_file)
+
+parser_options = dict(
+        debug=args.debug,
+        use_cache=use_cache,
+        max_concurrency=args.max_concurrency,
+        requests_per_second=args.requests_per_second,
+        streaming=args.streaming,
+        chunk_token_budget=args.chunk_token_budget)
+
+if args.dialects:
+    # Parse each dialect in a process of its own, and merge the results into one catalogue with a dialect column.
+    print(f"\n\nParsing the {', '.join(args.dialects)} source code ...")
+    driver = MultiDialectDriver([DIALECT_SOURCES[dialect] for dialect in args.dialects], parser_options=parser_options, batch_token_budget=args.batch_token_budget)
+    with instrumentation.stage('parse_dialects'):
+        ddl_statements_df, tables_df = driver.run()
+    print("\n\nDDL statements found in each dialect:")
+    print(ddl_statements_df.groupby(['dialect', 'sql_operation'], observed=True).size())
+    print(f"The catalogue has been written to {driver.results_directory}")
+    write_run_report()
+    print("Done.")
+    sys.exit(0)
+
 # Create SQL code parser.
+# The local, CPU bound work of the stages is shared by this pool of worker processes.
+worker_pool = WorkerPool(args.workers)
 sql_parser = SqlCodeParser(
         source_directory="source_code/sql_server", 
         source_file_glob_pattern="**/*.sql",
-        debug=args.debug,
-        use_cache=use_cache)
+        instrumentation=instrumentation,
+        worker_pool=worker_pool,
+        **parser_options)
+
+# The code index only embeds the batches of code that have changed since the last run.
+code_index = None
+if args.code_index or args.find_code:
+    print("\n\nIndexing the SQL code...")
+    code_index = CodeIndex(source_directory="source_code/sql_server", source_file_glob_pattern="**/*.sql",
+                           embedding=HashingEmbedding(n_features=args.code_index_features), instrumentation=instrumentation)
+    code_index.update()
+
+if args.find_code:
+    for code_match in code_index.find_code_touching(args.find_code, limit=20):
+        print(f"\n-- {code_match.path}, batch {code_match.batch_number} (score {code_match.score:.2f})")
+        print(code_match.code.strip())
+    write_run_report()
+    sys.exit(0)
 
 # Parse the SQL code and find the DDL statements
 # This returns cached results if the cache exists
@@ -46,20 +182,38 @@ table_names = ddl_statements_df[ddl_statements_df['sql_operation'] == 'CREATE TA
 print("Found tables:")
 print(table_names)
 
-# Create a map of procedures to tables
-# Note that this step also returns cached results if the cache exists.
-# todo: this needs tests
-print("\n\nMapping procedures to tables...")
-sp_to_table_mapper = StoredProcedureToTableMapper(sql_parser, use_cache=use_cache)
-tables_df = sp_to_table_mapper.map_procedures_to_tables(ddl_statements_df)
-print("The procedure map looks like the following:")
-print(tables_df.head())
-
-# Extract the services from the map of procedures to tables.
-# Note that this step also returns cached results if the cache exists.
-# todo: this needs tests
-service_extractor = ServiceExtractor(tables_df, use_cache=use_cache)
-service_definitions = service_extractor.extract()
+def create_service_extractor(tables_df):
+    if args.graph_services:
+        return GraphServiceExtractor(tables_df, use_cache=use_cache, instrumentation=instrumentation)
+    clustering_backend = MiniBatchKMeansBackend() if args.auto_clusters else None
+    return ServiceExtractor(tables_df, use_cache=use_cache, clustering_backend=clustering_backend, instrumentation=instrumentation)
+
+# The server uses the incremental updater to update the results when the source code changes.
+if args.incremental or args.serve:
+    incremental_updater = IncrementalUpdater(sql_parser, batch_token_budget=args.batch_token_budget, create_service_extractor=create_service_extractor, instrumentation=instrumentation)
+
+if args.incremental:
+    # Only map the procedures that have changed since the last run, and add them to the existing services.
+    print("\n\nUpdating the services incrementally...")
+    service_definitions = incremental_updater.update(ddl_statements_df)
+    tables_df = incremental_updater.tables_df
+    mapper = incremental_updater.mapper
+else:
+    # Create a map of procedures to tables
+    # Note that this step also returns cached results if the cache exists.
+    # todo: this needs tests
+    print("\n\nMapping procedures to tables...")
+    sp_to_table_mapper = StoredProcedureToTableMapper(sql_parser, use_cache=use_cache, batch_token_budget=args.batch_token_budget, instrumentation=instrumentation, code_index=code_index)
+    tables_df = sp_to_table_mapper.map_procedures_to_tables(ddl_statements_df)
+    mapper = sp_to_table_mapper
+    print("The procedure map looks like the following:")
+    print(tables_df.head())
+
+    # Extract the services from the map of procedures to tables.
+    # Note that this step also returns cached results if the cache exists.
+    # todo: this needs tests
+    service_extractor = create_service_extractor(tables_df)
+    service_definitions = service_extractor.extract()
 print("\n\nFound services:")
 for service_definition in service_definitions:
     print(service_definition)
@@ -67,7 +221,29 @@ for service_definition in service_definitions:
 # Generate diagrams for each service definition.
 # todo: this needs tests
 print("\n\nGenerating diagrams...")
-diagram_generator = DiagramGenerator()
+diagram_generator = DiagramGenerator(use_cache=use_cache, instrumentation=instrumentation, worker_pool=worker_pool)
 diagram_generator.generate(service_definitions)
 
+# Build the graph of the dependencies between the objects and services, and save it for --impact queries.
+# The graph of the last run is used if the source code, the procedure map and the services haven't changed.
+dependency_graph_fingerprint = DependencyGraph.fingerprint(sql_parser.source_fingerprint(), tables_df, service_definitions)
+dependency_graph = DependencyGraph.load(fingerprint=dependency_graph_fingerprint) if use_cache else None
+if use_cache:
+    instrumentation.record_cache('dependency_graph', dependency_graph is not None)
+if dependency_graph is None:
+    print("\n\nBuilding the dependency graph...")
+    dependency_graph = DependencyGraph.build(ddl_statements_df, tables_df, service_definitions, procedure_code_by_name=mapper.find_procedure_code(ddl_statements_df),
+                                             worker_pool=worker_pool, instrumentation=instrumentation)
+    dependency_graph.save(fingerprint=dependency_graph_fingerprint)
+
+write_run_report()
+
+if args.serve:
+    # Answer queries from the results in memory, and update them on request, until interrupted.
+    # e.g. curl http://localhost:8765/tables/Orders/services?operation=write
+    analysis_server = AnalysisServer(sql_parser, incremental_updater, port=args.port, diagram_generator=diagram_generator, worker_pool=worker_pool)
+    analysis_server.load(ddl_statements_df, tables_df, service_definitions, dependency_graph)
+    analysis_server.serve_forever()
+
+worker_pool.close()
 print("Done.")
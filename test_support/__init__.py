@@ -0,0 +1,4 @@
+"""
+Fakes and generated inputs shared by the tests in lib and the benchmarks, so that the pipeline can be run
+offline and without the tiktoken encoding.
+"""
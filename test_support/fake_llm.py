@@ -0,0 +1,134 @@
+"""
+A local stand in for the OpenAI chat model, for running the pipeline offline.
+
+The fake model answers the prompts sent by SqlCodeParser from the code in the prompt, with regular
+expressions, so the answers are deterministic and the same prompt always gets the same answer.  Each
+request is delayed by latency seconds, plus up to jitter seconds, to model the time taken by the API.
+"""
+import json
+import random
+import re
+import threading
+import time
+
+from langchain.schema import AIMessage, ChatGeneration, LLMResult
+
+DDL_PATTERN = re.compile(
+    r'\b(CREATE|ALTER|DROP)\s+(?:OR\s+ALTER\s+)?(TABLE|VIEW|PROCEDURE|PROC|FUNCTION|TRIGGER|INDEX)\s+'
+    r'(?:\w+\s+ON\s+)?(?:(?:"[^"]+"|\[[^\]]+\]|\w+)\.)?("[^"]+"|\[[^\]]+\]|\w+)',
+    re.IGNORECASE)
+DML_PATTERN = re.compile(
+    r'\b(?:(INSERT)\s+INTO|(UPDATE)|(DELETE)\s+FROM|FROM|JOIN)\s+("[^"]+"|\[[^\]]+\]|\w+)',
+    re.IGNORECASE)
+BATCH_PATTERN = re.compile(r'## PROCEDURE: (.+?) ##\n(.*?)(?=\n\n## PROCEDURE: |\Z)', re.DOTALL)
+
+
+def approximate_token_count(text):
+    """
+    Counts about one token for every four characters, which is close enough to tiktoken for benchmarking
+    and doesn't need the tiktoken encoding to be downloaded.
+    """
+    return len(text) // 4
+
+
+def _unquote(name):
+    return name.strip('"[]')
+
+
+def find_ddl_statements(sql_code):
+    operations = {'PROC': 'PROCEDURE'}
+    return [
+        {"db_object_name": _unquote(name), "sql_operation": f"{operation.upper()} {operations.get(object_type.upper(), object_type.upper())}"}
+        for operation, object_type, name in DDL_PATTERN.findall(sql_code)
+    ]
+
+
+def find_tables(sql_code):
+    tables = []
+    for insert, update, delete, name in DML_PATTERN.findall(sql_code):
+        sql_operation = insert or update or delete or 'SELECT'
+        table = {"table_name": _unquote(name), "sql_operation": sql_operation.upper()}
+        if table not in tables:
+            tables.append(table)
+    return tables
+
+
+class FakeChatModel:
+    """
+    Answers the DDL statement, procedure table and batch procedure table prompts of the SqlCodeParser.
+
+    Like the OpenAI chat model, it reports the prompt and completion token counts of each request, which
+    are counted with count_tokens.  The number of requests and tokens are kept in calls, prompt_tokens and
+    completion_tokens.
+    """
+
+    model_name = 'fake-chat-model'
+
+    def __init__(self, latency=0.0, jitter=0.0, seed=0, count_tokens=approximate_token_count) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.count_tokens = count_tokens
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+
+    def _answer(self, messages):
+        system_message = messages[0].content
+        code = messages[-1].content
+        if '## PROCEDURE: <name> ##' in system_message:
+            return {name: find_tables(body) for name, body in BATCH_PATTERN.findall(code)}
+        if 'stored procedure' in system_message:
+            return find_tables(code)
+        return find_ddl_statements(code)
+
+
+    def _delay(self):
+        with self.lock:
+            delay = self.latency + self.random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+
+    def generate(self, messages_list):
+        generations = []
+        prompt_tokens = completion_tokens = 0
+        for messages in messages_list:
+            self._delay()
+            content = json.dumps(self._answer(messages))
+            generations.append([ChatGeneration(message=AIMessage(content=content))])
+            prompt_tokens += sum(self.count_tokens(message.content) for message in messages)
+            completion_tokens += self.count_tokens(content)
+
+        with self.lock:
+            self.calls += len(messages_list)
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+        return LLMResult(generations=generations, llm_output={
+            'token_usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens},
+            'model_name': self.model_name,
+        })
+
+
+    def __call__(self, messages):
+        return self.generate([messages]).generations[0][0].message
+
+
+class FakeTableChatModel:
+    """
+    Answers every prompt with the tables updated and selected by the code in it, found with simple regular
+    expressions, e.g. UPDATE Orders and FROM Orders.  The number of requests is kept in calls.  It is
+    defined at module level so that it can be sent to worker processes.
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, messages):
+        self.calls += 1
+        code = messages[-1].content
+        tables = [{"table_name": t, "sql_operation": "UPDATE"} for t in re.findall(r'UPDATE (\w+)', code)]
+        tables += [{"table_name": t, "sql_operation": "SELECT"} for t in re.findall(r'FROM (\w+)', code)]
+        return AIMessage(content=json.dumps(tables))
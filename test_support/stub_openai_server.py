@@ -0,0 +1,79 @@
+"""
+A local HTTP server that answers OpenAI chat completion requests, for measuring the client side overhead
+of each request without the network or the model.
+
+Every request gets the same response after latency seconds.  The server counts the requests and the
+connections it accepts, which shows whether the client reuses its connections.
+"""
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RESPONSE = {
+    'id': 'chatcmpl-stub',
+    'object': 'chat.completion',
+    'created': 0,
+    'model': 'gpt-3.5-turbo',
+    'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': '[]'}, 'finish_reason': 'stop'}],
+    'usage': {'prompt_tokens': 100, 'completion_tokens': 1, 'total_tokens': 101},
+}
+
+
+class StubOpenAiServer:
+    """
+    Serves chat completions on a free port of localhost, on a background thread, e.g.
+
+        with StubOpenAiServer() as server:
+            ChatOpenAI(openai_api_base=server.api_base, openai_api_key='stub')
+    """
+
+    def __init__(self, latency=0.0) -> None:
+        self.latency = latency
+        self.requests = 0
+        self.connections = 0
+        self.lock = threading.Lock()
+        stub = self
+        body = json.dumps(RESPONSE).encode('utf-8')
+
+        class Handler(BaseHTTPRequestHandler):
+            # HTTP/1.1, so that connections are kept alive between requests.
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                # Send the headers and the body without waiting for an acknowledgement in between.
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                with stub.lock:
+                    stub.connections += 1
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                with stub.lock:
+                    stub.requests += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.api_base = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,105 @@
+"""
+Generates synthetic SQL Server schemas of any size, for testing and benchmarking the pipeline, and
+synthetic procedure to table maps for testing the service extractors.
+
+The tables are divided into domains, e.g. Domain3_Table17, and each procedure reads a few tables and
+writes one table of its own domain, with the occasional read from another domain, so the schemas have
+service boundaries for the clustering stage to find.  The same arguments always generate the same code.
+"""
+import os
+import random
+
+import pandas as pd
+
+OBJECTS_PER_FILE = 1000
+
+
+def table_name(domain, table):
+    return f"Domain{domain}_Table{table}"
+
+
+def _create_table(name):
+    return (
+        f'CREATE TABLE "{name}" (\n'
+        f'    "ID" int IDENTITY (1, 1) NOT NULL,\n'
+        f'    "Name" nvarchar (40) NOT NULL,\n'
+        f'    "Updated" datetime NULL,\n'
+        f'    CONSTRAINT "PK_{name}" PRIMARY KEY CLUSTERED ("ID")\n'
+        f')\nGO\n\n'
+    )
+
+
+def _create_procedure(name, read_tables, write_table):
+    reads = "\n".join(
+        f'SELECT "ID", "Name" FROM "{read_table}" WHERE "ID" = @ID' for read_table in read_tables
+    )
+    return (
+        f'CREATE PROCEDURE "{name}" @ID int\nAS\n'
+        f'SET NOCOUNT ON\n'
+        f'{reads}\n'
+        f'UPDATE "{write_table}" SET "Updated" = GETDATE() WHERE "ID" = @ID\n'
+        f'GO\n\n'
+    )
+
+
+def generate_schema(number_of_procedures, number_of_tables=None, tables_per_domain=20, seed=0):
+    """
+    Yields the CREATE TABLE and CREATE PROCEDURE statements of a synthetic schema, one at a time.
+    There are as many tables as procedures unless number_of_tables is given.
+    """
+    rng = random.Random(seed)
+    number_of_tables = number_of_tables or number_of_procedures
+    number_of_domains = max(1, number_of_tables // tables_per_domain)
+    tables = [table_name(i % number_of_domains, i // number_of_domains) for i in range(number_of_tables)]
+    tables_by_domain = [tables[domain::number_of_domains] for domain in range(number_of_domains)]
+
+    for name in tables:
+        yield _create_table(name)
+
+    for i in range(number_of_procedures):
+        domain_tables = tables_by_domain[i % number_of_domains]
+        read_tables = rng.sample(domain_tables, min(2, len(domain_tables)))
+        if rng.random() < 0.1:
+            read_tables.append(rng.choice(tables))
+        yield _create_procedure(f"Proc{i}", read_tables, rng.choice(domain_tables))
+
+
+def write_schema(directory, number_of_procedures, number_of_tables=None, seed=0):
+    """
+    Writes a synthetic schema to .sql files in the directory, OBJECTS_PER_FILE objects per file.
+    Returns the paths of the files.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    statements = []
+
+    def flush():
+        path = os.path.join(directory, f"schema_{len(paths):04d}.sql")
+        with open(path, 'w') as file:
+            file.write("".join(statements))
+        paths.append(path)
+        statements.clear()
+
+    for statement in generate_schema(number_of_procedures, number_of_tables, seed=seed):
+        statements.append(statement)
+        if len(statements) == OBJECTS_PER_FILE:
+            flush()
+    if statements:
+        flush()
+    return paths
+
+
+def make_tables_df(services=3, procedures_per_service=10, shared_lookups=("Shared_Lookup",)):
+    """
+    Returns a procedure to table map in which the procedures of each service write a table of their own
+    and read a lookup table of their own, and every procedure reads the shared_lookups.
+    """
+    rows = []
+    for service in range(services):
+        for procedure in range(procedures_per_service):
+            procedure_name = f"Service{service}_Proc{procedure}"
+            rows.append((f"Table{service}", 'UPDATE', 'WRITE', procedure_name))
+            rows.append((f"Table{service}_Lookup", 'SELECT', 'READ', procedure_name))
+            for shared_lookup in shared_lookups:
+                rows.append((shared_lookup, 'SELECT', 'READ', procedure_name))
+    return pd.DataFrame(rows, columns=['table_name', 'sql_operation', 'operation_type', 'procedure_name'])